@@ -619,6 +619,37 @@ def extract(dset, *d_slices):
     return array
 
 
+def memmap(fname, key):
+    """
+    Read a dataset by mapping it in memory in copy-on-write mode: processes
+    on the same machine reading the same file share the same physical
+    pages, so there is a single copy of the data even with many workers,
+    and changes to the array are private to the process and never
+    written to the file. Chunked datasets and datasets with
+    variable-length fields are read normally.
+
+    :param fname: path to an HDF5 file
+    :param key: path to a dataset inside the file
+    :returns: an array or an object built with __fromh5__
+    """
+    with File(fname, 'r') as f:
+        dset = f.getitem(key)
+        offset = dset.id.get_offset()
+        if (offset is None or dset.chunks or dset.dtype.hasobject or
+                dset.size == 0):
+            obj = f[key]
+            return obj[()] if isinstance(obj, h5py.Dataset) else obj
+        attrs = dict(dset.attrs)
+        array = numpy.memmap(fname, dset.dtype, 'c', offset, dset.shape)
+    array = array.view(numpy.ndarray)  # plain array backed by the mmap
+    if '__pyclass__' in attrs:
+        cls = dotname2cls(attrs['__pyclass__'])
+        obj = cls.__new__(cls)
+        obj.__fromh5__(array, attrs)
+        return obj
+    return array
+
+
 def parse_comment(comment):
     """
     Parse a comment of the form
@@ -82,6 +82,19 @@ available at the moment:
 `OQ_DISTRIBUTE` set tp "zmq"
    use the zmq concurrency mechanism (experimental)
 
+The order in which the queued tasks (i.e. the ones in `Starmap.submit_all`
+and the subtasks produced by other tasks) are sent is controlled by the
+`scheduler` parameter in the section `distribution` of openquake.cfg:
+
+`scheduler = fifo` (the default)
+  the tasks are sent in the order they were queued
+`scheduler = lpt`
+  the heaviest tasks are sent first (Longest Processing Time order) and
+  only when a core is free; moreover, when there are idle cores and
+  few tasks in the queue, the heaviest queued task is split in
+  smaller tasks, by using the time per unit of weight measured on the
+  tasks already completed
+
 There is also an `OQ_DISTRIBUTE` = "threadpool"; however the
 performance of using threads instead of processes is normally bad for the
 kind of applications we are interested in (CPU-dominated, which large
@@ -204,17 +217,18 @@ except ImportError:
         "Do nothing"
 
 from openquake.baselib import config, hdf5, workerpool, __version__
-from openquake.baselib.zeromq import zmq, Socket
+from openquake.baselib.zeromq import zmq, Socket, OOB, oob_callback
 from openquake.baselib.performance import (
-    Monitor, memory_rss, init_performance)
+    Monitor, Sampler, memory_rss, init_performance, SAMPLING_INTERVAL)
 from openquake.baselib.general import (
     split_in_blocks, block_splitter, AccumDict, humansize, CallableDict,
-    gettemp)
+    gettemp, WeightedSequence)
 
 sys.setrecursionlimit(1200)  # raised a bit to make pickle happier
 # see https://github.com/gem/oq-engine/issues/5230
 submit = CallableDict()
 GB = 1024 ** 3
+MIN_SPLIT_TIME = 10  # queued tasks expected to be faster are not split
 # use only the "visible" cores, not the total system cores
 # if the underlying OS supports it (macOS does not)
 try:
@@ -279,27 +293,50 @@ class Pickled(object):
     have a nice string representation and length giving the size
     of the pickled bytestring.
 
+    If `oob` is true (and the pickle protocol 5 is available) the big
+    NumPy arrays are not copied inside the bytestring but kept as
+    out-of-band buffers, which are sent as separate frames by a multipart
+    :class:`openquake.baselib.zeromq.Socket`.
+
     :param obj: the object to pickle
+    :param oob: if True, use out-of-band buffers
     """
-    def __init__(self, obj):
+    buffers = ()  # for objects pickled by an older version
+
+    def __init__(self, obj, oob=False):
         self.clsname = obj.__class__.__name__
         self.calc_id = str(getattr(obj, 'calc_id', ''))  # for monitors
+        self.buffers = []
         try:
-            self.pik = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+            if oob and OOB:
+                self.pik = pickle.dumps(
+                    obj, 5, buffer_callback=oob_callback(self.buffers))
+            else:
+                self.pik = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
         except TypeError as exc:  # can't pickle, show the obj in the message
             raise TypeError('%s: %s' % (exc, obj))
 
+    def __reduce_ex__(self, protocol):
+        state = vars(self).copy()
+        if protocol < 5 and self.buffers:  # the buffers must be copied
+            state['buffers'] = [bytes(memoryview(buf))
+                                for buf in self.buffers]
+        return object.__new__, (self.__class__,), state
+
     def __repr__(self):
         """String representation of the pickled object"""
         return '<Pickled %s #%s %s>' % (
             self.clsname, self.calc_id, humansize(len(self)))
 
     def __len__(self):
-        """Length of the pickled bytestring"""
-        return len(self.pik)
+        """Length of the pickled bytestring plus the out-of-band buffers"""
+        return len(self.pik) + sum(
+            memoryview(buf).nbytes for buf in self.buffers)
 
     def unpickle(self):
         """Unpickle the underlying object"""
+        if self.buffers:
+            return pickle.loads(self.pik, buffers=self.buffers)
         return pickle.loads(self.pik)
 
 
@@ -369,17 +406,18 @@ class Result(object):
 
     def __init__(self, val, mon, tb_str='', msg=''):
         if isinstance(val, dict):
-            self.pik = Pickled(val)
+            self.pik = Pickled(val, oob=True)
             self.nbytes = {k: len(Pickled(v)) for k, v in val.items()}
         elif isinstance(val, tuple) and callable(val[0]):
             self.func = val[0]
+            self.weight = getattr(val[1], 'weight', 1.)
             self.pik = pickle_sequence(val[1:])
             self.nbytes = {'args': sum(len(p) for p in self.pik)}
         elif msg == 'TASK_ENDED':
             self.pik = Pickled(None)
             self.nbytes = {}
         else:
-            self.pik = Pickled(val)
+            self.pik = Pickled(val, oob=True)
             self.nbytes = {'tot': len(self.pik)}
         self.mon = mon
         self.tb_str = tb_str
@@ -474,8 +512,9 @@ def safely_call(func, args, task_no=0, mon=dummy_mon):
     mon.task_no = task_no
     if mon.inject:
         args += (mon,)
+    sampler = Sampler(mon.profile).start() if mon.profile else None
     sentbytes = 0
-    with Socket(mon.backurl, zmq.PUSH, 'connect') as zsocket:
+    with Socket(mon.backurl, zmq.PUSH, 'connect', multipart=True) as zsocket:
         msg = check_mem_usage()  # warn if too much memory is used
         if msg:
             zsocket.send(Result(None, mon, msg=msg))
@@ -488,6 +527,8 @@ def safely_call(func, args, task_no=0, mon=dummy_mon):
         while True:
             # StopIteration -> TASK_ENDED
             res = Result.new(next, (it,), mon, sentbytes)
+            if sampler and res.msg == 'TASK_ENDED':
+                mon.task_profile = sampler.stop()  # sent back with res
             try:
                 zsocket.send(res)
             except Exception:  # like OverflowError
@@ -564,6 +605,8 @@ class IterResult(object):
                 self.h5['task_sent'] = str(task_sent)
                 name = result.mon.operation[6:]  # strip 'total '
                 result.mon.save_task_info(self.h5, result, name, mem_gb)
+                if hasattr(result.mon, 'task_profile'):
+                    result.mon.save_task_profile(self.h5, name)
                 result.mon.flush(self.h5)
                 self.h5.flush()
             elif not result.func:  # real output
@@ -711,8 +754,12 @@ class Starmap(object):
         ).submit_all()
 
     def __init__(self, task_func, task_args=(), distribute=None,
-                 progress=logging.info, h5=None, num_cores=None):
+                 progress=logging.info, h5=None, num_cores=None,
+                 scheduler=None):
         self.__class__.init(distribute=distribute)
+        self.scheduler = scheduler or config.distribution.scheduler
+        if self.scheduler not in ('fifo', 'lpt'):
+            raise ValueError('Unknown scheduler %r' % self.scheduler)
         self.task_func = task_func
         if h5:
             match = re.search(r'(\d+)', os.path.basename(h5.filename))
@@ -723,12 +770,18 @@ class Starmap(object):
             init_performance(h5)
         self.monitor = Monitor(task_func.__name__)
         self.monitor.calc_id = self.calc_id
+        if 'task_profile' in h5:  # set by the parameter profile_tasks
+            self.monitor.profile = SAMPLING_INTERVAL
         self.name = self.monitor.operation or task_func.__name__
         self.task_args = task_args
         self.progress = progress
         self.h5 = h5
         self.num_cores = num_cores
-        self.task_queue = []
+        self.task_queue = []  # triples (func, args, weight)
+        self.tot_weight = 0  # weight of the completed tasks
+        self.tot_time = 0  # time spent in the completed tasks
+        self.sched_mon = Monitor('scheduling ' + self.name)
+        self.split_mon = Monitor('splitting queued ' + self.name)
         try:
             self.num_tasks = len(self.task_args)
         except TypeError:  # generators have no len
@@ -809,8 +862,9 @@ class Starmap(object):
             for args in self.task_args:
                 self.submit(args)
         else:  # build a task queue in advance
-            self.task_queue = [(self.task_func, args)
-                               for args in self.task_args]
+            self.task_queue = [
+                (self.task_func, args, getattr(args[0], 'weight', 1.))
+                for args in self.task_args]
         return self.get_results()
 
     def get_results(self):
@@ -829,21 +883,62 @@ class Starmap(object):
     def __iter__(self):
         return iter(self.submit_all())
 
+    def _pop(self):
+        # remove a task from the queue, in FIFO or LPT order
+        if self.scheduler == 'lpt':
+            with self.sched_mon:
+                i = max(range(len(self.task_queue)),
+                        key=lambda i: self.task_queue[i][2])
+        else:
+            i = 0
+        func, args, weight = self.task_queue.pop(i)
+        return func, args
+
     def _submit_many(self, howmany):
         for _ in range(howmany):
             if self.task_queue:
-                # remove in LIFO order
-                func, args = self.task_queue[0]
-                del self.task_queue[0]
+                func, args = self._pop()
                 self.submit(args, func=func)
                 self.todo += 1
 
+    def _split_queued(self, free):
+        # split the heaviest queued task if there are more free cores than
+        # queued tasks and the task is expected to take at least
+        # MIN_SPLIT_TIME seconds; only tasks with a WeightedSequence
+        # as first argument are split
+        queued = len(self.task_queue)
+        if not queued or queued >= free or not self.tot_weight:
+            return
+        i = max(range(queued), key=lambda i: self.task_queue[i][2])
+        func, args, weight = self.task_queue[i]
+        if weight * self.tot_time / self.tot_weight < MIN_SPLIT_TIME:
+            return
+        pickled = isinstance(args[0], Pickled)
+        seq = args[0].unpickle() if pickled else args[0]
+        if not isinstance(seq, WeightedSequence) or len(seq) < 2:
+            return
+        with self.split_mon:
+            blocks = [WeightedSequence() for _ in range(
+                min(free - queued + 1, len(seq)))]
+            for item in sorted(seq, key=lambda it: getattr(it, 'weight', 1.),
+                               reverse=True):
+                min(blocks).append((item, getattr(item, 'weight', 1.)))
+            tot = sum(blk.weight for blk in blocks) or 1.
+            del self.task_queue[i]
+            for blk in blocks:
+                # rescale to the weight of the original task
+                blk.weight = blk.weight / tot * weight
+                arg0 = Pickled(blk) if pickled else blk
+                self.task_queue.append(
+                    (func, [arg0] + list(args[1:]), blk.weight))
+        logging.debug('Split a queued task of weight %d in %d tasks',
+                      weight, len(blocks))
+
     def _loop(self):
         num_cores = self.num_cores or CT // 2
         if self.task_queue:
-            first_args = self.task_queue[:num_cores]
-            self.task_queue[:] = self.task_queue[num_cores:]
-            for func, args in first_args:
+            for _ in range(min(num_cores, len(self.task_queue))):
+                func, args = self._pop()
                 self.submit(args, func=func)
         if not hasattr(self, 'socket'):  # no submit was ever made
             return ()
@@ -858,13 +953,22 @@ class Starmap(object):
                                 'is job %d', res.mon.calc_id, self.calc_id)
             elif res.msg == 'TASK_ENDED':
                 self.todo -= 1
-                self._submit_many(1)
+                if self.scheduler == 'lpt':
+                    # update the time per unit of weight
+                    self.tot_weight += res.mon.weight
+                    self.tot_time += res.mon.duration
+                    self._split_queued(num_cores - self.todo)
+                    self._submit_many(num_cores - self.todo)
+                else:
+                    self._submit_many(1)
                 logging.debug('%d tasks todo, %d in queue',
                               self.todo, len(self.task_queue))
                 yield res
             elif res.func:  # add subtask
-                self.task_queue.append((res.func, res.pik))
-                if self.num_cores is None:
+                self.task_queue.append((res.func, res.pik, res.weight))
+                if self.scheduler == 'lpt':  # submit only to free cores
+                    self._submit_many(num_cores - self.todo)
+                elif self.num_cores is None:
                     self._submit_many(1)  # oversubmit
                 elif self.todo < self.num_cores:
                     self._submit_many(self.num_cores - self.todo)
@@ -873,6 +977,9 @@ class Starmap(object):
         self.log_percent()
         self.socket.__exit__(None, None, None)
         self.tasks.clear()
+        if self.scheduler == 'lpt':  # record the scheduling decisions
+            self.sched_mon.flush(self.h5)
+            self.split_mon.flush(self.h5)
 
 
 def sequential_apply(task, args, concurrent_tasks=CT,
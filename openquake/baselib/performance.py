@@ -19,6 +19,7 @@
 import os
 import time
 import getpass
+import threading
 import operator
 import itertools
 from datetime import datetime
@@ -39,11 +40,19 @@ task_info_dt = numpy.dtype(
     [('taskname', '<S50'), ('task_no', numpy.uint32),
      ('weight', numpy.float32), ('duration', numpy.float32),
      ('received', numpy.int64), ('mem_gb', numpy.float32)])
+task_profile_dt = numpy.dtype(
+    [('taskname', '<S50'), ('task_no', numpy.uint32),
+     ('time_sec', numpy.float32), ('rss_mb', numpy.float32),
+     ('cpu_pct', numpy.float32), ('operation', '<S50')])
+SAMPLING_INTERVAL = .5  # seconds between two samples of the task profiler
+_operations = []  # stack of the operations being profiled in the process
 
 
-def init_performance(hdf5file, swmr=False):
+def init_performance(hdf5file, swmr=False, profile=False):
     """
     :param hdf5file: file name of hdf5.File instance
+    :param swmr: if True, set the file in SWMR mode
+    :param profile: if True, create also the task_profile dataset
     """
     fname = isinstance(hdf5file, str)
     h5 = hdf5.File(hdf5file) if fname else hdf5file
@@ -53,6 +62,8 @@ def init_performance(hdf5file, swmr=False):
         hdf5.create(h5, 'task_info', task_info_dt)
     if 'task_sent' not in h5:
         h5['task_sent'] = '{}'
+    if profile and 'task_profile' not in h5:
+        hdf5.create(h5, 'task_profile', task_profile_dt)
     if swmr:
         try:
             h5.swmr_mode = True
@@ -105,6 +116,61 @@ def memory_rss(pid):
     return psutil.Process(pid).memory_info().rss
 
 
+class Sampler(object):
+    """
+    Sample the RSS memory and the CPU usage of the current process
+    every `interval` seconds in a background thread, together with
+    the innermost operation being monitored. Used by the workers when
+    the parameter `profile_tasks` is set, as follows::
+
+     sampler = Sampler(.5).start()
+     do_something()
+     samples = sampler.stop()
+
+    :param interval: sampling interval in seconds
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self.samples = []
+        self.proc = psutil.Process()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        try:
+            rss = self.proc.memory_info().rss
+            cpu = self.proc.cpu_percent()
+        except psutil.AccessDenied:
+            # no access to information about this process
+            rss = cpu = 0
+        operation = _operations[-1] if _operations else ''
+        self.samples.append((time.time() - self.t0, rss / 1024. / 1024.,
+                             cpu, operation))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        """
+        Start the sampling thread and return the sampler itself
+        """
+        self.t0 = time.time()
+        self._sample()  # the first CPU measurement is always 0
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop the sampling thread and return the samples as a list of tuples
+        (time_sec, rss_mb, cpu_pct, operation)
+        """
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        return self.samples
+
+
 # this is not thread-safe
 class Monitor(object):
     """
@@ -135,6 +201,7 @@ class Monitor(object):
     address = None
     authkey = None
     calc_id = None
+    profile = 0  # sampling interval of the task profiler, 0 means disabled
 
     def __init__(self, operation='', measuremem=False, inner_loop=False,
                  h5=None):
@@ -191,10 +258,14 @@ class Monitor(object):
         self._start_time = time.time()
         if self.measuremem:
             self.start_mem = self.measure_mem()
+        if self.profile:
+            _operations.append(self.operation)
         return self
 
     def __exit__(self, etype, exc, tb):
         self.exc = exc
+        if self.profile and _operations:
+            _operations.pop()
         if self.measuremem:
             self.stop_mem = self.measure_mem()
             self.mem += self.stop_mem - self.start_mem
@@ -219,6 +290,18 @@ class Monitor(object):
         hdf5.extend(h5['task_info'], data)
         h5['task_info'].flush()  # notify the reader
 
+    def save_task_profile(self, h5, name):
+        """
+        Called by parallel.IterResult if the task was profiled.
+
+        :param h5: where to save the samples
+        :param name: name of the task function
+        """
+        samples = [(name, self.task_no) + tup for tup in self.task_profile]
+        data = numpy.array(samples, task_profile_dt)
+        hdf5.extend(h5['task_profile'], data)
+        h5['task_profile'].flush()  # notify the reader
+
     def reset(self):
         """
         Reset duration, mem, counts
@@ -22,6 +22,7 @@ import sys
 import unittest
 import tempfile
 import numpy
+from openquake.baselib import hdf5
 from openquake.baselib.datastore import DataStore, read
 
 
@@ -61,6 +62,19 @@ class DataStoreTestCase(unittest.TestCase):
         self.dstore['a/b'] = 42
         self.assertTrue('a/b' in self.dstore)
 
+    def test_memmap(self):
+        fname = tempfile.mktemp(suffix='.hdf5')
+        arr = numpy.array([(1, 2.), (3, 4.)], [('a', int), ('b', float)])
+        with hdf5.File(fname, 'w') as h5:
+            h5['arr'] = arr
+            h5['str'] = numpy.array(['x', 'yy'])  # variable-length
+        mapped = hdf5.memmap(fname, 'arr')
+        numpy.testing.assert_equal(mapped, arr)
+        mapped['a'] = 0  # copy-on-write, the file is not changed
+        numpy.testing.assert_equal(hdf5.memmap(fname, 'arr'), arr)
+        self.assertEqual(list(hdf5.memmap(fname, 'str')), ['x', 'yy'])
+        os.remove(fname)
+
     def test_export_path(self):
         path = self.dstore.export_path('hello.txt', tempfile.mkdtemp())
         mo = re.search(r'hello_\d+', path)
@@ -17,6 +17,7 @@
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import pickle
 import unittest.mock as mock
 import time
 import shutil
@@ -36,6 +37,10 @@ def get_length(data, monitor):
     return {'n': len(data)}
 
 
+def get_arange(n, monitor):
+    return {'arr': numpy.arange(n, dtype=float)}
+
+
 def gfunc(text, monitor):
     for char in text:
         yield char * 3
@@ -89,6 +94,24 @@ class StarmapTestCase(unittest.TestCase):
         partial_sums = sorted(dic['n'] for dic in res)
         self.assertEqual(partial_sums, [2, 3])
 
+    def test_apply_big_arrays(self):
+        # the arrays are sent as out-of-band buffers
+        smap = parallel.Starmap(get_arange, [(100_000,), (10,)])
+        res = smap.reduce(lambda acc, dic: acc + [dic['arr']], [])
+        self.assertEqual(sorted(len(arr) for arr in res), [10, 100_000])
+        for arr in res:
+            numpy.testing.assert_equal(arr, numpy.arange(len(arr)))
+
+    def test_pickled_oob(self):
+        arr = numpy.arange(100_000, dtype=float)
+        pik = parallel.Pickled({'arr': arr}, oob=True)
+        if parallel.OOB:
+            self.assertEqual(len(pik.buffers), 1)
+            self.assertGreater(len(pik), arr.nbytes)
+        # pickling with an old protocol copies the buffers
+        pik = pickle.loads(pickle.dumps(pik, 4))
+        numpy.testing.assert_equal(pik.unpickle()['arr'], arr)
+
     def test_apply_maxweight(self):
         res = parallel.Starmap.apply(
             get_length, ('aaabb',), maxweight=2,
@@ -143,6 +166,52 @@ class StarmapTestCase(unittest.TestCase):
             self.assertGreater(dic[b'supertask'], 0)
         shutil.rmtree(tmpdir)
 
+    def test_supertask_lpt(self):
+        allargs = [('aaaaeeeeiii',), ('aaaaeeeeiiiiiooooooo',)]
+        tmpdir = tempfile.mkdtemp()
+        tmp = os.path.join(tmpdir, 'calc_1.hdf5')
+        performance.init_performance(tmp, swmr=True)
+        smap = parallel.Starmap(supertask, allargs, h5=hdf5.File(tmp, 'a'),
+                                scheduler='lpt')
+        res = smap.reduce()
+        smap.h5.close()
+        self.assertEqual(res, {'n': 31})
+        with hdf5.File(tmp, 'r') as h5:
+            num = general.countby(h5['performance_data'][()], 'operation')
+            self.assertEqual(num[b'total get_length'], 8)  # subtasks
+            self.assertIn(b'scheduling supertask', num)
+        shutil.rmtree(tmpdir)
+
+    def test_task_profile(self):
+        allargs = [('aaaaeeeeiii',), ('aaaaeeeeiiiiiooooooo',)]
+        tmpdir = tempfile.mkdtemp()
+        tmp = os.path.join(tmpdir, 'calc_1.hdf5')
+        performance.init_performance(tmp, swmr=True, profile=True)
+        smap = parallel.Starmap(supertask, allargs, h5=hdf5.File(tmp, 'a'))
+        res = smap.reduce()
+        smap.h5.close()
+        self.assertEqual(res, {'n': 31})
+        with hdf5.File(tmp, 'r') as h5:
+            prof = h5['task_profile'][()]
+        # at least two samples (start and stop) per task and subtask
+        num = general.countby(prof, 'taskname')
+        self.assertGreaterEqual(num[b'supertask'], 4)
+        self.assertGreaterEqual(num[b'get_length'], 8)
+        self.assertGreater(prof['rss_mb'].min(), 0)
+        shutil.rmtree(tmpdir)
+
+    def test_split_queued(self):
+        smap = parallel.Starmap(get_length, distribute='no', scheduler='lpt')
+        block = general.WeightedSequence([(c, 1) for c in 'abcdefg'])
+        smap.task_queue = [(get_length, [block], 70.),
+                           (get_length, ['xy'], 2.)]
+        smap.tot_weight, smap.tot_time = 1., 1.  # 1 second per weight
+        smap._split_queued(4)  # 4 free cores, 2 queued tasks
+        weights = sorted(w for f, a, w in smap.task_queue)
+        self.assertEqual(weights, [2., 20., 20., 30.])
+        chars = sorted(c for f, a, w in smap.task_queue[1:] for c in a[0])
+        self.assertEqual(''.join(chars), 'abcdefg')
+
     def test_countletters(self):
         data = [('hello', 'world'), ('ciao', 'mondo')]
         smap = parallel.Starmap(countletters, data)
@@ -16,11 +16,16 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
 import re
-import zmq
+import pickle
 import logging
+import zmq
 
 context = zmq.Context()
 
+# pickle protocol 5 supports out-of-band buffers (Python >= 3.8)
+OOB = pickle.HIGHEST_PROTOCOL >= 5
+MIN_OOB_SIZE = 65536  # smaller buffers are kept inside the pickle
+
 # from integer socket_type to string
 SOCKTYPE = {zmq.REQ: 'REQ', zmq.REP: 'REP',
             zmq.PUSH: 'PUSH', zmq.PULL: 'PULL',
@@ -55,6 +60,49 @@ def connect(end_point, socket_type):
     return sock
 
 
+def dumps(obj):
+    """
+    Serialize an object into a list of frames: a pickle header followed by
+    the raw buffers of the out-of-band objects, typically NumPy arrays.
+
+    :param obj: a picklable object
+    :returns: a list of bytes-like objects
+    """
+    if not OOB:
+        return [pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)]
+    buffers = []
+    header = pickle.dumps(obj, 5, buffer_callback=oob_callback(buffers))
+    return [header] + [buf.raw() for buf in buffers]
+
+
+def oob_callback(buffers):
+    """
+    :param buffers: a list to be populated with PickleBuffer objects
+    :returns: a buffer_callback for pickle.dumps keeping out-of-band
+              only the buffers bigger than MIN_OOB_SIZE
+    """
+    def callback(buf):
+        if buf.raw().nbytes < MIN_OOB_SIZE:
+            return True  # in-band
+        buffers.append(buf)
+    return callback
+
+
+def loads(frames):
+    """
+    Reconstruct an object from the frames returned by
+    `recv_multipart(copy=False)`; the out-of-band buffers are not copied,
+    so the NumPy arrays are read-only views over the received messages.
+
+    :param frames: a list of zmq.Frame objects
+    :returns: the original object
+    """
+    if len(frames) == 1:  # sent with send_pyobj or without buffers
+        return pickle.loads(frames[0].buffer)
+    return pickle.loads(frames[0].buffer,
+                        buffers=[frame.buffer for frame in frames[1:]])
+
+
 class Socket(object):
     """
     A Socket class to be used with code like the following::
@@ -70,12 +118,18 @@ class Socket(object):
 
     It also support zmq.PULL/zmq.PUSH sockets, which are asynchronous.
 
+    If `multipart` is true the objects are sent as multipart messages (see
+    :func:`dumps`) and the buffers of the NumPy arrays are not pickled.
+    The receiving side understands both formats.
+
     :param end_point: zmq end point string
     :param socket_type: zmq socket type (integer)
     :param mode: default 'bind', accepts also 'connect'
     :param timeout: default 5000 ms, used when polling the underlying socket
+    :param multipart: default False, use the multipart framing when sending
     """
-    def __init__(self, end_point, socket_type, mode, timeout=5000):
+    def __init__(self, end_point, socket_type, mode, timeout=5000,
+                 multipart=False):
         assert socket_type in (zmq.REP, zmq.REQ, zmq.PULL, zmq.PUSH)
         assert mode in ('bind', 'connect'), mode
         if mode == 'bind':
@@ -84,6 +138,7 @@ class Socket(object):
         self.socket_type = socket_type
         self.mode = mode
         self.timeout = timeout
+        self.multipart = multipart
         self.running = False
 
     def __enter__(self):
@@ -125,7 +180,7 @@ class Socket(object):
         while self.running:
             try:
                 if self.zsocket.poll(self.timeout):
-                    yield self.zsocket.recv_pyobj()
+                    yield self.recv()
                 elif self.socket_type == zmq.PULL:
                     logging.debug('Waiting on %s:%d', self, self.port)
             except zmq.ZMQError:
@@ -141,13 +196,24 @@ class Socket(object):
             the Python object to send
         """
         try:
-            self.zsocket.send_pyobj(obj)
+            if self.multipart:
+                # the frames are copied, so the arrays can be modified later
+                self.zsocket.send_multipart(dumps(obj))
+            else:
+                self.zsocket.send_pyobj(obj)
         except Exception as exc:
             # usual for objects bigger than 4 GB
             raise exc.__class__('%s: %r' % (exc, obj))
         self.num_sent += 1
         if self.socket_type == zmq.REQ:
-            return self.zsocket.recv_pyobj()
+            return self.recv()
+
+    def recv(self):
+        """
+        Receive an object sent either with send_pyobj or with the
+        multipart framing
+        """
+        return loads(self.zsocket.recv_multipart(copy=False))
 
     def __repr__(self):
         return '<%s %s %s>' % (self.__class__.__name__,
@@ -145,6 +145,7 @@ def set_array(longarray, shortarray):
 
 
 MAXSITES = 1000
+MAX_GMF_ROWS = 1_000_000  # max number of GMF rows read at once
 CORRELATION_MATRIX_TOO_LARGE = '''\
 You have a correlation matrix which is too large: %%d sites > %d.
 To avoid that, set a proper `region_grid_spacing` so that your exposure
@@ -166,7 +167,7 @@ class BaseCalculator(metaclass=abc.ABCMeta):
 
     def __init__(self, oqparam, calc_id):
         self.datastore = datastore.DataStore(calc_id)
-        init_performance(self.datastore.hdf5)
+        init_performance(self.datastore.hdf5, profile=oqparam.profile_tasks)
         self._monitor = Monitor(
             '%s.run' % self.__class__.__name__, measuremem=True,
             h5=self.datastore)
@@ -919,7 +920,7 @@ class RiskCalculator(HazardCalculator):
             imts, gmfs = to_gmfs(
                 shakemap, oq.spatial_correlation, oq.cross_correlation,
                 oq.site_effects, oq.truncation_level, E, oq.random_seed,
-                oq.imtls)
+                oq.imtls, oq.shakemap_max_neighbors)
             save_gmf_data(self.datastore, sitecol, gmfs, imts)
         return sitecol, assetcol
 
@@ -980,6 +981,40 @@ class RiskCalculator(HazardCalculator):
             getter.init()
         return getter
 
+    def gen_getters(self, kind, sids):
+        """
+        :param kind: 'poe' or 'gmf'
+        :param sids: an ordered list of site IDs
+        :yields: pairs (sid, getter)
+
+        If gmf_data is compact (see :func:`getters.is_compact`) the GMFs
+        of many sites are read at once in the master with a GmfBlockGetter,
+        except for the calculators reading them in the workers.
+        """
+        parent = (self.oqparam.hazard_calculation_id and
+                  'gmf_data' not in self.datastore)
+        dstore = self.datastore.parent if parent else self.datastore
+        if (kind != 'gmf' or not sids or self.oqparam.calculation_mode in
+                'event_based_damage scenario_damage scenario_risk'):
+            compact = False
+        else:
+            dstore.open('r')  # if not already open
+            compact = getters.is_compact(dstore)
+        if not compact:
+            for sid in sids:
+                yield sid, self.get_getter(kind, sid)
+            return
+        if len(dstore['gmf_data/data']) == 0:
+            raise RuntimeError(
+                'There are no GMFs available: perhaps you set '
+                'ground_motion_fields=False or a large minimum_intensity')
+        idxs = dstore['gmf_data/indices'][()]
+        for block in getters.gen_gmf_blocks(idxs, sids, MAX_GMF_ROWS):
+            for getter in getters.GmfBlockGetter(dstore, block, self.R):
+                yield getter.sids[0], getter
+        if parent:
+            dstore.close()  # the workers will reopen it
+
     def _gen_riskinputs(self, kind):
         hazard = ('gmf_data' in self.datastore or 'poes' in self.datastore or
                   'multi_peril' in self.datastore)
@@ -990,10 +1025,10 @@ class RiskCalculator(HazardCalculator):
         rinfo_dt = numpy.dtype([('sid', U16), ('num_assets', U16)])
         rinfo = []
         assets_by_site = self.assetcol.assets_by_site()
-        for sid, assets in enumerate(assets_by_site):
-            if len(assets) == 0:
-                continue
-            getter = self.get_getter(kind, sid)
+        sids = [sid for sid, assets in enumerate(assets_by_site)
+                if len(assets)]
+        for sid, getter in self.gen_getters(kind, sids):
+            assets = assets_by_site[sid]
             for block in general.block_splitter(
                     assets, self.oqparam.assets_per_site_limit):
                 yield riskinput.RiskInput(sid, getter, numpy.array(block))
@@ -1036,24 +1071,24 @@ def save_gmf_data(dstore, sitecol, gmfs, imts, events=()):
         events = numpy.zeros(E, rupture.events_dt)
         events['id'] = numpy.arange(E, dtype=U32)
     dstore['events'] = events
-    offset = 0
-    # convert an array of shape (N, E, M) into an array of type gmv_data_dt
+    # convert an array of shape (N, E, M) into an array of type gmv_data_dt,
+    # by blocks of sites, to avoid building all the records in memory
     N, E, M = gmfs.shape
-    lst = [(sitecol.sids[s], ei, gmfs[s, ei])
-           for s in numpy.arange(N, dtype=U32)
-           for ei, event in enumerate(events)]
-    gmfa = numpy.array(lst, dstore['oqparam'].gmf_data_dt())
-    dstore['gmf_data/data'] = gmfa
-    dic = general.group_array(gmfa, 'sid')
-    lst = []
-    all_sids = sitecol.complete.sids
-    for sid in all_sids:
-        rows = dic.get(sid, ())
-        n = len(rows)
-        lst.append((offset, offset + n))
-        offset += n
+    dset = dstore.create_dset('gmf_data/data', dstore['oqparam'].gmf_data_dt())
+    eids = numpy.arange(E, dtype=U32)
+    blocksize = max(MAX_GMF_ROWS // E, 1) if E else N
+    for start in range(0, N, blocksize):
+        sids = sitecol.sids[start:start + blocksize]
+        gmfa = numpy.zeros(len(sids) * E, dset.dtype)
+        gmfa['sid'] = numpy.repeat(sids, E)
+        gmfa['eid'] = numpy.tile(eids, len(sids))
+        gmfa['gmv'] = gmfs[start:start + blocksize].reshape(-1, M)
+        hdf5.extend(dset, gmfa)
+    # each site of the (filtered) site collection has E rows
+    nrows = numpy.isin(sitecol.complete.sids, sitecol.sids) * E
+    stops = numpy.cumsum(nrows)
     dstore['gmf_data/imts'] = ' '.join(imts)
-    dstore['gmf_data/indices'] = numpy.array(lst, U32)
+    dstore['gmf_data/indices'] = numpy.array([stops - nrows, stops], U32).T
 
 
 def import_gmfs(dstore, fname, sids):
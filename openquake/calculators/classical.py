@@ -17,7 +17,9 @@
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 import os
 import re
+import copy
 import time
+import zlib
 import logging
 import operator
 from datetime import datetime
@@ -26,6 +28,7 @@ import numpy
 from openquake.baselib import parallel, hdf5
 from openquake.baselib.general import (
     AccumDict, block_splitter, groupby, humansize)
+from openquake.baselib.python3compat import decode
 from openquake.hazardlib.contexts import ContextMaker, get_effect
 from openquake.hazardlib.calc.filters import split_sources, getdefault
 from openquake.hazardlib.calc.hazard_curve import classical
@@ -40,9 +43,16 @@ U32 = numpy.uint32
 F32 = numpy.float32
 F64 = numpy.float64
 TWO32 = 2 ** 32
+MAXPOES = 10_000_000  # max number of PoEs per block of sites in build_hazard
 grp_extreme_dt = numpy.dtype([('grp_id', U16), ('grp_trt', hdf5.vstr),
                              ('extreme_poe', F32)])
 
+# parameters affecting the PoEs of a source group, used in get_grp_checksums
+HAZARD_PARAMS = ('imtls', 'truncation_level', 'maximum_distance',
+                 'investigation_time', 'pointsource_distance',
+                 'minimum_intensity', 'minimum_magnitude', 'filter_distance',
+                 'shift_hypo', 'collapse_level', 'point_rupture_bins')
+
 MAXMEMORY = '''Estimated upper memory limit per core:
 %d sites x %d levels x %d gsims x %d src_multiplicity * 8 bytes = %s'''
 
@@ -181,7 +191,7 @@ class ClassicalCalculator(base.HazardCalculator):
             self.by_task[extra['task_no']] = (
                 eff_rups, eff_sites, sorted(srcids))
             for grp_id, pmap in dic['pmap'].items():
-                if pmap:
+                if pmap and grp_id not in self.reused:
                     acc[grp_id] |= pmap
                 acc.eff_ruptures[trt] += eff_rups
 
@@ -228,6 +238,10 @@ class ClassicalCalculator(base.HazardCalculator):
                     rparams.add(dparam + '_')
                 zd[grp_id] = ProbabilityMap(num_levels, len(gsims))
         zd.eff_ruptures = AccumDict(accum=0)  # trt -> eff_ruptures
+        for grp_id, pmap in self.reused.items():
+            zd[grp_id] = pmap
+        for trt, eff_rups in self.reused_eff_ruptures.items():
+            zd.eff_ruptures[trt] += eff_rups
         if self.few_sites:
             self.rparams = sorted(rparams)
             for k in self.rparams:
@@ -300,6 +314,12 @@ class ClassicalCalculator(base.HazardCalculator):
             self.psd = oq.pointsource_distance.interp(mags_by_trt)
         else:
             self.psd = {}
+        self.grp_checksums = self.get_grp_checksums()
+        self.reused = {}  # grp_id -> ProbabilityMap read from the parent
+        self.reused_times = {}  # src_id -> (eff_rups, num_sites, calc_time)
+        self.reused_eff_ruptures = AccumDict(accum=0)  # trt -> eff_rups
+        if oq.incremental_calculation_id:
+            self.read_reused(oq.incremental_calculation_id)
         smap = parallel.Starmap(classical, h5=self.datastore.hdf5,
                                 num_cores=oq.num_cores)
         self.submit_tasks(smap)
@@ -307,6 +327,7 @@ class ClassicalCalculator(base.HazardCalculator):
         self.datastore.swmr_on()
         smap.h5 = self.datastore.hdf5
         self.calc_times = AccumDict(accum=numpy.zeros(3, F32))
+        self.calc_times += self.reused_times
         try:
             acc = smap.reduce(self.agg_dicts, acc0)
             self.store_rlz_info(acc.eff_ruptures)
@@ -333,8 +354,9 @@ class ClassicalCalculator(base.HazardCalculator):
         numsites = sum(arr[1] for arr in self.calc_times.values())
         logging.info('Effective number of ruptures: {:_d}/{:_d}'.format(
             int(self.numrups), self.totrups))
-        logging.info('Effective number of sites per rupture: %d',
-                     numsites / self.numrups)
+        if self.numrups:
+            logging.info('Effective number of sites per rupture: %d',
+                         numsites / self.numrups)
         if self.psd:
             psdist = max(max(self.psd[trt].values()) for trt in self.psd)
             if psdist != -1 and self.maxradius >= psdist / 2:
@@ -344,13 +366,112 @@ class ClassicalCalculator(base.HazardCalculator):
         self.calc_times.clear()  # save a bit of memory
         return acc
 
+    def get_grp_checksums(self):
+        """
+        :returns:
+            a dictionary grp_id -> 32 bit checksum of the sources, the GSIMs,
+            the sites and the parameters determining the PoEs of the group
+        """
+        oq = self.oqparam
+        common = ['%s = %s' % (name, getattr(oq, name, None))
+                  for name in HAZARD_PARAMS]
+        common.append('sitecol = %d' % zlib.adler32(
+            self.sitecol.complete.array.tobytes()))
+        # the content of the input files changing the PoEs, i.e. the
+        # reqv tables and the GSIM tables
+        fnames = {'reqv %s' % key: fname
+                  for key, fname in oq.inputs.get('reqv', {}).items()}
+        for gsims in self.full_lt.gsim_lt.values.values():
+            for gsim in gsims:
+                for k, v in gsim.kwargs.items():
+                    if k.endswith(('_file', '_table')):
+                        fnames[os.path.basename(v)] = v
+        for name, fname in sorted(fnames.items()):
+            with open(fname, 'rb') as f:
+                common.append('%s = %d' % (name, zlib.adler32(f.read())))
+        gsims_by_trt = self.full_lt.get_gsims_by_trt()
+        lines = AccumDict(accum=[])  # grp_id -> lines
+        for sg in self.csm.src_groups:
+            grp = ' '.join(str(getattr(sg, name, None)) for name in (
+                'src_interdep', 'rup_interdep', 'grp_probability', 'cluster'))
+            tom = sg.temporal_occurrence_model
+            if tom is not None:  # PoissonTOM has no __repr__
+                grp += ' %s %s %s' % (tom.__class__.__name__, tom.time_span,
+                                      tom.occurrence_rate)
+            for src in sg:
+                for grp_id in src.grp_ids:
+                    lines[grp_id].append(
+                        '%s %d %s' % (src.source_id, src.checksum, grp))
+        checksums = {}
+        for grp_id, lst in lines.items():
+            trt = self.full_lt.trt_by_grp[grp_id]
+            gsims = [str(gsim) for gsim in gsims_by_trt[trt]]
+            data = '\n'.join(common + gsims + sorted(lst)).encode('utf8')
+            checksums[grp_id] = zlib.adler32(data) & 0xffffffff
+        return checksums
+
+    def read_reused(self, calc_id):
+        """
+        Read from the parent calculation the PoEs of the source groups with
+        the same checksum and populate .reused, .reused_times and
+        .reused_eff_ruptures.
+
+        :param calc_id: ID of a previous classical calculation
+        """
+        oq = self.oqparam
+        if oq.disagg_by_src or oq.is_ucerf() or self.few_sites:
+            logging.warning('incremental_calculation_id is ignored with '
+                            'disagg_by_src, UCERF or few sites')
+            return
+        parent = util.read(calc_id)
+        try:
+            if 'classical' not in parent['oqparam'].calculation_mode:
+                raise ValueError('The calculation #%d is not a classical '
+                                 'calculation' % calc_id)
+            key_by_checksum = {}
+            for key in parent.get('poes', []):
+                checksum = parent.get_attr('poes/' + key, 'checksum', None)
+                if checksum is not None:
+                    key_by_checksum[checksum] = 'poes/' + key
+            for grp_id, checksum in self.grp_checksums.items():
+                if checksum in key_by_checksum:
+                    self.reused[grp_id] = parent[key_by_checksum[checksum]]
+            info = {decode(rec['source_id']): rec
+                    for rec in parent['source_info'][()]}
+        finally:
+            parent.close()
+        reused = set(self.reused)
+        for sg in self.csm.src_groups:
+            for src in sg:
+                if reused.issuperset(src.grp_ids) and src.source_id in info:
+                    rec = info[src.source_id]
+                    self.reused_times[src.source_id] = F32(
+                        [rec['eff_ruptures'], rec['num_sites'],
+                         rec['calc_time']])
+                    self.reused_eff_ruptures[sg.trt] += rec['eff_ruptures']
+        logging.info('Reusing the PoEs of %d/%d source group(s) from '
+                     'calculation #%d', len(reused), len(self.grp_checksums),
+                     calc_id)
+
     def submit_tasks(self, smap):
         """
         Submit tasks to the passed Starmap
         """
         oq = self.oqparam
         gsims_by_trt = self.full_lt.get_gsims_by_trt()
-        src_groups = self.csm.src_groups
+        src_groups = []
+        for sg in self.csm.src_groups:
+            # discard the sources affecting only groups reused from a parent
+            srcs = [src for src in sg
+                    if not set(self.reused).issuperset(src.grp_ids)]
+            if len(srcs) == len(sg) or srcs and sg.atomic:
+                src_groups.append(sg)
+            elif srcs:
+                sg = copy.copy(sg)
+                sg.sources = srcs
+                src_groups.append(sg)
+        if not src_groups:
+            return
 
         def srcweight(src):
             trt = src.tectonic_region_type
@@ -412,29 +533,20 @@ class ClassicalCalculator(base.HazardCalculator):
             logging.info('max_dist={}, gsims={}, weight={:_d}, blocks={}'.
                          format(md, len(gsims), int(w), nb))
 
-    def save_hazard(self, acc, pmap_by_kind):
+    def save_hazard(self, acc, arrays):
         """
         Works by side effect by saving hcurves and hmaps on the datastore
 
         :param acc: ignored
-        :param pmap_by_kind: a dictionary of ProbabilityMaps
+        :param arrays: a dictionary kind -> (start, array)
 
-        kind can be ('hcurves', 'mean'), ('hmaps', 'mean'),  ...
+        kind can be 'hcurves-rlzs', 'hmaps-rlzs', 'hcurves-stats', ...
+        Each array is stored in a single write on the slab of sites
+        start:start+len(array), which is contiguous on disk.
         """
         with self.monitor('saving statistics'):
-            for kind in pmap_by_kind:  # i.e. kind == 'hcurves-stats'
-                pmaps = pmap_by_kind[kind]
-                if kind in ('hmaps-rlzs', 'hmaps-stats'):
-                    # pmaps is a list of R pmaps
-                    dset = self.datastore.getitem(kind)
-                    for r, pmap in enumerate(pmaps):
-                        for s in pmap:
-                            dset[s, r] = pmap[s].array  # shape (M, P)
-                elif kind in ('hcurves-rlzs', 'hcurves-stats'):
-                    dset = self.datastore.getitem(kind)
-                    for r, pmap in enumerate(pmaps):
-                        for s in pmap:
-                            dset[s, r] = pmap[s].array[:, 0]  # shape L
+            for kind, (start, array) in arrays.items():
+                self.datastore.getitem(kind)[start:start + len(array)] = array
             self.datastore.flush()
 
     def post_execute(self, pmap_by_grp_id):
@@ -453,7 +565,8 @@ class ClassicalCalculator(base.HazardCalculator):
                     trt = self.full_lt.trt_by_grp[grp_id]
                     key = 'poes/grp-%02d' % grp_id
                     self.datastore[key] = pmap
-                    self.datastore.set_attrs(key, trt=trt)
+                    self.datastore.set_attrs(
+                        key, trt=trt, checksum=self.grp_checksums[grp_id])
                     extreme = max(
                         get_extreme_poe(pmap[sid].array, oq.imtls)
                         for sid in pmap)
@@ -511,6 +624,33 @@ class PreCalculator(ClassicalCalculator):
     core_task = preclassical
 
 
+def _stat_curves(poes, imtls, stat, weights):
+    # vectorized version of getters.build_stat_curve for a block of sites;
+    # poes has shape (R, N, L) and the result has shape (N, L)
+    if isinstance(weights, list):  # IMT-dependent weights
+        array = numpy.zeros(poes.shape[1:])
+        for imt in imtls:
+            slc = imtls(imt)
+            ws = [w[imt] for w in weights]
+            if sum(ws) == 0:  # expect no data for this IMT
+                continue
+            array[:, slc] = stat(poes[:, :, slc], ws)
+        return array
+    return stat(poes, weights)
+
+
+def _hmaps(curves, imtls, poes):
+    # vectorized version of calc.make_hmap for a block of sites;
+    # curves has shape (N, K, L) and the result has shape (N, K, M, P)
+    N, K, _ = curves.shape
+    hmaps = numpy.zeros((N, K, len(imtls), len(poes)))
+    for m, imt in enumerate(imtls):
+        data = calc.compute_hazard_maps(
+            curves[:, :, imtls(imt)].reshape(N * K, -1), imtls[imt], poes)
+        hmaps[:, :, m] = data.reshape(N, K, -1)
+    return hmaps
+
+
 def build_hazard(pgetter, N, hstats, individual_curves,
                  max_sites_disagg, amplifier, monitor):
     """
@@ -521,10 +661,11 @@ def build_hazard(pgetter, N, hstats, individual_curves,
     :param max_sites_disagg: if there are less sites than this, store rup info
     :param amplifier: instance of Amplifier or None
     :param monitor: instance of Monitor
-    :returns: a dictionary kind -> ProbabilityMap
+    :returns: a dictionary kind -> (start, array)
 
-    The "kind" is a string of the form 'rlz-XXX' or 'mean' of 'quantile-XXX'
-    used to specify the kind of output.
+    The "kind" is the name of the dataset ('hcurves-rlzs', 'hmaps-stats',
+    ...) and the array contains the data for the contiguous slab of sites
+    start:start+len(array); sites without data are filled with zeros.
     """
     with monitor('read PoEs'):
         pgetter.init()
@@ -536,36 +677,48 @@ def build_hazard(pgetter, N, hstats, individual_curves,
     L = len(imtls.array) if amplifier is None else len(amplifier.amplevels) * M
     R = len(weights)
     S = len(hstats)
-    pmap_by_kind = {}
-    if R > 1 and individual_curves or not hstats:
-        pmap_by_kind['hcurves-rlzs'] = [ProbabilityMap(L) for r in range(R)]
+    sids = numpy.array(pgetter.sids)
+    start = sids[0]
+    n = sids[-1] + 1 - start
+    arrays = {}
+    rlzs = R > 1 and individual_curves or not hstats
+    if rlzs:
+        arrays['hcurves-rlzs'] = numpy.zeros((n, R, L), F32)
+        if poes:
+            arrays['hmaps-rlzs'] = numpy.zeros((n, R, M, P), F32)
     if hstats:
-        pmap_by_kind['hcurves-stats'] = [ProbabilityMap(L) for r in range(S)]
+        arrays['hcurves-stats'] = numpy.zeros((n, S, L), F32)
         if poes:
-            pmap_by_kind['hmaps-stats'] = [
-                ProbabilityMap(M, P) for r in range(S)]
+            arrays['hmaps-stats'] = numpy.zeros((n, S, M, P), F32)
     combine_mon = monitor('combine pmaps', measuremem=False)
     compute_mon = monitor('compute stats', measuremem=False)
-    for sid in pgetter.sids:
+    blocksize = max(MAXPOES // (R * L), 1)
+    for b in range(0, len(sids), blocksize):
+        block = sids[b:b + blocksize]
         with combine_mon:
-            pcurves = pgetter.get_pcurves(sid)
-            if amplifier:
-                pcurves = amplifier.amplify(ampcode[sid], pcurves)
-        if sum(pc.array.sum() for pc in pcurves) == 0:  # no data
+            curves = numpy.zeros((len(block), R, L))
+            for i, sid in enumerate(block):
+                pcurves = pgetter.get_pcurves(sid)
+                if amplifier:
+                    pcurves = amplifier.amplify(ampcode[sid], pcurves)
+                for r, pc in enumerate(pcurves):
+                    curves[i, r] = pc.array[:, 0]
+            ok = curves.sum(axis=(1, 2)) > 0  # discard sites with no data
+            idxs = block[ok] - start
+            curves = curves[ok]
+        if len(curves) == 0:
             continue
         with compute_mon:
             if hstats:
-                arr = numpy.array([pc.array for pc in pcurves])
-                for s, (statname, stat) in enumerate(hstats.items()):
-                    pc = getters.build_stat_curve(arr, imtls, stat, weights)
-                    pmap_by_kind['hcurves-stats'][s][sid] = pc
-                    if poes:
-                        hmap = calc.make_hmap(pc, pgetter.imtls, poes, sid)
-                        pmap_by_kind['hmaps-stats'][s].update(hmap)
-            if R > 1 and individual_curves or not hstats:
-                for pmap, pc in zip(pmap_by_kind['hcurves-rlzs'], pcurves):
-                    pmap[sid] = pc
+                arr = curves.transpose(1, 0, 2)  # shape (R, N, L)
+                stats = numpy.zeros((len(curves), S, L))
+                for s, stat in enumerate(hstats.values()):
+                    stats[:, s] = _stat_curves(arr, imtls, stat, weights)
+                arrays['hcurves-stats'][idxs] = stats
+                if poes:
+                    arrays['hmaps-stats'][idxs] = _hmaps(stats, imtls, poes)
+            if rlzs:
+                arrays['hcurves-rlzs'][idxs] = curves
                 if poes:
-                    pmap_by_kind['hmaps-rlzs'] = [
-                        calc.make_hmap(pc, imtls, poes, sid) for pc in pcurves]
-    return pmap_by_kind
+                    arrays['hmaps-rlzs'][idxs] = _hmaps(curves, imtls, poes)
+    return {kind: (start, array) for kind, array in arrays.items()}
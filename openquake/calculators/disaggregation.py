@@ -30,7 +30,7 @@ from openquake.baselib.python3compat import encode
 from openquake.hazardlib import stats
 from openquake.hazardlib.calc import disagg
 from openquake.hazardlib.imt import from_string
-from openquake.hazardlib.gsim.base import ContextMaker, DistancesContext
+from openquake.hazardlib.gsim.base import ContextMaker
 from openquake.hazardlib.contexts import RuptureContext
 from openquake.hazardlib.tom import PoissonTOM
 from openquake.commonlib import util
@@ -123,22 +123,9 @@ def compute_disagg(dstore, idxs, cmaker, iml4, trti, bin_edges, monitor):
     pne_mon = monitor('disaggregate_pne', measuremem=False)
     mat_mon = monitor('build_disagg_matrix', measuremem=True)
     gmf_mon = monitor('disagg mean_std', measuremem=False)
-    for sid, iml3 in zip(sitecol.sids, iml4):
-        singlesite = sitecol.filtered([sid])
-        bins = disagg.get_bins(bin_edges, sid)
-        rlzs = [iml4.rlzs[sid, z] for z in range(iml4.shape[-1])]
-        ctxs = []
-        ok, = numpy.where(
-            rupdata['rrup_'][:, sid] <= cmaker.maximum_distance(cmaker.trt))
-        for ridx in ok:  # consider only the ruptures close to the site
-            rctx = RuptureContext((par, rupdata[par][ridx])
-                                  for par in rupdata if not par.endswith('_'))
-            dctx = DistancesContext((par[:-1], rupdata[par][ridx, [sid]])
-                                    for par in rupdata if par.endswith('_'))
-            ctxs.append((rctx, dctx))
-        matrix = disagg.build_matrix(
-            cmaker, singlesite, ctxs, iml3, iml4.imts, rlzs,
-            oq.num_epsilon_bins, bins, pne_mon, mat_mon, gmf_mon)
+    for sid, matrix in disagg.build_matrices(
+            cmaker, sitecol, rupdata, iml4, oq.num_epsilon_bins,
+            bin_edges, pne_mon, mat_mon, gmf_mon):
         if matrix.any():
             yield {'trti': trti, sid: matrix}
 
@@ -20,6 +20,7 @@ import operator
 import itertools
 from datetime import datetime
 import numpy
+import pandas
 
 from openquake.baselib import datastore, hdf5, parallel, general
 from openquake.baselib.python3compat import zip
@@ -27,7 +28,7 @@ from openquake.hazardlib.calc.filters import getdefault
 from openquake.risklib import riskmodels
 from openquake.risklib.scientific import LossesByAsset
 from openquake.risklib.riskinput import (
-    cache_epsilons, get_assets_by_taxo, get_output)
+    get_epsilon_getter, get_assets_by_taxo, get_output)
 from openquake.commonlib import logs
 from openquake.calculators import base, event_based, getters
 from openquake.calculators.post_risk import PostRiskCalculator
@@ -55,8 +56,17 @@ def calc_risk(gmfs, param, monitor):
     mon_agg = monitor('aggregating losses', measuremem=False)
     eids = numpy.unique(gmfs['eid'])
     dstore = datastore.read(param['hdf5path'])
+    haz_by_sid = general.group_array(gmfs, 'sid')
     with monitor('getting assets'):
-        assets_df = dstore.read_df('assetcol/array', 'ordinal')
+        # the asset array is mapped in memory and shared by the workers;
+        # it is sorted by site_id, so the assets of the site `sid` are in
+        # the rows idx[sid]:idx[sid + 1] and only those rows are copied
+        array = hdf5.memmap(param['cachepath'], 'assets')
+        idx = hdf5.memmap(param['cachepath'], 'assets_idx')
+        rows = numpy.concatenate([numpy.arange(idx[sid], idx[sid + 1])
+                                  for sid in sorted(haz_by_sid)])
+        assets_df = pandas.DataFrame.from_records(
+            array[rows], index='ordinal')
     with monitor('getting crmodel'):
         crmodel = riskmodels.CompositeRiskModel.read(dstore)
         events = dstore['events'][list(eids)]
@@ -64,13 +74,12 @@ def calc_risk(gmfs, param, monitor):
     E = len(eids)
     L = len(param['lba'].loss_names)
     elt_dt = [('event_id', U32), ('rlzi', U16), ('loss', (F32, (L,)))]
-    # aggkey -> eid -> loss
+    # aggkey -> [(eids, losses), ...]
     acc = dict(events_per_sid=0, numlosses=numpy.zeros(2, int))  # (kept, tot)
     lba = param['lba']
-    lba.alt = general.AccumDict(
-        accum=general.AccumDict(accum=numpy.zeros(L, F32)))
+    lba.alt = general.AccumDict(accum=[])
     lba.losses_by_E = numpy.zeros((E, L), F32)
-    tempname = param['tempname']
+    epsgetter = param['epsgetter']
     eid2rlz = dict(events[['id', 'rlz_id']])
     eid2idx = {eid: idx for idx, eid in enumerate(eids)}
     aggby = param['aggregate_by']
@@ -82,12 +91,8 @@ def calc_risk(gmfs, param, monitor):
         if lt in lba.policy_dict:  # same order as in lba.compute
             minimum_loss.append(val)
 
-    haz_by_sid = general.group_array(gmfs, 'sid')
     for sid, asset_df in assets_df.groupby('site_id'):
-        try:
-            haz = haz_by_sid[sid]
-        except KeyError:  # no hazard here
-            continue
+        haz = haz_by_sid[sid]
         with mon_risk:
             assets = asset_df.to_records()  # fast
             acc['events_per_sid'] += len(haz)
@@ -95,7 +100,8 @@ def calc_risk(gmfs, param, monitor):
                 ws = weights[[eid2rlz[eid] for eid in haz['eid']]]
             else:
                 ws = None
-            assets_by_taxo = get_assets_by_taxo(assets, tempname)  # fast
+            assets_by_taxo = get_assets_by_taxo(
+                assets, epsgetter=epsgetter)  # fast
             eidx = numpy.array([eid2idx[eid] for eid in haz['eid']])  # fast
             out = get_output(crmodel, assets_by_taxo, haz)  # slow
         with mon_agg:
@@ -108,9 +114,7 @@ def calc_risk(gmfs, param, monitor):
         ((event['id'], event['rlz_id'], losses)
          for event, losses in zip(events, lba.losses_by_E) if losses.sum()),
         elt_dt)
-    acc['alt'] = {idx: numpy.fromiter(  # already sorted by aid, ultra-fast
-        ((eid, eid2rlz[eid], loss) for eid, loss in lba.alt[idx].items()),
-        elt_dt) for idx in lba.alt}
+    acc['alt'] = {idx: lba.get_alt(idx, events) for idx in lba.alt}
     if param['avg_losses']:
         acc['losses_by_A'] = param['lba'].losses_by_A * param['ses_ratio']
         # without resetting the cache the sequential avg_losses would be wrong!
@@ -131,26 +135,37 @@ def ebrisk(rupgetter, srcfilter, param, monitor):
     gmfs = []
     gmf_info = []
     gg = getters.GmfGetter(rupgetter, srcfilter, param['oqparam'],
-                           param['amplifier'])
+                           param['amplifier'], param['mean_stds'])
     nbytes = 0
+    subtasks = 0
     for c in gg.gen_computers(mon_rup):
-        with mon_haz:
-            data, time_by_rup = c.compute_all(gg.min_iml, gg.rlzs_by_gsim)
-        if len(data):
+        gmfbytes = 0
+        dt = 0
+        chunks = c.gen_gmfs(gg.min_iml, gg.rlzs_by_gsim)
+        while True:
+            with mon_haz:
+                data = next(chunks, None)
+            dt += mon_haz.dt
+            if data is None:
+                break
             gmfs.append(data)
+            gmfbytes += data.nbytes
             nbytes += data.nbytes
+            if nbytes > param['ebrisk_maxsize']:
+                yield calc_risk, numpy.concatenate(gmfs), param
+                subtasks += 1
+                nbytes = 0
+                gmfs = []
         gmf_info.append((c.rupture.id, mon_haz.task_no, len(c.sids),
-                         data.nbytes, mon_haz.dt))
-        if nbytes > param['ebrisk_maxsize']:
-            msg = 'produced subtask'
-            try:
-                logs.dbcmd('log', monitor.calc_id, datetime.utcnow(), 'DEBUG',
-                           'ebrisk#%d' % monitor.task_no, msg)
-            except Exception:  # for `oq run`
-                print(msg)
-            yield calc_risk, numpy.concatenate(gmfs), param
-            nbytes = 0
-            gmfs = []
+                         gmfbytes, dt))
+    if subtasks:
+        # a single log record per task, not one per subtask
+        msg = 'produced %d subtask(s)' % subtasks
+        try:
+            logs.dbcmd('log', monitor.calc_id, datetime.utcnow(), 'DEBUG',
+                       'ebrisk#%d' % monitor.task_no, msg)
+        except Exception:  # for `oq run`
+            print(msg)
     res = {}
     if gmfs:
         res.update(calc_risk(numpy.concatenate(gmfs), param, monitor))
@@ -221,8 +236,16 @@ class EbriskCalculator(event_based.EventBasedCalculator):
         self.init_logic_tree(full_lt)
         self.set_param(
             hdf5path=self.datastore.filename,
-            tempname=cache_epsilons(
-                self.datastore, oq, self.assetcol, self.crmodel, self.E))
+            epsgetter=get_epsilon_getter(oq, self.crmodel),
+            cachepath=self.datastore.tempname,
+            mean_stds=self.check_mean_stds(write=False))
+        with hdf5.File(self.datastore.tempname, 'a') as cache:
+            # sorted by site_id, with the offsets of the sites in assets_idx
+            array = self.assetcol.array
+            assets = array[numpy.argsort(array['site_id'], kind='stable')]
+            sids = numpy.arange(len(self.sitecol.complete) + 1)
+            cache['assets'] = assets
+            cache['assets_idx'] = numpy.searchsorted(assets['site_id'], sids)
         srcfilter = self.src_filter(self.datastore.tempname)
         logging.info(
             'Sending {:_d} ruptures'.format(len(self.datastore['ruptures'])))
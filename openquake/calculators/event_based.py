@@ -17,12 +17,13 @@
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 
 import os.path
+import zlib
 import logging
 import operator
 import numpy
 
 from openquake.baselib import hdf5
-from openquake.baselib.general import AccumDict, get_indices
+from openquake.baselib.general import AccumDict, get_indices, block_splitter
 from openquake.hazardlib.probability_map import ProbabilityMap
 from openquake.hazardlib.stats import compute_pmap_stats
 from openquake.hazardlib.calc.stochastic import sample_ruptures
@@ -45,6 +46,7 @@ U32 = numpy.uint32
 F32 = numpy.float32
 F64 = numpy.float64
 TWO32 = numpy.float64(2 ** 32)
+MAX_ROWS = 10_000_000  # max number of GMF rows read when compacting
 by_grp = operator.attrgetter('grp_id')
 
 
@@ -65,8 +67,64 @@ def compute_gmfs(rupgetter, srcfilter, param, monitor):
     Compute GMFs and optionally hazard curves
     """
     oq = param['oqparam']
-    getter = GmfGetter(rupgetter, srcfilter, oq, param['amplifier'])
-    return getter.compute_gmfs_curves(param.get('rlz_by_event'), monitor)
+    getter = GmfGetter(rupgetter, srcfilter, oq, param['amplifier'],
+                       param.get('mean_stds', ''))
+    res = getter.compute_gmfs_curves(param.get('rlz_by_event'), monitor)
+    if getter.mean_stds_by_rup:
+        res['mean_stds'] = getter.mean_stds_by_rup
+    return res
+
+
+def get_mean_stds_checksum(oqparam, sitecol, gsim_lt):
+    """
+    :param oqparam: an OqParam instance
+    :param sitecol: the complete site collection
+    :param gsim_lt: a GsimLogicTree instance
+    :returns: a 32 bit checksum of the parameters affecting the mean_stds
+    """
+    params = (list(oqparam.imtls), oqparam.maximum_distance,
+              oqparam.filter_distance, gsim_lt)
+    return zlib.adler32(repr(params).encode('utf8') + sitecol.array.tobytes())
+
+
+def compact_gmf_data(dstore, indices, max_rows=MAX_ROWS):
+    """
+    Copy the GMFs from gmf_data/fragments into gmf_data/data ordered by site
+    ID, so that the rows of each site are contiguous and gmf_data/indices
+    is an array of shape (N, 2) with a single (start, stop) pair per site,
+    as in scenario calculations. The order of the rows of each site is
+    preserved. The sites are processed in blocks of at most `max_rows` rows
+    (unless a single site has more) and at the end the fragments are
+    removed by resizing the dataset, since objects cannot be deleted from
+    a file in SWMR mode.
+
+    :param dstore: a DataStore with gmf_data/fragments and events_by_sid
+    :param indices: a dictionary (sid, 0|1) -> list of start|stop indices
+    :param max_rows: the maximum number of rows read at once
+    """
+    num_evs = dstore['gmf_data/events_by_sid'][()]
+    stops = numpy.cumsum(num_evs, dtype=U32)
+    starts = stops - num_evs
+    fragments = dstore['gmf_data/fragments']
+    for block in block_splitter(range(len(num_evs)), max_rows,
+                                weight=lambda sid: num_evs[sid]):
+        # the fragments of consecutive sites are often adjacent, so
+        # merging the ranges reduces the number of reads
+        ranges = sorted(pair for sid in block
+                        for pair in zip(indices[sid, 0], indices[sid, 1]))
+        merged = []
+        for start, stop in ranges:
+            if merged and merged[-1][1] == start:
+                merged[-1][1] = stop
+            else:
+                merged.append([start, stop])
+        if merged:
+            arr = numpy.concatenate([fragments[start:stop]
+                                     for start, stop in merged])
+            arr = arr[numpy.argsort(arr['sid'], kind='stable')]
+            hdf5.extend(dstore['gmf_data/data'], arr)
+    fragments.resize((0,))
+    dstore['gmf_data/indices'] = numpy.array([starts, stops], U32).T
 
 
 @base.calculators.add('event_based', 'ucerf_hazard')
@@ -173,7 +231,9 @@ class EventBasedCalculator(base.HazardCalculator):
                 times = result.pop('times')
                 rupids = list(times['rup_id'])
                 self.datastore['gmf_data/time_by_rup'][rupids] = times
-                hdf5.extend(self.datastore['gmf_data/data'], data)
+                key = ('gmf_data/fragments' if self.oqparam.compact_gmf_data
+                       else 'gmf_data/data')
+                hdf5.extend(self.datastore[key], data)
                 sig_eps = result.pop('sig_eps')
                 hdf5.extend(self.datastore['gmf_data/sigma_epsilon'], sig_eps)
                 for sid, start, stop in result['indices']:
@@ -183,6 +243,11 @@ class EventBasedCalculator(base.HazardCalculator):
         if self.offset >= TWO32:
             raise RuntimeError(
                 'The gmf_data table has more than %d rows' % TWO32)
+        if 'mean_stds' in result:
+            with self.monitor('saving mean_stds'):
+                dset = self.datastore['mean_stds']
+                for rup_id, array in result.pop('mean_stds').items():
+                    dset[rup_id] = array
         imtls = self.oqparam.imtls
         with agg_mon:
             for key, poes in result.get('hcurves', {}).items():
@@ -289,6 +354,35 @@ class EventBasedCalculator(base.HazardCalculator):
             imtls=oq.imtls, filter_distance=oq.filter_distance,
             ses_per_logic_tree_path=oq.ses_per_logic_tree_path, **kw)
 
+    def check_mean_stds(self, write):
+        """
+        :param write: if True, prepare the mean_stds dataset when needed
+        :returns:
+            'r' if there is a cache of mean_stds compatible with the
+            current calculation, 'w' if the cache has to be built,
+            '' otherwise
+        """
+        oq = self.oqparam
+        checksum = get_mean_stds_checksum(
+            oq, self.sitecol.complete, self.datastore['full_lt'].gsim_lt)
+        try:
+            dset = self.datastore['mean_stds']
+        except KeyError:  # no cache
+            pass
+        else:
+            if dset.attrs['checksum'] == checksum:
+                logging.info('Reusing the cached mean_stds')
+                return 'r'
+            logging.warning('Ignoring the cached mean_stds, computed with '
+                            'different sites, GSIMs or IMTs')
+        if write and oq.cache_mean_stds:
+            nrups = len(self.datastore['ruptures'])
+            self.datastore.create_dset(
+                'mean_stds', hdf5.vfloat64, (nrups,), fillvalue=None,
+                attrs=dict(checksum=checksum))
+            return 'w'
+        return ''
+
     def execute(self):
         oq = self.oqparam
         self.set_param()
@@ -312,13 +406,18 @@ class EventBasedCalculator(base.HazardCalculator):
             self.datastore.create_dset('gmf_data/data', oq.gmf_data_dt())
             self.datastore.create_dset('gmf_data/sigma_epsilon',
                                        sig_eps_dt(oq.imtls))
-            self.datastore.create_dset(
-                'gmf_data/indices', hdf5.vuint32, shape=(N, 2), fillvalue=None)
+            if oq.compact_gmf_data:  # the fragments are compacted at the end
+                self.datastore.create_dset('gmf_data/fragments',
+                                           oq.gmf_data_dt())
+            else:
+                self.datastore.create_dset('gmf_data/indices', hdf5.vuint32,
+                                           shape=(N, 2), fillvalue=None)
             self.datastore.create_dset('gmf_data/events_by_sid', U32, (N,))
             self.datastore.create_dset('gmf_data/time_by_rup',
                                        time_dt, (nrups,), fillvalue=None)
         if oq.hazard_curves_from_gmfs:
             self.param['rlz_by_event'] = self.datastore['events']['rlz_id']
+        self.param['mean_stds'] = self.check_mean_stds(write=True)
 
         # compute_gmfs in parallel
         self.datastore.swmr_on()
@@ -332,19 +431,25 @@ class EventBasedCalculator(base.HazardCalculator):
         ).reduce(self.agg_dicts, self.acc0())
 
         if self.indices:
-            dset = self.datastore['gmf_data/indices']
             num_evs = self.datastore['gmf_data/events_by_sid']
             logging.info('Saving gmf_data/indices')
             with self.monitor('saving gmf_data/indices', measuremem=True):
                 self.datastore['gmf_data/imts'] = ' '.join(oq.imtls)
+                if not oq.compact_gmf_data:
+                    dset = self.datastore['gmf_data/indices']
                 for sid in self.sitecol.complete.sids:
                     start = numpy.array(self.indices[sid, 0])
                     stop = numpy.array(self.indices[sid, 1])
-                    dset[sid, 0] = start
-                    dset[sid, 1] = stop
+                    if not oq.compact_gmf_data:
+                        dset[sid, 0] = start
+                        dset[sid, 1] = stop
                     num_evs[sid] = (stop - start).sum()
             avg_events_by_sid = num_evs[()].sum() / N
             logging.info('Found ~%d GMVs per site', avg_events_by_sid)
+            if oq.compact_gmf_data:
+                logging.info('Compacting gmf_data')
+                with self.monitor('compacting gmf_data', measuremem=True):
+                    compact_gmf_data(self.datastore, self.indices)
         elif oq.ground_motion_fields:
             raise RuntimeError('No GMFs were generated, perhaps they were '
                                'all below the minimum_intensity threshold')
@@ -566,6 +566,21 @@ def extract_task_info(dstore, what):
         yield decode(name), dic[name]
 
 
+@extract.add('task_profile')
+def extract_task_profile(dstore, what):
+    """
+    Extracts the samples of the task profiler (requires `profile_tasks`).
+    Use it as /extract/task_profile?kind=classical
+    """
+    dic = group_array(dstore['task_profile'][()], 'taskname')
+    if 'kind' in what:
+        name = parse(what)['kind'][0]
+        yield name, dic[encode(name)]
+        return
+    for name in dic:
+        yield decode(name), dic[name]
+
+
 def _agg(losses, idxs):
     shp = losses.shape[1:]
     if not idxs:
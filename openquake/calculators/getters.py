@@ -19,6 +19,7 @@ import collections
 import itertools
 import operator
 import logging
+import time
 import unittest.mock as mock
 import numpy
 from openquake.baselib import hdf5, datastore, general
@@ -27,7 +28,6 @@ from openquake.hazardlib import calc, probability_map, stats
 from openquake.hazardlib.source.rupture import (
     EBRupture, BaseRupture, events_dt, RuptureProxy)
 from openquake.risklib.riskinput import rsi2str
-from openquake.commonlib.calc import _gmvs_to_haz_curve
 
 U16 = numpy.uint16
 U32 = numpy.uint32
@@ -114,14 +114,17 @@ class PmapGetter(object):
         self._pmap_by_grp = {}
         if 'poes' in self.dstore:
             # build probability maps restricted to the given sids
-            ok_sids = set(self.sids)
             for grp, dset in self.dstore['poes'].items():
-                ds = dset['array']
-                L, G = ds.shape[1:]
-                pmap = probability_map.ProbabilityMap(L, G)
-                for idx, sid in enumerate(dset['sids'][()]):
-                    if sid in ok_sids:
-                        pmap[sid] = probability_map.ProbabilityCurve(ds[idx])
+                sids = dset['sids'][()]
+                ok, = numpy.where(numpy.isin(sids, self.sids))
+                L, G = dset['array'].shape[1:]
+                if len(ok) == 0:
+                    pmap = probability_map.ProbabilityMap(L, G)
+                else:  # read only the slice containing the required sids
+                    start, stop = ok[0], ok[-1] + 1
+                    array = dset['array'][start:stop][ok - start]
+                    pmap = probability_map.ProbabilityMap.from_array(
+                        array, sids[ok])
                 self._pmap_by_grp[grp] = pmap
                 self.nbytes += pmap.nbytes
         return self._pmap_by_grp
@@ -265,11 +268,23 @@ class GmfDataGetter(collections.abc.Mapping):
             return
         self.dstore.open('r')  # if not already open
         try:
-            self.imts = self.dstore['gmf_data/imts'][()].split()
+            imts = self.dstore['gmf_data/imts'][()].split()
         except KeyError:  # engine < 3.3
-            self.imts = list(self.dstore['oqparam'].imtls)
+            imts = list(self.dstore['oqparam'].imtls)
         self.rlzs = self.dstore['events']['rlz_id']
-        self.data = self[self.sids[0]]
+        self.set_data(imts, self.rlzs, self[self.sids[0]])
+
+    def set_data(self, imts, rlzs, data):
+        """
+        Initialize the getter with already read data.
+
+        :param imts: a list of IMT strings
+        :param rlzs: an array with the realization index of each event
+        :param data: a dictionary rlzi -> GMF records
+        """
+        self.imts = imts
+        self.rlzs = rlzs
+        self.data = data
         if not self.data:  # no GMVs, return 0, counted in no_damage
             self.data = {rlzi: 0 for rlzi in range(self.num_rlzs)}
         # now some attributes set for API compatibility with the GmfGetter
@@ -303,6 +318,77 @@ class GmfDataGetter(collections.abc.Mapping):
         return len(self.sids)
 
 
+def is_compact(dstore):
+    """
+    :returns: True if gmf_data/indices contains a single (start, stop)
+              pair per site, as in scenario or compacted calculations
+    """
+    return dstore['gmf_data/indices'].dtype == U32
+
+
+def gen_gmf_blocks(indices, sids, max_rows):
+    """
+    Split the sites in blocks such that the contiguous slice of gmf_data
+    read by a :class:`GmfBlockGetter` has at most `max_rows` rows, unless
+    the block contains a single site. The slice includes the rows of the
+    sites in between, so the span of the block is considered, not only the
+    rows of the given sites.
+
+    :param indices: the (start, stop) pairs of a compact gmf_data
+    :param sids: an ordered sequence of site IDs
+    :param max_rows: the maximum number of rows read at once
+    :yields: lists of site IDs
+
+    >>> indices = numpy.array([[0, 2], [2, 10], [10, 11], [11, 12]])
+    >>> list(gen_gmf_blocks(indices, [0, 2, 3], 5))
+    [[0], [2, 3]]
+    """
+    block = []
+    for sid in sids:
+        if block and indices[sid, 1] - indices[block[0], 0] > max_rows:
+            yield block
+            block = []
+        block.append(sid)
+    if block:
+        yield block
+
+
+class GmfBlockGetter(object):
+    """
+    Read the GMFs of a block of sites with a single contiguous read and
+    yield initialized GmfDataGetters, one per site. Requires a compact
+    gmf_data (see :func:`is_compact`).
+
+    :param dstore: a DataStore instance
+    :param sids: an ordered sequence of site IDs
+    :param num_rlzs: the number of realizations
+    """
+    def __init__(self, dstore, sids, num_rlzs):
+        self.dstore = dstore
+        self.sids = sids
+        self.num_rlzs = num_rlzs
+
+    def __iter__(self):
+        self.dstore.open('r')  # if not already open
+        try:
+            imts = self.dstore['gmf_data/imts'][()].split()
+        except KeyError:  # engine < 3.3
+            imts = list(self.dstore['oqparam'].imtls)
+        rlzs = self.dstore['events']['rlz_id']
+        sid0 = self.sids[0]
+        idxs = self.dstore['gmf_data/indices'][sid0:self.sids[-1] + 1]
+        start = idxs[0, 0]
+        data = self.dstore['gmf_data/data'][start:idxs[-1, 1]]
+        for sid in self.sids:
+            i1, i2 = idxs[sid - sid0] - start
+            getter = GmfDataGetter(self.dstore, [sid], self.num_rlzs)
+            getter.set_data(imts, rlzs, group_by_rlz(data[i1:i2], rlzs))
+            yield getter
+
+    def __len__(self):
+        return len(self.sids)
+
+
 time_dt = numpy.dtype(
     [('rup_id', U32), ('nsites', U16), ('time', F32), ('task_no', U16)])
 
@@ -311,8 +397,14 @@ class GmfGetter(object):
     """
     An hazard getter with methods .get_gmfdata and .get_hazard returning
     ground motion values.
+
+    If `mean_stds` is 'r' the mean and standard deviations of the ruptures
+    are read from the dataset `mean_stds` stored next to the ruptures;
+    if it is 'w' they are computed and collected in .mean_stds_by_rup,
+    to be stored by the caller.
     """
-    def __init__(self, rupgetter, srcfilter, oqparam, amplifier=None):
+    def __init__(self, rupgetter, srcfilter, oqparam, amplifier=None,
+                 mean_stds=''):
         self.rlzs_by_gsim = rupgetter.rlzs_by_gsim
         self.rupgetter = rupgetter
         self.srcfilter = srcfilter
@@ -333,14 +425,24 @@ class GmfGetter(object):
         self.cmaker = ContextMaker(
             rupgetter.trt, rupgetter.rlzs_by_gsim, param)
         self.correl_model = oqparam.correl_model
+        self.mean_stds = mean_stds
+        self.mean_stds_by_rup = {}  # rup_id -> flat array
 
     def gen_computers(self, mon):
         """
         Yield a GmfComputer instance for each non-discarded rupture
         """
         trt, samples = self.rupgetter.trt, self.rupgetter.samples
+        cached = {}
         with mon:
             proxies = self.rupgetter.get_proxies()
+            if self.mean_stds == 'r':
+                with datastore.read(self.rupgetter.filename) as dstore:
+                    dset = dstore['mean_stds']
+                    for proxy in proxies:
+                        array = dset[proxy['id']]
+                        if len(array):  # empty for discarded ruptures
+                            cached[proxy['id']] = array
         for proxy in proxies:
             with mon:
                 ebr = proxy.to_ebr(trt, samples)
@@ -350,9 +452,12 @@ class GmfGetter(object):
                     computer = calc.gmf.GmfComputer(
                         ebr, sitecol, self.oqparam.imtls, self.cmaker,
                         self.oqparam.truncation_level, self.correl_model,
-                        self.amplifier)
+                        self.amplifier, cached.get(ebr.id))
                 except FarAwayRupture:
                     continue
+                if self.mean_stds == 'w':
+                    computer.mean_stds = ms = computer.get_mean_stds()
+                    self.mean_stds_by_rup[ebr.id] = ms.flatten()
                 # due to numeric errors ruptures within the maximum_distance
                 # when written, can be outside when read; I found a case with
                 # a distance of 99.9996936 km over a maximum distance of 100 km
@@ -370,18 +475,30 @@ class GmfGetter(object):
     def imts(self):
         return list(self.oqparam.imtls)
 
-    def get_gmfdata(self, mon):
+    def gen_gmfs(self, mon, max_rows=1_000_000):
         """
-        :returns: an array of the dtype (sid, eid, gmv)
+        :param mon: a Monitor instance
+        :param max_rows: maximum number of rows in the yielded arrays
+        :yields: arrays of the dtype (sid, eid, gmv), one rupture at the time
         """
-        alldata = []
         self.sig_eps = []
         self.times = []  # rup_id, nsites, dt
         for computer in self.gen_computers(mon):
-            data, dt = computer.compute_all(
-                self.min_iml, self.rlzs_by_gsim, self.sig_eps)
+            dt = 0
+            t0 = time.time()
+            for data in computer.gen_gmfs(self.min_iml, self.rlzs_by_gsim,
+                                          self.sig_eps, max_rows):
+                dt += time.time() - t0
+                yield data
+                t0 = time.time()
+            dt += time.time() - t0
             self.times.append((computer.rupture.id, len(computer.sids), dt))
-            alldata.append(data)
+
+    def get_gmfdata(self, mon):
+        """
+        :returns: an array of the dtype (sid, eid, gmv)
+        """
+        alldata = list(self.gen_gmfs(mon))
         if not alldata:
             return []
         return numpy.concatenate(alldata)
@@ -404,26 +521,32 @@ class GmfGetter(object):
         """
         oq = self.oqparam
         mon = monitor('getting ruptures', measuremem=True)
+        hc_mon = monitor('building hazard curves', measuremem=False)
+        counts = general.AccumDict(accum=0)  # key -> number of exceedances
+        alldata = []
+        for data in self.gen_gmfs(mon):
+            if oq.hazard_curves_from_gmfs:
+                # the exceedances are additive and can be counted by chunk
+                for sid, hazardr in self.get_hazard_by_sid(data).items():
+                    dic = group_by_rlz(hazardr, rlzs)
+                    for rlzi, array in dic.items():
+                        with hc_mon:
+                            gmvs = array['gmv']
+                            for imti, imt in enumerate(oq.imtls):
+                                imls = numpy.array(oq.imtls[imt])
+                                counts[rlzi, sid, imt] += (
+                                    gmvs[:, imti, None] >= imls).sum(axis=0)
+            if oq.ground_motion_fields:
+                alldata.append(data)
         hcurves = {}  # key -> poes
-        if oq.hazard_curves_from_gmfs:
-            hc_mon = monitor('building hazard curves', measuremem=False)
-            gmfdata = self.get_gmfdata(mon)  # returned later
-            hazard = self.get_hazard_by_sid(data=gmfdata)
-            for sid, hazardr in hazard.items():
-                dic = group_by_rlz(hazardr, rlzs)
-                for rlzi, array in dic.items():
-                    with hc_mon:
-                        gmvs = array['gmv']
-                        for imti, imt in enumerate(oq.imtls):
-                            poes = _gmvs_to_haz_curve(
-                                gmvs[:, imti], oq.imtls[imt],
-                                oq.ses_per_logic_tree_path)
-                            hcurves[rsi2str(rlzi, sid, imt)] = poes
+        for (rlzi, sid, imt), num_exceeding in counts.items():
+            hcurves[rsi2str(rlzi, sid, imt)] = 1 - numpy.exp(
+                - num_exceeding / oq.ses_per_logic_tree_path)
         if not oq.ground_motion_fields:
             return dict(gmfdata=(), hcurves=hcurves)
-        gmfdata = self.get_gmfdata(mon)
-        if len(gmfdata) == 0:
+        if not alldata:
             return dict(gmfdata=[])
+        gmfdata = numpy.concatenate(alldata)
         indices = []
         gmfdata.sort(order=('sid', 'eid'))
         start = stop = 0
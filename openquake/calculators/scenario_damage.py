@@ -27,6 +27,7 @@ U16 = numpy.uint16
 U32 = numpy.uint32
 F32 = numpy.float32
 F64 = numpy.float64
+MAX_SAMPLES = 1_000_000  # max number of uniform numbers generated at once
 
 
 def floats_in(numbers):
@@ -39,16 +40,28 @@ def floats_in(numbers):
 
 def bin_ddd(fractions, n, seed):
     """
-    Converting fractions into discrete damage distributions using bincount
-    and numpy.random.choice
+    Converting fractions into discrete damage distributions by counting
+    how many of n uniform random numbers per event fall in each damage
+    state. This is a vectorized version of calling numpy.random.choice
+    for each event and it consumes the same random numbers, so the results
+    are the same.
     """
     n = int(n)
-    D = fractions.shape[1]  # shape (E, D)
-    ddd = numpy.zeros(fractions.shape, U32)
+    E, D = fractions.shape
+    ddd = numpy.zeros((E, D), U32)
     numpy.random.seed(seed)
-    for e, frac in enumerate(fractions):
-        ddd[e] = numpy.bincount(
-            numpy.random.choice(D, n, p=frac/frac.sum()), minlength=D)
+    cdf = (fractions / fractions.sum(axis=1)[:, None]).cumsum(axis=1)
+    cdf /= cdf[:, -1:]
+    # the events are managed in blocks, to keep the memory under control
+    step = max(MAX_SAMPLES // max(n, 1), 1)
+    for start in range(0, E, step):
+        stop = min(start + step, E)
+        uniform = numpy.random.random_sample((stop - start, n))
+        counts = numpy.full((stop - start, D), n, U32)  # cumulative
+        for d in range(D - 1):
+            counts[:, d] = (uniform < cdf[start:stop, d, None]).sum(axis=1)
+        ddd[start:stop, 0] = counts[:, 0]
+        ddd[start:stop, 1:] = numpy.diff(counts, axis=1)
     return ddd
 
 
@@ -102,37 +115,47 @@ def scenario_damage(riskinputs, crmodel, param, monitor):
         result = dict(d_asset=[])
         for name in consequences:
             result[name + '_by_asset'] = []
-        ddic = AccumDict(accum=numpy.zeros((L, D - 1), F32))  # aid,eid->dd
+        aids = ri.aids
+        aeds = []
         with haz_mon:
             ri.hazard_getter.init()
         for out in ri.gen_outputs(crmodel, monitor):
             with rsk_mon:
                 r = out.rlzi
+                E = len(out.eids)
+                dd = numpy.zeros((len(aids), E, L, D - 1), U32)
+                by_event = {name: numpy.zeros((E, L)) for name in consequences}
                 for l, loss_type in enumerate(crmodel.loss_types):
-                    for asset, fractions in zip(ri.assets, out[loss_type]):
+                    for a, (asset, fractions) in enumerate(
+                            zip(ri.assets, out[loss_type])):
                         aid = asset['ordinal']
                         ddds = make_ddd(fractions, asset['number'], seed + aid)
-                        for e, ddd in enumerate(ddds):
-                            eid = out.eids[e]
-                            ddic[aid, eid][l] = ddd[1:]
-                            d_event[eid][l] += ddd[1:]
+                        dd[a, :, l] = ddds[:, 1:]
                         if make_ddd is approx_ddd:
                             ms = mean_std(fractions * asset['number'])
                         else:
                             ms = mean_std(ddds)
-                        result['d_asset'].append((l, r, asset['ordinal'], ms))
+                        result['d_asset'].append((l, r, aid, ms))
                         # TODO: use the ddd, not the fractions in compute_csq
                         csq = crmodel.compute_csq(asset, fractions, loss_type)
                         for name, values in csq.items():
                             result[name + '_by_asset'].append(
-                                (l, r, asset['ordinal'], mean_std(values)))
-                            by_event = res[name + '_by_event']
-                            for eid, value in zip(out.eids, values):
-                                by_event[eid][l] += value
+                                (l, r, aid, mean_std(values)))
+                            by_event[name][:, l] += values
+                # accumulate by event, summing on the assets
+                for e, (eid, dmg) in enumerate(zip(out.eids, dd.sum(axis=0))):
+                    d_event[eid] += dmg
+                    for name in consequences:
+                        res[name + '_by_event'][eid] += by_event[name][e]
+                aed = numpy.zeros(dd.shape[:2], param['aed_dt'])
+                aed['aid'] = aids[:, None]
+                aed['eid'] = out.eids
+                aed['dd'] = dd
+                aeds.append(aed.flatten())
         with rsk_mon:
-            result['aed'] = aed = numpy.zeros(len(ddic), param['aed_dt'])
-            for i, ((aid, eid), dd) in enumerate(sorted(ddic.items())):
-                aed[i] = (aid, eid, dd)
+            aed = numpy.concatenate(aeds) if aeds else numpy.zeros(
+                0, param['aed_dt'])
+            result['aed'] = aed[numpy.lexsort((aed['eid'], aed['aid']))]
         yield result
     yield res
 
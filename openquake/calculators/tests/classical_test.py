@@ -20,8 +20,10 @@ import os
 import unittest
 import unittest.mock as mock
 import numpy
-from openquake.baselib import parallel, general
+from openquake.baselib import parallel, general, hdf5
 from openquake.hazardlib import InvalidFile
+from openquake.hazardlib.tom import PoissonTOM
+from openquake.commonlib import calc
 from openquake.calculators.views import view, rst_table
 from openquake.calculators.export import export
 from openquake.calculators.extract import extract
@@ -81,6 +83,14 @@ class ClassicalTestCase(CalculatorTestCase):
             self.run_calc(case_1.__file__, 'job.ini', minimum_magnitude='4.5')
         self.assertEqual(str(ctx.exception), 'All sources were discarded!?')
 
+    def test_task_profile(self):
+        self.run_calc(case_1.__file__, 'job.ini', profile_tasks='true')
+        prof = view('task_profile', self.calc.datastore)
+        self.assertIn('classical_split_filter', prof)
+        self.assertIn('max_rss_mb', prof)
+        dic = dict(extract(self.calc.datastore, 'task_profile'))
+        self.assertGreater(len(dic['classical_split_filter']), 1)
+
     def test_wrong_smlt(self):
         with self.assertRaises(InvalidFile):
             self.run_calc(case_1.__file__, 'job_wrong.ini')
@@ -102,6 +112,19 @@ class ClassicalTestCase(CalculatorTestCase):
         got = view('pmap:grp-00', self.calc.datastore)
         self.assertEqual(got, '<ProbabilityMap 1, 4, 1>')
 
+        # the group checksums depend on the content of the reqv files
+        # and not on the identity of the temporal occurrence model
+        for sg in self.calc.csm.src_groups:
+            sg.temporal_occurrence_model = PoissonTOM(1.)
+        checksums = self.calc.get_grp_checksums()
+        for sg in self.calc.csm.src_groups:
+            sg.temporal_occurrence_model = PoissonTOM(1.)
+        self.assertEqual(self.calc.get_grp_checksums(), checksums)
+        reqv = self.calc.oqparam.inputs['reqv']
+        asc, sta = 'active shallow crust', 'stable shallow crust'
+        reqv[asc], reqv[sta] = reqv[sta], reqv[asc]
+        self.assertNotEqual(self.calc.get_grp_checksums(), checksums)
+
         # check view inputs
         lines = view('inputs', self.calc.datastore).splitlines()
         self.assertEqual(len(lines), 9)
@@ -145,6 +168,32 @@ class ClassicalTestCase(CalculatorTestCase):
             case_7.__file__, 'job.ini', mean_hazard_curves='false',
             calculation_mode='preclassical',  poes='0.1')
 
+    def get_hcurves(self, calc):
+        with hdf5.File(calc.datastore.filename, 'r') as h5:
+            return h5['hcurves-stats'][()]
+
+    def test_incremental(self):
+        # rerunning case_7 with incremental_calculation_id reuses the PoEs
+        # of all the source groups and gives the same curves
+        self.run_calc(case_7.__file__, 'job.ini', max_sites_disagg='0')
+        parent = self.calc
+        expected = self.get_hcurves(parent)
+        calc_id = str(parent.datastore.calc_id)
+        self.run_calc(case_7.__file__, 'job.ini', max_sites_disagg='0',
+                      incremental_calculation_id=calc_id)
+        self.assertEqual(len(self.calc.reused), 2)
+        numpy.testing.assert_allclose(self.get_hcurves(self.calc), expected)
+
+        # changing the checksum of a group in the parent forces the
+        # recomputation of that group only
+        parent.datastore.close()
+        with hdf5.File(parent.datastore.filename, 'r+') as h5:
+            h5.save_attrs('poes/grp-01', {}, checksum=0)
+        self.run_calc(case_7.__file__, 'job.ini', max_sites_disagg='0',
+                      incremental_calculation_id=calc_id)
+        self.assertEqual(list(self.calc.reused), [0])
+        numpy.testing.assert_allclose(self.get_hcurves(self.calc), expected)
+
     def test_case_8(self):
         self.assert_curves_ok(
             ['hazard_curve-smltp_b1_b2-gsimltp_b1.csv',
@@ -206,6 +255,18 @@ class ClassicalTestCase(CalculatorTestCase):
                           '0.0269', '0.0376', '0.0527', '0.0738', '0.103',
                           '0.145', '0.203', '0.284'))
 
+        # test the hazard maps of the individual realizations on all sites
+        self.run_calc(case_13.__file__, 'job.ini', individual_curves='true')
+        hcurves = self.calc.datastore['hcurves-rlzs'][()]  # shape (N, R, L)
+        hmaps = self.calc.datastore['hmaps-rlzs'][()]  # shape (N, R, M, P)
+        imtls = self.calc.oqparam.imtls
+        for m, imt in enumerate(imtls):
+            for r in range(hcurves.shape[1]):
+                expected = calc.compute_hazard_maps(
+                    hcurves[:, r, imtls(imt)], imtls[imt], [.1])
+                numpy.testing.assert_allclose(
+                    hmaps[:, r, m], expected, rtol=1E-5)
+
     def test_case_14(self):
         # test classical with 2 gsims and 1 sample
         self.assert_curves_ok(['hazard_curve-rlz-000_PGA.csv'],
@@ -18,9 +18,11 @@
 import os
 import sys
 import unittest
+import unittest.mock as mock
 import numpy
 from openquake.baselib.general import gettemp
 from openquake.hazardlib.probability_map import combine
+from openquake.hazardlib.calc import disagg
 from openquake.calculators import getters
 from openquake.calculators.views import view
 from openquake.calculators.export import export
@@ -108,6 +110,15 @@ class DisaggregationTestCase(CalculatorTestCase):
         self.assertEqual(aw.dtype.names, ('site_id', 'lon', 'lat', 'poes'))
         self.assertEqual(aw['poes'].shape, (2, 15))  # 2 rows
 
+        # building the matrices one site at the time gives the same outputs
+        hc_id = self.calc.datastore['oqparam'].hazard_calculation_id
+        with mock.patch.object(disagg, 'MAXBYTES', 1):
+            self.run_calc(case_2.__file__, 'job.ini',
+                          hazard_calculation=str(hc_id))
+        for fname in export(('disagg', 'csv'), self.calc.datastore):
+            self.assertEqualFiles(
+                'expected_output/%s' % strip_calc_id(fname), fname)
+
     def test_case_3(self):
         # a case with poes_disagg too large
         with self.assertRaises(SystemExit) as ctx:
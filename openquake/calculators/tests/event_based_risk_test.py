@@ -26,6 +26,7 @@ from openquake.calculators.views import view, rst_table
 from openquake.calculators.tests import CalculatorTestCase, strip_calc_id
 from openquake.calculators.export import export
 from openquake.calculators.extract import extract
+from openquake.calculators import getters
 from openquake.qa_tests_data.event_based_risk import (
     case_1, case_2, case_3, case_4, case_4a, case_6c, case_master, case_miriam,
     occupants, case_1f, case_1g, case_7a)
@@ -111,7 +112,7 @@ class EventBasedRiskTestCase(CalculatorTestCase):
 
         aw = extract(self.calc.datastore, 'agg_losses/structural')
         self.assertEqual(aw.stats, ['mean'])
-        self.assertEqual(aw.array, numpy.float32([779.6024]))
+        self.assertEqual(aw.array, numpy.float32([779.5988]))
 
         fnames = export(('tot_curves-stats', 'csv'), self.calc.datastore)
         for fname in fnames:
@@ -203,6 +204,39 @@ class EventBasedRiskTestCase(CalculatorTestCase):
             'No GMFs were generated, perhaps they were all below the '
             'minimum_intensity threshold')
 
+    def test_case_2_compact(self):
+        # compacting gmf_data must not change the GMFs of each site
+        self.run_calc(case_2.__file__, 'job.ini', concurrent_tasks='4')
+        gmfs = {sid: getters.GmfDataGetter(self.calc.datastore, [sid], 1)
+                for sid in self.calc.sitecol.sids}
+        for getter in gmfs.values():
+            getter.init()
+        avg_losses = self.calc.datastore['avg_losses-rlzs'][()]
+        self.run_calc(case_2.__file__, 'job.ini', concurrent_tasks='4',
+                      compact_gmf_data='true')
+        dstore = self.calc.datastore
+        self.assertTrue(getters.is_compact(dstore))
+        self.assertEqual(len(dstore['gmf_data/fragments']), 0)
+        sids = dstore['gmf_data/data']['sid']
+        self.assertTrue((numpy.diff(sids) >= 0).all())  # sorted
+        for getter in getters.GmfBlockGetter(dstore, sorted(gmfs), 1):
+            [sid] = getter.sids
+            for rlz, data in gmfs[sid].data.items():
+                numpy.testing.assert_equal(getter.data[rlz], data)
+        numpy.testing.assert_equal(
+            dstore['avg_losses-rlzs'][()], avg_losses)
+
+    def test_gmf_blocks_sparse(self):
+        # the sites without assets between two sites are read too
+        nrows = numpy.array([3, 100, 100, 100, 2, 2, 50, 1])
+        stops = numpy.cumsum(nrows)
+        indices = numpy.array([stops - nrows, stops]).T
+        blocks = list(getters.gen_gmf_blocks(indices, [0, 4, 5, 7], 10))
+        self.assertEqual(blocks, [[0], [4, 5], [7]])
+        for block in blocks:
+            span = indices[block[-1], 1] - indices[block[0], 0]
+            self.assertLessEqual(span, 10)
+
     def test_case_2_sampling(self):
         self.run_calc(case_2.__file__, 'job_sampling.ini')
         self.assertEqual(len(self.calc.datastore['events']), 20)
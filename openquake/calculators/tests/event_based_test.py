@@ -185,6 +185,28 @@ class EventBasedTestCase(CalculatorTestCase):
         [fname, _, _] = out['gmf_data', 'csv']
         self.assertEqualFiles('expected/minimum-intensity-gmf-data.csv', fname)
 
+    def test_mean_stds_cache(self):
+        self.run_calc(case_1.__file__, 'job.ini', cache_mean_stds='true')
+        parent = self.calc.datastore
+        self.assertEqual(self.calc.param['mean_stds'], 'w')
+        expected = parent['gmf_data/data'][()]
+        expected.sort(order=['eid', 'sid'])
+
+        # the GMFs computed from the cached mean_stds are the same
+        self.run_calc(case_1.__file__, 'job.ini',
+                      hazard_calculation_id=str(parent.calc_id))
+        self.assertEqual(self.calc.param['mean_stds'], 'r')
+        got = self.calc.datastore['gmf_data/data'][()]
+        got.sort(order=['eid', 'sid'])
+        numpy.testing.assert_equal(got, expected)
+
+        # the cache is rebuilt if the IMTs are different
+        imtls = '{"PGA": [0.1, 0.4, 0.6], "SA(0.1)": [0.1, 0.4, 0.6]}'
+        self.run_calc(case_1.__file__, 'job.ini',
+                      intensity_measure_types_and_levels=imtls,
+                      hazard_calculation_id=str(parent.calc_id))
+        self.assertEqual(self.calc.param['mean_stds'], 'w')
+
     def test_case_2(self):
         out = self.run_calc(case_2.__file__, 'job.ini', exports='csv')
         [gmfs, sig_eps, _sitefile] = out['gmf_data', 'csv']
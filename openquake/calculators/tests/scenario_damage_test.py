@@ -17,6 +17,7 @@
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 
 import os
+from unittest import mock
 import numpy
 
 from openquake.baselib.general import fast_agg3
@@ -29,6 +30,7 @@ from openquake.calculators.tests import CalculatorTestCase, strip_calc_id
 from openquake.calculators.extract import extract
 from openquake.calculators.export import export
 from openquake.calculators.views import view
+from openquake.calculators.scenario_damage import bin_ddd
 
 aac = numpy.testing.assert_allclose
 
@@ -184,3 +186,18 @@ RM       4_000
         fnames = export(('dmg_by_asset', 'csv'), self.calc.datastore)
         for i, fname in enumerate(fnames):
             self.assertEqualFiles('expected/dmg_by_asset-%d.csv' % i, fname)
+
+    def test_bin_ddd(self):
+        # the vectorized bin_ddd must give the same results as the
+        # original implementation calling numpy.random.choice per event
+        fractions = numpy.random.RandomState(42).random_sample((50, 4))
+        numpy.random.seed(7)
+        expected = numpy.zeros((50, 4), numpy.uint32)
+        for e, frac in enumerate(fractions):
+            expected[e] = numpy.bincount(
+                numpy.random.choice(4, 30, p=frac/frac.sum()), minlength=4)
+        numpy.testing.assert_equal(bin_ddd(fractions, 30, 7), expected)
+        # managing the events in blocks does not change the results
+        with mock.patch(
+                'openquake.calculators.scenario_damage.MAX_SAMPLES', 100):
+            numpy.testing.assert_equal(bin_ddd(fractions, 30, 7), expected)
@@ -527,6 +527,42 @@ def view_task_info(token, dstore):
     return rst_table(data)
 
 
+@view.add('task_profile')
+def view_task_profile(token, dstore):
+    """
+    Display the peak memory, the mean CPU usage and the dominant operation
+    of the profiled tasks (requires `profile_tasks = true` in the job.ini).
+    It is possible to get the samples for a specific task with a command
+    like this one, for a classical calculation::
+
+      $ oq show task_profile:classical:0
+    """
+    if 'task_profile' not in dstore:
+        return 'Not available'
+    task_profile = dstore['task_profile']
+    task_profile.refresh()
+    args = token.split(':')[1:]  # called as task_profile:task_name:task_no
+    if args:
+        task, taskno = args
+        array = get_array(task_profile[()], taskname=task.encode('utf8'),
+                          task_no=int(taskno))
+        return rst_table(array[['time_sec', 'rss_mb', 'cpu_pct',
+                                'operation']])
+
+    data = ['taskname task_no duration max_rss_mb mean_cpu_pct '
+            'main_operation'.split()]
+    for (task, taskno), arr in sorted(
+            group_array(task_profile[()], 'taskname', 'task_no').items()):
+        ops = arr['operation'][arr['operation'] != b'']  # skip idle samples
+        uniq, counts = numpy.unique(ops, return_counts=True)
+        mainop = decode(uniq[counts.argmax()]) if len(uniq) else ''
+        data.append((decode(task), taskno, arr['time_sec'].max(),
+                     arr['rss_mb'].max(), arr['cpu_pct'].mean(), mainop))
+    if len(data) == 1:
+        return 'Not available'
+    return rst_table(data)
+
+
 @view.add('task_durations')
 def view_task_durations(token, dstore):
     """
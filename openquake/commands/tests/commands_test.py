@@ -17,6 +17,7 @@
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 import os
 import sys
+import logging
 import unittest.mock as mock
 import shutil
 import zipfile
@@ -460,6 +461,21 @@ class DbTestCase(unittest.TestCase):
                 pass
 
 
+class LogsTestCase(unittest.TestCase):
+    def test_batched_logs(self):
+        # the records are sent to the db in batches, at the latest when
+        # exiting from logs.handle
+        dbserver.ensure_on()
+        job_id = commonlib.logs.init('job')
+        with commonlib.logs.handle(job_id, 'info', os.devnull):
+            for i in range(5):
+                logging.warning('message #%d', i)
+            logging.debug('not stored')  # below INFO
+        lines = commonlib.logs.dbcmd('get_log', job_id)
+        self.assertEqual([line.split('] ')[1] for line in lines],
+                         ['message #%d' % i for i in range(5)])
+
+
 class EngineRunJobTestCase(unittest.TestCase):
     def test_ebr(self):
         # test a single case of `run_job`, but it is the most complex one,
@@ -250,6 +250,8 @@ class RuptureSerializer(object):
         """
         self.nruptures += len(rup_array)
         offset = len(self.datastore['rupgeoms'])
+        # NB: the received array can be read-only, so it is copied
+        rup_array.array = rup_array.array.copy()
         rup_array.array['gidx1'] += offset
         rup_array.array['gidx2'] += offset
         hdf5.extend(self.datastore['ruptures'], rup_array)
@@ -21,6 +21,9 @@ Set up some system-wide loggers
 import os.path
 import socket
 import logging
+import threading
+import traceback
+import collections
 from datetime import datetime
 from contextlib import contextmanager
 from openquake.baselib import zeromq, config, parallel, datastore
@@ -32,6 +35,7 @@ LEVELS = {'debug': logging.DEBUG,
           'critical': logging.CRITICAL}
 
 DBSERVER_PORT = int(os.environ.get('OQ_DBSERVER_PORT') or config.dbserver.port)
+FLUSH_INTERVAL = 1.  # seconds between two writes of the logs on the db
 
 
 def dbcmd(action, *args):
@@ -100,17 +104,60 @@ class LogFileHandler(logging.FileHandler):
 
 class LogDatabaseHandler(logging.Handler):
     """
-    Log stream handler
+    Log handler storing the records in the database. The records are
+    buffered and sent in batches by a background thread every
+    `flush_interval` seconds, so that the calculation never waits for the
+    DbServer; the remaining records are sent when the handler is closed.
     """
-    def __init__(self, job_id):
+    def __init__(self, job_id, flush_interval=FLUSH_INTERVAL):
         super().__init__()
         self.job_id = job_id
+        self.flush_interval = flush_interval
+        self.pid = os.getpid()
+        self.records = collections.deque()
+        self.flush_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self.flusher.start()
 
     def emit(self, record):  # pylint: disable=E0202
         if record.levelno >= logging.INFO:
-            dbcmd('log', self.job_id, datetime.utcnow(), record.levelname,
-                  '%s/%s' % (record.processName, record.process),
-                  record.getMessage())
+            rec = (self.job_id, datetime.utcnow(), record.levelname,
+                   '%s/%s' % (record.processName, record.process),
+                   record.getMessage())
+            if os.getpid() == self.pid:
+                self.records.append(rec)
+            else:  # forked process, there is no flusher thread
+                dbcmd('log', *rec)
+
+    def _flush_loop(self):
+        while not self.stopped.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """
+        Send the buffered records to the database with a single command
+        """
+        with self.flush_lock:
+            rows = []
+            while self.records:
+                rows.append(self.records.popleft())
+            if rows:
+                try:
+                    dbcmd('log_many', rows)
+                except Exception:
+                    traceback.print_exc()
+
+    def close(self):
+        """
+        Stop the flusher thread and send the remaining records
+        """
+        self.stopped.set()
+        if (self.flusher.is_alive() and
+                threading.current_thread() is not self.flusher):
+            self.flusher.join()
+        self.flush()
+        super().close()
 
 
 @contextmanager
@@ -145,6 +192,7 @@ def handle(job_id, log_level='info', log_file=None):
             logging.root.warn('The log file %s is empty!?' % log_file)
         for handler in handlers:
             logging.root.removeHandler(handler)
+            handler.close()
 
 
 def init(calc_id='nojob', level=logging.INFO):
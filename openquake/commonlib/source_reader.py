@@ -24,11 +24,16 @@ import logging
 import zlib
 import numpy
 
-from openquake.baselib import parallel, general
+from openquake.baselib import parallel, general, hdf5, datastore, __version__
 from openquake.hazardlib import nrml, sourceconverter, calc, InvalidFile
 from openquake.hazardlib.lt import apply_uncertainties
 
 TWO16 = 2 ** 16  # 65,536
+# SourceConverter attributes affecting the parsed sources
+CONVERTER_PARAMS = (
+    'investigation_time', 'rupture_mesh_spacing', 'complex_fault_mesh_spacing',
+    'width_of_mfd_bin', 'area_source_discretization', 'minimum_magnitude',
+    'spinning_floating', 'source_id', 'discard_trts')
 
 
 def random_filtered_sources(sources, srcfilter, seed):
@@ -47,15 +52,81 @@ def random_filtered_sources(sources, srcfilter, seed):
     return []
 
 
-def read_source_model(fname, converter, srcfilter, monitor):
+def get_cache_path(fname, converter, cachedir):
+    """
+    :param fname: path to a source model XML file
+    :param converter: SourceConverter
+    :param cachedir: directory containing the cached source models
+    :returns: the path of the cache file, depending on the content of the
+              source model file, on the converter parameters and on the
+              engine version
+    """
+    with open(fname, 'rb') as f:
+        checksum = zlib.adler32(f.read())
+    params = [__version__] + [
+        '%s = %s' % (name, getattr(converter, name))
+        for name in CONVERTER_PARAMS]
+    checksum = zlib.adler32('\n'.join(params).encode('utf8'), checksum)
+    name = os.path.splitext(os.path.basename(fname))[0]
+    return os.path.join(cachedir, '%s-%d.hdf5' % (name, checksum))
+
+
+def save_cached(sm, path):
+    """
+    Save a SourceModel in the given cache file, by using the HDF5
+    serialization of the underlying SourceGroups.
+
+    :param sm: a SourceModel instance
+    :param path: path to the cache file
+    """
+    for sg in sm.src_groups:
+        for src in sg:
+            if hasattr(src, 'get_placements'):  # fault sources
+                src.get_placements()  # cache the rupture placements
+    tmp = path + '.%d.tmp' % os.getpid()
+    with hdf5.File(tmp, 'w') as h5:
+        for i, sg in enumerate(sm.src_groups):
+            h5['grp-%02d' % i] = sg
+        h5.save_attrs('/', dict(
+            name=sm.name, investigation_time=sm.investigation_time or '',
+            start_time=sm.start_time or '', num_groups=len(sm.src_groups)))
+    os.replace(tmp, path)  # atomic, safe for concurrent jobs
+
+
+def read_cached(path):
+    """
+    :param path: path to a cache file written by :func:`save_cached`
+    :returns: a SourceModel instance
+    """
+    with hdf5.File(path, 'r') as h5:
+        attrs = dict(h5.attrs)
+        groups = [h5['grp-%02d' % i] for i in range(attrs['num_groups'])]
+    return nrml.SourceModel(groups, attrs['name'],
+                            attrs['investigation_time'] or None,
+                            attrs['start_time'] or None)
+
+
+def read_source_model(fname, converter, srcfilter, cachedir, monitor):
     """
     :param fname: path to a source model XML file
     :param converter: SourceConverter
     :param srcfilter: None unless OQ_SAMPLE_SOURCES is set
+    :param cachedir: None unless cache_source_models is set
     :param monitor: a Monitor instance
     :returns: a SourceModel instance
     """
-    [sm] = nrml.read_source_models([fname], converter)
+    if cachedir:
+        path = get_cache_path(fname, converter, cachedir)
+        if os.path.exists(path):
+            with monitor('reading cached source model', measuremem=False):
+                sm = read_cached(path)
+            sm.fname = fname
+        else:
+            [sm] = nrml.read_source_models([fname], converter)
+            with monitor('caching source model', measuremem=False):
+                save_cached(sm, path)
+    else:
+        [sm] = nrml.read_source_models([fname], converter)
     if srcfilter:  # if OQ_SAMPLE_SOURCES is set sample the close sources
         for i, sg in enumerate(sm.src_groups):
             sg.sources = random_filtered_sources(sg.sources, srcfilter, i)
@@ -116,9 +187,15 @@ def get_csm(oq, full_lt, h5=None):
     dist = ('no' if os.environ.get('OQ_DISTRIBUTE') == 'no'
             else 'processpool')
     # NB: h5 is None in logictree_test.py
+    if oq.cache_source_models:
+        cachedir = os.path.join(datastore.get_datadir(), 'cache')
+        os.makedirs(cachedir, exist_ok=True)
+        logging.info('Using the source model cache in %s', cachedir)
+    else:
+        cachedir = None
     allargs = []
     for fname in full_lt.source_model_lt.info.smpaths:
-        allargs.append((fname, converter, srcfilter))
+        allargs.append((fname, converter, srcfilter, cachedir))
     smdict = parallel.Starmap(read_source_model, allargs, distribute=dist,
                               h5=h5 if h5 else None).reduce()
     if len(smdict) > 1:  # really parallel
@@ -181,6 +258,16 @@ def _build_groups(full_lt, smdict):
     return groups
 
 
+def get_checksum(src):
+    """
+    :param src: a source object
+    :returns: a 32 bit checksum of the source, independent from its grp_id
+    """
+    dic = {k: v for k, v in vars(src).items()
+           if k not in 'grp_id samples' and k != '_placements'}
+    return zlib.adler32(pickle.dumps(dic, protocol=4))
+
+
 def reduce_sources(sources_with_same_id):
     """
     :param sources_with_same_id: a list of sources with the same source_id
@@ -188,8 +275,7 @@ def reduce_sources(sources_with_same_id):
     """
     out = []
     for src in sources_with_same_id:
-        dic = {k: v for k, v in vars(src).items() if k not in 'grp_id samples'}
-        src.checksum = zlib.adler32(pickle.dumps(dic, protocol=4))
+        src.checksum = get_checksum(src)
     for srcs in general.groupby(
             sources_with_same_id, operator.attrgetter('checksum')).values():
         src = srcs[0]
@@ -220,6 +306,8 @@ def _get_csm(full_lt, groups):
         for srcs in general.groupby(acc[trt], key).values():
             if len(srcs) > 1:
                 srcs = reduce_sources(srcs)
+            else:  # the checksum is used in incremental calculations
+                srcs[0].checksum = get_checksum(srcs[0])
             for src in srcs:
                 src.id = idx
                 src._wkt = src.wkt()
@@ -228,6 +316,7 @@ def _get_csm(full_lt, groups):
         dic[trt] = sourceconverter.SourceGroup(trt, lst)
     for ag in atomic:
         for src in ag:
+            src.checksum = get_checksum(src)
             src.id = idx
             src._wkt = src.wkt()
             idx += 1
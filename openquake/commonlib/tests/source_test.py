@@ -17,7 +17,10 @@
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import shutil
+import tempfile
 import unittest
+from unittest import mock
 from io import BytesIO
 
 import numpy
@@ -741,6 +744,26 @@ Subduction Interface,b3,[SadighEtAl1997],w=1.0>''')
         # counting the sources in each TRT model (after splitting)
         self.assertEqual([9, 18], list(map(len, csm.src_groups)))
 
+    def test_cache(self):
+        oqparam = tests.get_oqparam('classical_job.ini')
+        oqparam.cache_source_models = True
+        tmpdir = tempfile.mkdtemp()
+        env = dict(OQ_DATADIR=tmpdir, OQ_DISTRIBUTE='no')
+        with mock.patch.dict(os.environ, env):
+            csm1 = readinput.get_composite_source_model(oqparam)
+            [cached] = os.listdir(os.path.join(tmpdir, 'cache'))
+            with mock.patch('openquake.hazardlib.nrml.read_source_models') \
+                    as read:
+                csm2 = readinput.get_composite_source_model(oqparam)
+        self.assertEqual(read.call_count, 0)  # read from the cache
+        self.assertEqual(len(csm1.src_groups), len(csm2.src_groups))
+        for grp1, grp2 in zip(csm1.src_groups, csm2.src_groups):
+            self.assertEqual(grp1.trt, grp2.trt)
+            self.assertEqual(grp1.max_mag, grp2.max_mag)
+            self.assertEqual([src.checksum for src in grp1],
+                             [src.checksum for src in grp2])
+        shutil.rmtree(tmpdir)
+
     def test_oversampling(self):
         from openquake.qa_tests_data.classical import case_17
         oq = readinput.get_oqparam(
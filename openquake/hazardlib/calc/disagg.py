@@ -28,7 +28,7 @@ import scipy.stats
 
 from openquake.hazardlib import pmf, contexts
 from openquake.baselib import hdf5, performance
-from openquake.baselib.general import pack, groupby
+from openquake.baselib.general import pack, groupby, block_splitter
 from openquake.hazardlib.calc import filters
 from openquake.hazardlib.geo.geodetic import npoints_between
 from openquake.hazardlib.geo.utils import get_longitudinal_extent
@@ -37,6 +37,8 @@ from openquake.hazardlib.site import SiteCollection
 from openquake.hazardlib.gsim.base import (
     ContextMaker, get_mean_std, to_distribution_values)
 
+MAXBYTES = 1E9  # max memory of the matrices of a block of sites
+
 
 def _eps3(truncation_level, n_epsilons):
     # NB: instantiating truncnorm is slow and calls the infamous "doccer"
@@ -144,27 +146,19 @@ def get_bins(bin_edges, sid):
     return mag_bins, dist_bins, lon_bins[sid], lat_bins[sid], eps_bins
 
 
-# this is fast
-def _build_disagg_matrix(bdata, bins):
-    """
-    :param bdata: a dictionary of probabilities of no exceedence
-    :param bins: bin edges
-    :returns: a 7D-matrix of shape (#magbins, #distbins, #lonbins,
-                                    #latbins, #epsbins, #imts, #poes)
-    """
-    mag_bins, dist_bins, lon_bins, lat_bins, eps_bins = bins
-    dim1, dim2, dim3, dim4, dim5 = shape = [len(b)-1 for b in bins]
-
+def _digitize(mags, dists, lons, lats, bins):
     # find bin indexes of rupture attributes; bins are assumed closed
     # on the lower bound, and open on the upper bound, that is [ )
     # longitude values need an ad-hoc method to take into account
     # the 'international date line' issue
     # the 'minus 1' is needed because the digitize method returns the
     # index of the upper bound of the bin
-    mags_idx = numpy.digitize(bdata.mags+pmf.PRECISION, mag_bins) - 1
-    dists_idx = numpy.digitize(bdata.dists, dist_bins) - 1
-    lons_idx = _digitize_lons(bdata.lons, lon_bins)
-    lats_idx = numpy.digitize(bdata.lats, lat_bins) - 1
+    mag_bins, dist_bins, lon_bins, lat_bins, eps_bins = bins
+    dim1, dim2, dim3, dim4, dim5 = [len(b)-1 for b in bins]
+    mags_idx = numpy.digitize(mags+pmf.PRECISION, mag_bins) - 1
+    dists_idx = numpy.digitize(dists, dist_bins) - 1
+    lons_idx = _digitize_lons(lons, lon_bins)
+    lats_idx = numpy.digitize(lats, lat_bins) - 1
 
     # because of the way numpy.digitize works, values equal to the last bin
     # edge are associated to an index equal to len(bins) which is not a
@@ -174,7 +168,20 @@ def _build_disagg_matrix(bdata, bins):
     dists_idx[dists_idx == dim2] = dim2 - 1
     lons_idx[lons_idx == dim3] = dim3 - 1
     lats_idx[lats_idx == dim4] = dim4 - 1
+    return mags_idx, dists_idx, lons_idx, lats_idx
 
+
+# this is fast
+def _build_disagg_matrix(bdata, bins):
+    """
+    :param bdata: a dictionary of probabilities of no exceedence
+    :param bins: bin edges
+    :returns: a 7D-matrix of shape (#magbins, #distbins, #lonbins,
+                                    #latbins, #epsbins, #imts, #poes)
+    """
+    shape = [len(b)-1 for b in bins]
+    mags_idx, dists_idx, lons_idx, lats_idx = _digitize(
+        bdata.mags, bdata.dists, bdata.lons, bdata.lats, bins)
     U, M, P, E = bdata.pnes.shape
     mat7D = numpy.ones(shape + [M, P])
     for i_mag, i_dist, i_lon, i_lat, pne in zip(
@@ -183,30 +190,143 @@ def _build_disagg_matrix(bdata, bins):
     return 1. - mat7D
 
 
+def _eps_poes(lvls, truncnorm, epsilons, eps_bands):
+    # vectorized version of _disaggregate_pne, without the final conversion
+    # into probabilities of no exceedance; lvls is an array of normalized
+    # levels and the returned array has an additional epsilon dimension
+    E = len(eps_bands)
+    tails = numpy.array([eps_bands[b:].sum() for b in range(E + 1)])
+    bins = numpy.searchsorted(epsilons, lvls)
+    poes = numpy.where(numpy.arange(E) >= bins[..., None], eps_bands, 0.)
+    partial = (bins >= 1) & (bins <= E)
+    idx = bins[partial]
+    poes[partial, idx - 1] = truncnorm.sf(lvls[partial]) - tails[idx]
+    return poes
+
+
+def _multiply_pnes(mats, shape, sids, mags, dists, lons, lats, pnes,
+                   bin_edges):
+    # multiply the probabilities of no exceedence inside the matrices
+    # of the given sites, one site at the time; the order of the
+    # ruptures is preserved, so that the products are the same as in
+    # _build_disagg_matrix
+    order = numpy.argsort(sids, kind='stable')
+    sids, mags, dists = sids[order], mags[order], dists[order]
+    lons, lats, pnes = lons[order], lats[order], pnes[order]
+    uniq, start = numpy.unique(sids, return_index=True)
+    stop = list(start[1:]) + [len(sids)]
+    for sid, i, j in zip(uniq, start, stop):
+        bins = get_bins(bin_edges, sid)
+        if sid not in mats:
+            mats[sid] = numpy.ones([len(b) - 1 for b in bins] + shape)
+        mat = mats[sid]
+        mi, di, li, ti = _digitize(
+            mags[i:j], dists[i:j], lons[i:j], lats[i:j], bins)
+        for z in range(shape[-1]):  # pnes have shape (U, M, P, Z, E)
+            numpy.multiply.at(mat[..., z], (mi, di[:, z], li, ti),
+                              pnes[i:j, :, :, z].transpose(0, 3, 1, 2))
+
+
 # called by the engine
-def build_matrix(cmaker, singlesite, ctxs, iml3, imts, rlzs,
-                 num_epsilon_bins, bins, pne_mon, mat_mon, gmf_mon):
+def build_matrices(cmaker, sitecol, rupdata, iml4, num_epsilon_bins,
+                   bin_edges, pne_mon, mat_mon, gmf_mon,
+                   maxrows=100_000):
     """
+    Multi-site disaggregation. For each rupture the GSIMs are called once
+    for all the sites within the maximum distance, the PoEs for all
+    levels, realizations and epsilon bins are computed with array operations
+    and the matrices are built with `numpy.multiply.at`.
+
     :param cmaker: a ContextMaker
-    :param singlesite: a site collection with a single site
-    :param ctxs: a list of pairs (rctx, dctx)
-    :param iml3: an array of shape (M, P, Z)
-    :param imts: a list of intensity measure types
-    :param rlzs: Z realizations for the given site
+    :param sitecol: a complete site collection
+    :param rupdata: a dictionary with the rupture parameters and the
+                    distances (arrays of shape (U, N) ending with "_")
+    :param iml4: an ArrayWrapper of shape (N, M, P, Z)
     :param num_epsilon_bins: number of epsilons bins
-    :param bins: bin edges for the given site
-    :returns: 8D disaggregation matrix
+    :param bin_edges: a quintet (mag_edges, dist_edges, lon_edges,
+                      lat_edges, eps_edges)
+    :param maxrows: the number of (rupture, site) pairs kept in memory
+    :yields: pairs (sid, 8D disaggregation matrix), one block of sites
+             at the time
     """
-    eps3 = _eps3(cmaker.trunclevel, num_epsilon_bins)
-    arr = numpy.zeros([len(b) - 1 for b in bins] + list(iml3.shape))
-    for z, rlz in enumerate(rlzs):
-        iml2 = hdf5.ArrayWrapper(iml3[:, :, z], dict(rlzi=rlz, imts=imts))
-        bdata = _disaggregate(cmaker, singlesite, ctxs, iml2, eps3,
-                              pne_mon, gmf_mon)
-        if bdata.pnes.sum():
+    tn, eps, eps_bands = _eps3(cmaker.trunclevel, num_epsilon_bins)
+    N, M, P, Z = iml4.shape
+    imls = numpy.zeros(iml4.shape)
+    for m, imt in enumerate(iml4.imts):
+        imls[:, m] = to_distribution_values(iml4.array[:, m], imt)
+    gsim_idx = {gsim: g for g, gsim in enumerate(cmaker.gsims)}
+    gidx = numpy.zeros((N, Z), int)
+    missing = numpy.zeros((N, Z), bool)
+    for (sid, z), rlz in numpy.ndenumerate(iml4.rlzs):
+        try:
+            gidx[sid, z] = gsim_idx[cmaker.gsim_by_rlzi[rlz]]
+        except KeyError:  # the realization is not in this cmaker
+            missing[sid, z] = True
+    mindists = numpy.array([gsim.minimum_distance or 0.
+                            for gsim in cmaker.gsims])
+    close = rupdata['rrup_'] <= cmaker.maximum_distance(cmaker.trt)
+    rpars = [par for par in rupdata if not par.endswith('_')]
+    dpars = [par for par in rupdata if par.endswith('_')]
+
+    def nbytes(sid):  # size of the disaggregation matrix of the site
+        shape = [len(b) - 1 for b in get_bins(bin_edges, sid)]
+        return 8 * numpy.prod(shape + [M, P, Z])
+
+    # the matrices of a block of sites are kept in memory until all the
+    # ruptures have been processed, so the blocks are limited by MAXBYTES
+    allsids = numpy.where(close.any(axis=0))[0]
+    for block in block_splitter(allsids, MAXBYTES, nbytes):
+        inblock = numpy.zeros(close.shape[1], bool)
+        inblock[list(block)] = True
+        mats = {}
+        acc = dict(sids=[], mags=[], dists=[], lons=[], lats=[], pnes=[])
+        nrows = 0
+        for ridx in numpy.where(close[:, inblock].any(axis=1))[0]:
+            sids = numpy.where(close[ridx] & inblock)[0]
+            rctx = contexts.RuptureContext(
+                (par, rupdata[par][ridx]) for par in rpars)
+            dctx = contexts.DistancesContext(
+                (par[:-1], rupdata[par][ridx, sids]) for par in dpars)
+            with gmf_mon:
+                mean_std = get_mean_std(
+                    sitecol.filtered(sids), rctx, dctx, iml4.imts,
+                    cmaker.gsims)  # (2, n, M, G)
+            with pne_mon:
+                ms = mean_std[:, numpy.arange(len(sids))[:, None, None],
+                              numpy.arange(M)[:, None], gidx[sids][:, None]]
+                # shape (n, M, P, Z)
+                lvls = (imls[sids] - ms[0][:, :, None]) / ms[1][:, :, None]
+                lvls[numpy.isnan(lvls)] = numpy.inf
+                # missing realizations have zero poes, i.e. pnes equal to 1
+                lvls[numpy.broadcast_to(missing[sids][:, None, None],
+                                        lvls.shape)] = numpy.inf
+                poes = _eps_poes(lvls, tn, eps, eps_bands)
+                acc['pnes'].append(rctx.get_probability_no_exceedance(poes))
+            acc['sids'].append(sids)
+            acc['mags'].append(numpy.repeat(rctx.mag, len(sids)))
+            acc['dists'].append(numpy.maximum(
+                dctx.rrup[:, None], mindists[gidx[sids]]))
+            acc['lons'].append(dctx.lon)
+            acc['lats'].append(dctx.lat)
+            nrows += len(sids)
+            if nrows > maxrows:
+                with mat_mon:
+                    _multiply_pnes(mats, [M, P, Z], *_concat(acc), bin_edges)
+                nrows = 0
+        if nrows:
             with mat_mon:
-                arr[..., z] = _build_disagg_matrix(bdata, bins)
-    return arr
+                _multiply_pnes(mats, [M, P, Z], *_concat(acc), bin_edges)
+        for sid in sorted(mats):
+            yield sid, 1. - mats.pop(sid)
+
+
+def _concat(acc):
+    # concatenate and clear the accumulated arrays
+    arrays = []
+    for key in 'sids mags dists lons lats pnes'.split():
+        arrays.append(numpy.concatenate(acc[key]))
+        acc[key].clear()
+    return arrays
 
 
 def _digitize_lons(lons, lon_bins):
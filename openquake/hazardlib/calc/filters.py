@@ -21,12 +21,13 @@ import sys
 import time
 import logging
 import operator
+import itertools
 import collections.abc
 from contextlib import contextmanager
 import numpy
 from scipy.spatial import cKDTree, distance
 
-from openquake.baselib import hdf5, general
+from openquake.baselib import hdf5, general, parallel
 from openquake.baselib.python3compat import raise_
 from openquake.hazardlib.geo.utils import (
     KM_TO_DEGREES, angular_distance, fix_lon, get_bounding_box, cross_idl,
@@ -34,6 +35,7 @@ from openquake.hazardlib.geo.utils import (
 
 U32 = numpy.uint32
 MAX_DISTANCE = 2000  # km, ultra big distance used if there is no filter
+MAX_BBOXES = 1000  # max number of bounding boxes per KD-tree query
 grp_id = operator.attrgetter('grp_id')
 
 
@@ -256,8 +258,13 @@ class SourceFilter(object):
             return
         elif not os.path.exists(self.filename):
             raise FileNotFoundError('%s: shared_dir issue?' % self.filename)
-        with hdf5.File(self.filename, 'r') as h5:
-            self.__dict__['sitecol'] = sc = h5.get('sitecol')
+        if parallel.oq_distribute() == 'processpool':
+            # map the site collection in memory, shared by all the workers
+            self.__dict__['sitecol'] = sc = hdf5.memmap(
+                self.filename, 'sitecol')
+        else:
+            with hdf5.File(self.filename, 'r') as h5:
+                self.__dict__['sitecol'] = sc = h5.get('sitecol')
         return sc
 
     def get_rectangle(self, src):
@@ -317,6 +324,70 @@ class SourceFilter(object):
             bbs.append(bb)
         return bbs
 
+    @general.cached_property
+    def kdt(self):
+        """
+        A KD-tree on the cartesian coordinates of the sites, built on demand
+        """
+        return cKDTree(self.sitecol.xyz)
+
+    def sids_within_bboxes(self, bboxes):
+        """
+        Batched version of `self.sitecol.within_bbox`, based on the KD-tree
+        of the sites: only the sites inside the sphere enclosing each
+        bounding box are checked, so the cost does not scale with N.
+
+        :param bboxes:
+            an array of shape (B, 4) with bounding boxes
+            (min_lon, min_lat, max_lon, max_lat), possibly crossing the IDL
+        :returns:
+            a list of B arrays of site IDs within the bounding boxes
+        """
+        bboxes = numpy.array(bboxes, float).reshape(-1, 4)
+        out = []
+        for start in range(0, len(bboxes), MAX_BBOXES):
+            out.extend(self._sids_within_bboxes(
+                bboxes[start:start + MAX_BBOXES]))
+        return out
+
+    def _sids_within_bboxes(self, bboxes):
+        minlon, minlat, maxlon, maxlat = bboxes.T
+        width = (maxlon - minlon) % 360
+        lats = numpy.clip([minlat, minlat, maxlat, maxlat], -90, 90)
+        lons = numpy.array([minlon, maxlon, minlon, maxlon])
+        center = spherical_to_cartesian(
+            minlon + width / 2, lats.mean(axis=0)).reshape(-1, 3)
+        corners = spherical_to_cartesian(lons, lats)  # shape (4, B, 3)
+        # the farthest point of a lon-lat box from its center is a corner,
+        # unless the box is wider than 180 degrees: then the middle of the
+        # side edges can be farther and all the sites are considered;
+        # the margin accounts for the depth of the sites
+        radius = numpy.sqrt(((corners - center) ** 2).sum(axis=-1)).max(
+            axis=0) + numpy.abs(self.sitecol.depths).max() + 1.
+        radius[width > 180] = numpy.inf
+        candidates = self.kdt.query_ball_point(
+            center, radius, return_sorted=True)
+        lens = [len(cand) for cand in candidates]
+        sids = numpy.fromiter(itertools.chain.from_iterable(candidates),
+                              U32, sum(lens))
+        bidx = numpy.repeat(numpy.arange(len(bboxes)), lens)
+        # replicate the logic of SiteCollection.within_bbox
+        sc_lons = self.sitecol.lons
+        l1 = numpy.minimum(numpy.minimum(minlon, maxlon), sc_lons.min())
+        l2 = numpy.maximum(numpy.maximum(minlon, maxlon), sc_lons.max())
+        idl = (l1 * l2 < 0) & (numpy.abs(l1 - l2) > 180)
+        slons, blon1, blon2 = sc_lons[sids], minlon[bidx], maxlon[bidx]
+        ok = idl[bidx]
+        slons[ok] %= 360
+        blon1[ok] %= 360
+        blon2[ok] %= 360
+        slats = self.sitecol.lats[sids]
+        mask = ((blon1 < slons) & (slons < blon2) &
+                (minlat[bidx] < slats) & (slats < maxlat[bidx]))
+        # the sids are already sorted by box and by site ID
+        counts = numpy.bincount(bidx[mask], minlength=len(bboxes))
+        return numpy.split(sids[mask], numpy.cumsum(counts)[:-1])
+
     # used in the rupture prefiltering: it should not discard too much
     def close_sids(self, rec, trt):
         """
@@ -332,8 +403,6 @@ class SourceFilter(object):
             return []
         elif not self.integration_distance:  # do not filter
             return self.sitecol.sids
-        if not hasattr(self, 'kdt'):
-            self.kdt = cKDTree(self.sitecol.xyz)
         xyz = spherical_to_cartesian(*rec['hypo'])
         dlon = get_longitudinal_extent(rec['minlon'], rec['maxlon'])
         dlat = rec['maxlat'] - rec['minlat']
@@ -359,20 +428,34 @@ class SourceFilter(object):
         if self.sitecol is None:  # nofilter
             yield from sources
             return
+        yield from self.filter_group(sources)
+
+    def filter_group(self, sources):
+        """
+        Filter all the given sources with a single query to the KD-tree
+        of the sites.
+
+        :param sources: a sequence of sources
+        :returns: the list of sources with .indices affecting some site
+        """
+        if self.sitecol is None:  # nofilter
+            return list(sources)
+        sources = list(sources)
+        todo, bboxes = [], []
         for src in sources:
             if hasattr(src, 'indices'):   # already filtered
-                yield src
                 continue
             try:
-                box = self.integration_distance.get_affected_box(src)
+                bboxes.append(self.integration_distance.get_affected_box(src))
             except BBoxError:  # too large, don't filter
                 src.indices = self.sitecol.sids
-                yield src
                 continue
-            indices = self.sitecol.within_bbox(box)
-            if len(indices):
-                src.indices = indices
-                yield src
+            todo.append(src)
+        if todo:
+            for src, indices in zip(todo, self.sids_within_bboxes(bboxes)):
+                if len(indices):
+                    src.indices = indices
+        return [src for src in sources if hasattr(src, 'indices')]
 
     def within_bbox(self, srcs):
         """
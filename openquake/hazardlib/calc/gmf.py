@@ -33,6 +33,14 @@ U32 = numpy.uint32
 F32 = numpy.float32
 
 
+def gmf_dt(num_imts):
+    """
+    :returns: the composite dtype (sid, eid, gmv) for the GMFs
+    """
+    return numpy.dtype(
+        [('sid', U32), ('eid', U32), ('gmv', (F32, (num_imts,)))])
+
+
 class CorrelationButNoInterIntraStdDevs(Exception):
     def __init__(self, corr, gsim):
         self.corr = corr
@@ -91,6 +99,10 @@ class GmfComputer(object):
 
     :param amplifier:
         None or an instance of Amplifier
+
+    :param mean_stds:
+        None or a flat array of floats as returned by
+        :meth:`get_mean_stds`, to be used instead of calling the GSIMs
     """
     # The GmfComputer is called from the OpenQuake Engine. In that case
     # the rupture is an higher level containing a
@@ -101,7 +113,7 @@ class GmfComputer(object):
     # seed is extracted from the underlying rupture.
     def __init__(self, rupture, sitecol, imts, cmaker,
                  truncation_level=None, correlation_model=None,
-                 amplifier=None):
+                 amplifier=None, mean_stds=None):
         if len(sitecol) == 0:
             raise ValueError('No sites')
         elif len(imts) == 0:
@@ -129,45 +141,103 @@ class GmfComputer(object):
         self.sids = self.sctx.sids
         if correlation_model:  # store the filtered sitecol
             self.sites = sitecol.complete.filtered(self.sids)
+        if mean_stds is not None:
+            mean_stds = mean_stds.reshape(
+                len(self.gsims), len(self.imts), 3, len(self.sids))
+        self.mean_stds = mean_stds
 
-    def compute_all(self, min_iml, rlzs_by_gsim, sig_eps=None):
+    def get_mean_stds(self):
         """
-        :returns: [(sid, eid, gmv), ...], dt
+        :returns:
+            an array of shape (G, M, 3, N) with the mean and the inter-event
+            and intra-event standard deviations for each GSIM and IMT; for
+            GSIMs defining only the total standard deviation the second
+            entry is the total standard deviation and the third is NaN
+        """
+        rctx = getattr(self.rupture, 'rupture', self.rupture)
+        G, M, N = len(self.gsims), len(self.imts), len(self.sids)
+        mean_stds = numpy.zeros((G, M, 3, N))
+        for g, gsim in enumerate(self.gsims):
+            for m, imt in enumerate(self.imts):
+                if isinstance(gsim, MultiGMPE):
+                    gs = gsim[str(imt)]  # MultiGMPE
+                else:
+                    gs = gsim  # regular GMPE
+                dctx = self.dctx.roundup(gs.minimum_distance)
+                if gs.DEFINED_FOR_STANDARD_DEVIATION_TYPES == {StdDev.TOTAL}:
+                    mean, [stddev_total] = gs.get_mean_and_stddevs(
+                        self.sctx, rctx, dctx, imt, [StdDev.TOTAL])
+                    mean_stds[g, m, :2] = mean, stddev_total
+                    mean_stds[g, m, 2] = numpy.nan
+                else:
+                    mean, [stddev_inter, stddev_intra] = (
+                        gs.get_mean_and_stddevs(
+                            self.sctx, rctx, dctx, imt,
+                            [StdDev.INTER_EVENT, StdDev.INTRA_EVENT]))
+                    mean_stds[g, m] = mean, stddev_inter, stddev_intra
+        return mean_stds
+
+    def gen_gmfs(self, min_iml, rlzs_by_gsim, sig_eps=None,
+                 max_rows=1_000_000):
+        """
+        :param min_iml: an array of M minimum intensities
+        :param rlzs_by_gsim: a dictionary gsim -> realization indices
+        :param sig_eps: a list to populate with the (eid, rlzi, sig, eps)
+        :param max_rows: maximum number of rows in the yielded arrays
+        :yields: arrays of dtype (sid, eid, gmv) ordered by gsim, eid, sid
+
+        The events are never split between two arrays, so an array can
+        exceed max_rows only if a single event has more than max_rows sites.
         """
-        t0 = time.time()
         rup = self.rupture
         sids = self.sids
         eids_by_rlz = rup.get_eids_by_rlz(rlzs_by_gsim)
-        data = []
+        dt = gmf_dt(len(min_iml))
         for gs, rlzs in rlzs_by_gsim.items():
-            num_events = sum(len(eids_by_rlz[rlzi]) for rlzi in rlzs)
+            eids = numpy.concatenate(
+                [eids_by_rlz[rlzi] for rlzi in rlzs]) + self.e0
+            rlzis = numpy.repeat(
+                rlzs, [len(eids_by_rlz[rlzi]) for rlzi in rlzs])
             # NB: the trick for performance is to keep the call to
             # compute.compute outside of the loop over the realizations
             # it is better to have few calls producing big arrays
-            array, sig, eps = self.compute(gs, num_events)
-            array = array.transpose(1, 0, 2)  # from M, N, E to N, M, E
+            array, sig, eps = self.compute(gs, len(eids))
+            array = array.transpose(2, 1, 0)  # from M, N, E to E, N, M
             for i, miniml in enumerate(min_iml):  # gmv < minimum
-                arr = array[:, i, :]
+                arr = array[:, :, i]
                 arr[arr < miniml] = 0
-            n = 0
-            for rlzi in rlzs:
-                eids = eids_by_rlz[rlzi] + self.e0
-                e = len(eids)
-                for ei, eid in enumerate(eids):
-                    gmf = array[:, :, n + ei]  # shape (N, M)
-                    tot = gmf.sum(axis=0)  # shape (M,)
-                    if not tot.sum():
-                        continue
-                    if sig_eps is not None:
-                        tup = tuple([eid, rlzi] + list(sig[:, n + ei]) +
-                                    list(eps[:, n + ei]))
-                        sig_eps.append(tup)
-                    for sid, gmv in zip(sids, gmf):
-                        if gmv.sum():
-                            data.append((sid, eid, gmv))
-                n += e
-        m = (len(min_iml),)
-        d = numpy.array(data, [('sid', U32), ('eid', U32), ('gmv', (F32, m))])
+            tot = array.sum(axis=2)  # shape (E, N)
+            if sig_eps is not None:
+                for ei in numpy.where(tot.sum(axis=1))[0]:
+                    sig_eps.append(tuple([eids[ei], rlzis[ei]] +
+                                         list(sig[:, ei]) + list(eps[:, ei])))
+            eis, sis = numpy.nonzero(tot)  # ordered by event and site
+            start = 0
+            while start < len(eis):
+                stop = start + max_rows
+                if stop < len(eis):  # cut at the beginning of an event
+                    stop = numpy.searchsorted(eis, eis[stop])
+                    if stop == start:  # a single event with many sites
+                        stop = numpy.searchsorted(eis, eis[start], 'right')
+                ei = eis[start:stop]
+                si = sis[start:stop]
+                start = stop
+                data = numpy.zeros(len(ei), dt)
+                data['sid'] = sids[si]
+                data['eid'] = eids[ei]
+                data['gmv'] = array[ei, si]
+                yield data
+
+    def compute_all(self, min_iml, rlzs_by_gsim, sig_eps=None):
+        """
+        :returns: an array of dtype (sid, eid, gmv) and the time spent
+        """
+        t0 = time.time()
+        data = list(self.gen_gmfs(min_iml, rlzs_by_gsim, sig_eps))
+        if data:
+            d = numpy.concatenate(data)
+        else:
+            d = numpy.zeros(0, gmf_dt(len(min_iml)))
         return d, time.time() - t0
 
     def compute(self, gsim, num_events):
@@ -183,26 +253,30 @@ class GmfComputer(object):
         result = numpy.zeros((len(self.imts), len(self.sids), num_events), F32)
         sig = numpy.zeros((len(self.imts), num_events), F32)
         eps = numpy.zeros((len(self.imts), num_events), F32)
+        if self.mean_stds is not None:
+            mean_stds = self.mean_stds[self.gsims.index(gsim)]
         for imti, imt in enumerate(self.imts):
             if isinstance(gsim, MultiGMPE):
                 gs = gsim[str(imt)]  # MultiGMPE
             else:
                 gs = gsim  # regular GMPE
+            ms = None if self.mean_stds is None else mean_stds[imti]
             try:
                 result[imti], sig[imti], eps[imti] = self._compute(
-                    None, gs, num_events, imt)
+                    None, gs, num_events, imt, ms)
             except Exception as exc:
                 raise exc.__class__(
                     '%s for %s, %s, srcidx=%s' % (exc, gs, imt, self.srcidx)
                 ).with_traceback(exc.__traceback__)
         return result, sig, eps
 
-    def _compute(self, seed, gsim, num_events, imt):
+    def _compute(self, seed, gsim, num_events, imt, mean_std=None):
         """
         :param seed: a random seed or None if the seed is already set
         :param gsim: a GSIM instance
         :param num_events: the number of seismic events
         :param imt: an IMT instance
+        :param mean_std: None or a cached array of shape (3, num_sites)
         :returns: (gmf(num_sites, num_events), stddev_inter(num_events),
                    epsilons(num_events))
         """
@@ -214,8 +288,11 @@ class GmfComputer(object):
             if self.correlation_model:
                 raise ValueError('truncation_level=0 requires '
                                  'no correlation model')
-            mean, _stddevs = gsim.get_mean_and_stddevs(
-                self.sctx, rctx, dctx, imt, stddev_types=[])
+            if mean_std is None:
+                mean, _stddevs = gsim.get_mean_and_stddevs(
+                    self.sctx, rctx, dctx, imt, stddev_types=[])
+            else:
+                mean = mean_std[0]
             mean = to_imt_unit_values(mean, imt)
             mean.shape += (1, )
             mean = mean.repeat(num_events, axis=1)
@@ -241,8 +318,11 @@ class GmfComputer(object):
                 raise CorrelationButNoInterIntraStdDevs(
                     self.correlation_model, gsim)
 
-            mean, [stddev_total] = gsim.get_mean_and_stddevs(
-                self.sctx, rctx, dctx, imt, [StdDev.TOTAL])
+            if mean_std is None:
+                mean, [stddev_total] = gsim.get_mean_and_stddevs(
+                    self.sctx, rctx, dctx, imt, [StdDev.TOTAL])
+            else:
+                mean, stddev_total = mean_std[:2]
             stddev_total = stddev_total.reshape(stddev_total.shape + (1, ))
             mean = mean.reshape(mean.shape + (1, ))
 
@@ -253,9 +333,13 @@ class GmfComputer(object):
             epsilons = numpy.empty(num_events, F32)
             epsilons.fill(numpy.nan)
         else:
-            mean, [stddev_inter, stddev_intra] = gsim.get_mean_and_stddevs(
-                self.sctx, rctx, dctx, imt,
-                [StdDev.INTER_EVENT, StdDev.INTRA_EVENT])
+            if mean_std is None:
+                mean, [stddev_inter, stddev_intra] = (
+                    gsim.get_mean_and_stddevs(
+                        self.sctx, rctx, dctx, imt,
+                        [StdDev.INTER_EVENT, StdDev.INTRA_EVENT]))
+            else:
+                mean, stddev_inter, stddev_intra = mean_std
             stddev_intra = stddev_intra.reshape(stddev_intra.shape + (1, ))
             stddev_inter = stddev_inter.reshape(stddev_inter.shape + (1, ))
             mean = mean.reshape(mean.shape + (1, ))
@@ -36,6 +36,8 @@ from openquake.hazardlib.gsim import base
 from openquake.hazardlib.calc.filters import IntegrationDistance
 from openquake.hazardlib.probability_map import ProbabilityMap
 from openquake.hazardlib.geo.surface import PlanarSurface
+from openquake.hazardlib.geo.surface.planar import (
+    get_planar_distances, build_planar_array, planar_surface_dt)
 
 bymag = operator.attrgetter('mag')
 bydist = operator.attrgetter('dist')
@@ -43,6 +45,14 @@ I16 = numpy.int16
 F32 = numpy.float32
 KNOWN_DISTANCES = frozenset(
     'rrup rx ry0 rjb rhypo repi rcdpp azimuth azimuth_cp rvolc'.split())
+# maximum number of floats in the PoEs array of a stack of contexts, i.e.
+# 10M floats = 80 MB; a single context can be larger than that
+MAX_STACK_SIZE = 10_000_000
+# distances that can be computed on arrays of planar ruptures
+PLANAR_DISTANCES = frozenset('rrup rx rjb ry0 rhypo repi rvolc'.split())
+# planar surfaces of rupture objects, see ContextMaker.make_ctxs
+planar_rup_dt = numpy.dtype([('mag', numpy.float64)] +
+                            planar_surface_dt.descr)
 
 
 def get_distances(rupture, sites, param):
@@ -190,6 +200,7 @@ class ContextMaker(object):
         self.ctx_mon = monitor('make_contexts', measuremem=False)
         self.loglevels = DictArray(self.imtls)
         self.shift_hypo = param.get('shift_hypo')
+        self.planar = self.REQUIRES_DISTANCES <= PLANAR_DISTANCES
         with warnings.catch_warnings():
             # avoid RuntimeWarning: divide by zero encountered in log
             warnings.simplefilter("ignore")
@@ -310,6 +321,51 @@ class ContextMaker(object):
         self.add_rup_params(rupture)
         return sites, dctx
 
+    def make_planar_ctxs(self, planar, tom, sites, grp_ids, filt, rups=()):
+        """
+        Same as :meth:`make_ctxs`, but for an array of planar ruptures
+        (see :data:`openquake.hazardlib.source.point.planar_dt`): the
+        distances are computed for all ruptures at once and no rupture
+        or surface objects are instantiated.
+
+        :param planar: an array of planar ruptures
+        :param tom: the temporal occurrence model of the ruptures
+        :param rups: if given, the rupture objects corresponding to planar
+        """
+        params = sorted(self.REQUIRES_DISTANCES | {self.filter_distance})
+        if not filt:
+            params += ['lon', 'lat']
+        reqv_obj = (self.reqv.get(self.trt) if self.reqv else None)
+        mdist = {mag: self.maximum_distance(self.trt, mag)
+                 for mag in numpy.unique(planar['mag'])}
+        dists = get_planar_distances(planar, sites, params)
+        ctxs = []
+        for k, rec in enumerate(planar):
+            mask = dists[self.filter_distance][k] <= mdist[rec['mag']]
+            if not mask.any():
+                continue
+            if len(rups):
+                rup = rups[k]
+                self.add_rup_params(rup)
+            else:
+                rup = PlanarRuptureContext.from_record(rec, self.trt, tom)
+            rup.grp_ids = grp_ids
+            if filt:
+                r_sites = sites.filter(mask)
+                dctx = DistancesContext(
+                    (par, dists[par][k][mask]) for par in params)
+            else:
+                dctx = DistancesContext(
+                    (par, dists[par][k]) for par in params)
+            if reqv_obj:
+                reqv = reqv_obj.get(dctx.repi, rup.mag)
+                if 'rjb' in self.REQUIRES_DISTANCES:
+                    dctx.rjb = reqv
+                if 'rrup' in self.REQUIRES_DISTANCES:
+                    dctx.rrup = numpy.sqrt(reqv**2 + rup.hypo_depth**2)
+            ctxs.append((rup, r_sites, dctx) if filt else (rup, dctx))
+        return ctxs
+
     def make_ctxs(self, ruptures, sites, grp_ids, filt):
         """
         :returns:
@@ -317,7 +373,11 @@ class ContextMaker(object):
             a list of pairs (rctx, dctx) if filt is False
         """
         ctxs = []
+        planar_rups = []  # ruptures with distances computed all together
         for rup in ruptures:
+            if self.planar and type(rup.surface) is PlanarSurface:
+                planar_rups.append(rup)
+                continue
             try:
                 sctx, dctx = self.make_contexts(sites, rup, filt)
             except FarAwayRupture:
@@ -330,8 +390,47 @@ class ContextMaker(object):
                 dctx.lon = closest.lons
                 dctx.lat = closest.lats
                 ctxs.append((rup, dctx))
+        if planar_rups:
+            arr = build_planar_array([rup.surface for rup in planar_rups],
+                                     [rup.hypocenter for rup in planar_rups])
+            planar = numpy.zeros(len(arr), planar_rup_dt)
+            planar['mag'] = [rup.mag for rup in planar_rups]
+            for name in arr.dtype.names:
+                planar[name] = arr[name]
+            ctxs.extend(self.make_planar_ctxs(
+                planar, None, sites, grp_ids, filt, planar_rups))
         return ctxs
 
+    def stack_ctxs(self, ctxs, maxrows):
+        """
+        Stack together contexts with the same rupture parameters, so that
+        each GSIM can be called once per IMT on all of them.
+
+        :param ctxs: a list of triples (rup, sites, dctx)
+        :param maxrows: maximum number of rows in a stack
+        :yields: triples (ctxs, sites, dctx) with stacked sites and distances
+        """
+        if not all(gsim.stackable for gsim in self.gsims):
+            for ctx in ctxs:
+                yield [ctx], ctx[1], ctx[2]
+            return
+        params = sorted(self.REQUIRES_RUPTURE_PARAMETERS)
+        dists = sorted(self.REQUIRES_DISTANCES)
+        acc = {}  # rupture parameters -> contexts
+        for ctx in ctxs:
+            key = tuple(getattr(ctx[0], par) for par in params)
+            acc.setdefault(key, []).append(ctx)
+        for group in acc.values():
+            block, size = [], 0
+            for ctx in group:
+                block.append(ctx)
+                size += len(ctx[1])
+                if size >= maxrows:
+                    yield _stack(block, dists)
+                    block, size = [], 0
+            if block:
+                yield _stack(block, dists)
+
     def max_intensity(self, sitecol1, mags, dists):
         """
         :param sitecol1: a SiteCollection instance with a single site
@@ -373,6 +472,19 @@ def _collapse(rups):
     return [rup]
 
 
+def _stack(ctxs, dists):
+    # stack the sites and distances of contexts with the same rupture params
+    if len(ctxs) == 1:
+        return ctxs, ctxs[0][1], ctxs[0][2]
+    sites = object.__new__(ctxs[0][1].__class__)
+    sites.array = numpy.concatenate([ctx[1].array for ctx in ctxs])
+    sites.complete = ctxs[0][1].complete
+    dctx = DistancesContext(
+        (dst, numpy.concatenate([getattr(ctx[2], dst) for ctx in ctxs]))
+        for dst in dists)
+    return ctxs, sites, dctx
+
+
 def print_finite_size(rups):
     """
     Used to print the number of finite-size ruptures
@@ -400,8 +512,22 @@ class PmapMaker(object):
         self.poe_mon = cmaker.mon('get_poes', measuremem=False)
         self.pne_mon = cmaker.mon('composing pnes', measuremem=False)
         self.gmf_mon = cmaker.mon('computing mean_std', measuremem=False)
+        self.imt_idx = base.level_imts(cmaker.loglevels)
+        L, G = len(cmaker.imtls.array), len(cmaker.gsims)
+        self.maxrows = max(MAX_STACK_SIZE // (L * G or 1), 1)
+
+    def _is_planar(self, src):
+        # True if the ruptures of the source can be managed as an array
+        loc = getattr(src, 'location', None)
+        return (self.planar and self.rup_indep and hasattr(src, 'get_planar')
+                and not (loc and self.pointsource_distance))
+
+    def _planar(self, src):
+        self.totrups += src.num_ruptures
+        with self.cmaker.mon('iter_ruptures', measuremem=False):
+            return src.get_planar(self.shift_hypo)
 
-    def _gen_ctxs(self, rups, sites, grp_ids):
+    def _gen_ctxs(self, rups, sites, grp_ids, planars=()):
         # generate triples (rup, sites, dctx)
         rup_param = not numpy.isnan([r.occurrence_rate for r in rups]).any()
         collapse_level = self.rup_indep and rup_param and self.collapse_level
@@ -410,6 +536,9 @@ class PmapMaker(object):
             rups = self.collapse_point_ruptures(rups, sites)
             # print_finite_size(rups)
         ctxs = self.cmaker.make_ctxs(rups, sites, grp_ids, filt=False)
+        for planar, tom in planars:
+            ctxs.extend(self.cmaker.make_planar_ctxs(
+                planar, tom, sites, grp_ids, filt=False))
         if collapse_level > 1:
             ctxs = self.collapse_the_ctxs(ctxs)
         self.numrups += len(ctxs)
@@ -428,14 +557,15 @@ class PmapMaker(object):
         # compute PoEs and update pmap
         if pmap is None:  # for src_indep
             pmap = self.pmap
-        for rup, r_sites, dctx in ctxs:
+        for stack, sites, dctx in self.cmaker.stack_ctxs(ctxs, self.maxrows):
             # this must be fast since it is inside an inner loop
             with self.gmf_mon:
                 mean_std = base.get_mean_std(  # shape (2, N, M, G)
-                    r_sites, rup, dctx, self.imts, self.gsims)
+                    sites, stack[0][0], dctx, self.imts, self.gsims)
             with self.poe_mon:
                 ll = self.loglevels
-                poes = base.get_poes(mean_std, ll, self.trunclevel, self.gsims)
+                poes = base.get_poes(mean_std, ll, self.trunclevel,
+                                     self.gsims, self.imt_idx)
                 for g, gsim in enumerate(self.gsims):
                     for m, imt in enumerate(ll):
                         if hasattr(gsim, 'weight') and gsim.weight[imt] == 0:
@@ -443,17 +573,18 @@ class PmapMaker(object):
                             # when 0 ignore the gsim: see _build_trts_branches
                             poes[:, ll(imt), g] = 0
             with self.pne_mon:
-                # pnes and poes of shape (N, L, G)
-                pnes = rup.get_probability_no_exceedance(poes)
-                for grp_id in rup.grp_ids:
-                    p = pmap[grp_id]
-                    if self.rup_indep:
-                        for sid, pne in zip(r_sites.sids, pnes):
-                            p.setdefault(sid, 1.).array *= pne
-                    else:  # rup_mutex
-                        for sid, pne in zip(r_sites.sids, pnes):
-                            p.setdefault(sid, 0.).array += (
-                                1.-pne) * rup.weight
+                start = 0
+                for rup, r_sites, _ in stack:
+                    stop = start + len(r_sites)
+                    # pnes and poes of shape (N, L, G)
+                    pnes = rup.get_probability_no_exceedance(poes[start:stop])
+                    start = stop
+                    for grp_id in rup.grp_ids:
+                        if self.rup_indep:
+                            pmap[grp_id].imul(r_sites.sids, pnes)
+                        else:  # rup_mutex
+                            pmap[grp_id].iadd(
+                                r_sites.sids, (1. - pnes) * rup.weight)
 
     def _ruptures(self, src, filtermag=None):
         with self.cmaker.mon('iter_ruptures', measuremem=False):
@@ -470,21 +601,30 @@ class PmapMaker(object):
             self.numsites = 0
             if self.fewsites:
                 # we can afford using a lot of memory to store the ruptures
-                rups = self._get_rups(srcs, sites)
+                planars = [(self._planar(src), src.temporal_occurrence_model)
+                           for src in srcs if self._is_planar(src)]
+                rups = self._get_rups(
+                    [src for src in srcs if not self._is_planar(src)], sites)
                 # print_finite_size(rups)
                 with self.ctx_mon:
-                    ctxs = list(self._gen_ctxs(rups, sites, grp_ids))
+                    ctxs = list(self._gen_ctxs(rups, sites, grp_ids, planars))
                 self._update_pmap(ctxs)
             else:
-                # many sites: keep in memory less ruptures
+                # many sites: keep in memory less ruptures, by stacking
+                # the contexts in blocks of at most maxrows rows
+                ctxs, nrows = [], 0
                 for src in srcs:
-                    for rup in self._get_rups([src], sites):
-                        with self.ctx_mon:
-                            ctxs = self.cmaker.make_ctxs(
-                                [rup], rup.sites, grp_ids, filt=True)
-                        self.numrups += len(ctxs)
-                        self.numsites += sum(len(ctx[1]) for ctx in ctxs)
-                        self._update_pmap(ctxs)
+                    for cs in self._gen_src_ctxs(src, sites, grp_ids):
+                        n = sum(len(ctx[1]) for ctx in cs)
+                        self.numrups += len(cs)
+                        self.numsites += n
+                        ctxs.extend(cs)
+                        nrows += n
+                        if nrows >= self.maxrows:
+                            self._update_pmap(ctxs)
+                            ctxs, nrows = [], 0
+                if ctxs:
+                    self._update_pmap(ctxs)
             self.calc_times[src_id] += numpy.array(
                 [self.numrups, self.numsites, time.time() - t0])
         return AccumDict((grp_id, ~p if self.rup_indep else p)
@@ -581,6 +721,26 @@ class PmapMaker(object):
                 out.append((rup, dctx))
         return out
 
+    def _gen_src_ctxs(self, src, sites, grp_ids):
+        # yield lists of triples (rup, sites, dctx) for the given source
+        if self._is_planar(src):
+            planar = self._planar(src)
+            # blocks of ruptures producing around maxrows rows
+            blocksize = max(self.maxrows // len(sites), 1)
+            for start in range(0, len(planar), blocksize):
+                with self.ctx_mon:
+                    cs = self.cmaker.make_planar_ctxs(
+                        planar[start:start + blocksize],
+                        src.temporal_occurrence_model, sites, grp_ids,
+                        filt=True)
+                yield cs
+        else:
+            for rup in self._get_rups([src], sites):
+                with self.ctx_mon:
+                    cs = self.cmaker.make_ctxs(
+                        [rup], rup.sites, grp_ids, filt=True)
+                yield cs
+
     def _get_rups(self, srcs, sites):
         # returns a list of ruptures, each one with a .sites attribute
         rups = []
@@ -783,6 +943,44 @@ class RuptureContext(BaseContext):
         return tom.get_probability_no_exceedance(self.occurrence_rate, poes)
 
 
+class PlanarRuptureContext(RuptureContext):
+    """
+    RuptureContext built from a record of an array of planar ruptures;
+    the surface is instantiated only if a GSIM needs it.
+    """
+    weight = None
+    probs_occur = numpy.zeros(0)
+
+    @classmethod
+    def from_record(cls, rec, trt, tom):
+        """
+        :param rec: a record of dtype planar_dt
+        :param trt: tectonic region type
+        :param tom: temporal occurrence model
+        :returns: a PlanarRuptureContext instance
+        """
+        self = cls()
+        self.mag = rec['mag']
+        self.strike = rec['strike']
+        self.dip = rec['dip']
+        self.rake = rec['rake']
+        self.ztor = rec['corners'][2, 0]
+        self.hypo_lon, self.hypo_lat, self.hypo_depth = rec['hypo']
+        self.width = rec['width']
+        self.occurrence_rate = rec['rate']
+        self.tectonic_region_type = trt
+        self.temporal_occurrence_model = tom
+        self.corners = rec['corners']
+        return self
+
+    @property
+    def surface(self):
+        """
+        :returns: a :class:`PlanarSurface` instance
+        """
+        return PlanarSurface.from_array(self.corners)
+
+
 class Effect(object):
     """
     Compute the effect of a rupture of a given magnitude and distance.
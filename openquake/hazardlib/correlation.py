@@ -19,6 +19,95 @@ spatially-distributed ground-shaking intensities.
 """
 import abc
 import numpy
+from scipy.spatial import cKDTree
+from scipy.sparse import csc_matrix
+from scipy.sparse.linalg import splu
+
+from openquake.hazardlib.geo.geodetic import (
+    geodetic_distance, spherical_to_cartesian)
+
+MAX_CORR = 10_000_000  # max size of the neighbor correlation arrays
+
+
+class LocalCorrelationFactor(object):
+    """
+    Sparse approximation of the lower triangular Cholesky factor of a
+    spatial correlation matrix, obtained by conditioning the residual of
+    each site only on the residuals of its `k` nearest neighbors among the
+    previous sites (Vecchia approximation). It requires O(N k) memory and
+    O(N k^3) time instead of O(N^2) and O(N^3); for k = N - 1 it is exact.
+    Multiplying it by an array of residuals of shape (N, s) returns
+    correlated residuals, as for the dense factor.
+
+    :param lons: longitudes of the N sites
+    :param lats: latitudes of the N sites
+    :param corrfunc: a function distances -> correlation coefficients
+    :param k: the maximum number of neighbors for each site
+    """
+    def __init__(self, lons, lats, corrfunc, k):
+        N = len(lons)
+        k = max(min(k, N - 1), 1)
+        # process the sites in blocks, to keep the (B, k, k) arrays small
+        blocksize = min(max(MAX_CORR // k ** 2, 1), 1000)
+        xyz = spherical_to_cartesian(lons, lats)
+        rows, cols, data = [numpy.arange(N)], [numpy.arange(N)], [
+            numpy.ones(N)]
+        self.sqrtd = numpy.ones(N)
+        for start in range(0, N, blocksize):
+            stop = min(start + blocksize, N)
+            idx = numpy.arange(start, stop)
+            nbrs, ok = self._get_neighbors(xyz, idx, k)
+            # correlations between the neighbors and with the site
+            lo, la = lons[nbrs], lats[nbrs]
+            cnn = corrfunc(geodetic_distance(lo[:, :, None], la[:, :, None],
+                                             lo[:, None, :], la[:, None, :]))
+            cin = corrfunc(geodetic_distance(
+                lons[idx, None], lats[idx, None], lo, la))
+            # missing neighbors do not contribute
+            cin[~ok] = 0
+            cnn[~ok[:, :, None] | ~ok[:, None, :]] = 0
+            cnn[:, numpy.arange(k), numpy.arange(k)] = 1
+            b = numpy.linalg.solve(cnn, cin[:, :, None])[:, :, 0]
+            var = 1. - (b * cin).sum(axis=1)
+            self.sqrtd[idx] = numpy.sqrt(numpy.maximum(var, 0))
+            rows.append(numpy.repeat(idx, ok.sum(axis=1)))
+            cols.append(nbrs[ok])
+            data.append(-b[ok])
+        # sparse lower triangular matrix I - B such that x = B x + D^1/2 z;
+        # a factorization with natural ordering and no pivoting has no fill-in
+        mat = csc_matrix((numpy.concatenate(data), (
+            numpy.concatenate(rows), numpy.concatenate(cols))), (N, N))
+        self.lu = splu(mat, permc_spec='NATURAL', diag_pivot_thresh=0)
+
+    def _get_neighbors(self, xyz, idx, k):
+        # returns the k nearest neighbors of the sites in idx among
+        # the previous sites and a boolean mask of the valid neighbors
+        start = idx[0]
+        n = len(idx)
+        dists = numpy.full((n, 0), numpy.inf)
+        nbrs = numpy.zeros((n, 0), int)
+        if start:  # neighbors in the previous blocks
+            kp = min(k, start)
+            dists, nbrs = cKDTree(xyz[:start]).query(xyz[idx], kp)
+            dists, nbrs = dists.reshape(n, kp), nbrs.reshape(n, kp)
+        # neighbors in the same block
+        d = numpy.sqrt(((xyz[idx, None] - xyz[None, idx]) ** 2).sum(axis=2))
+        d[numpy.triu_indices(n)] = numpy.inf
+        dists = numpy.concatenate([dists, d], axis=1)
+        nbrs = numpy.concatenate([nbrs, numpy.tile(idx, (n, 1))], axis=1)
+        if dists.shape[1] < k:  # few candidates, add missing neighbors
+            pad = k - dists.shape[1]
+            dists = numpy.pad(dists, [(0, 0), (0, pad)],
+                              constant_values=numpy.inf)
+            nbrs = numpy.pad(nbrs, [(0, 0), (0, pad)])
+        best = numpy.argsort(dists, axis=1, kind='stable')[:, :k]
+        ok = numpy.take_along_axis(dists, best, 1) < numpy.inf
+        nbrs = numpy.take_along_axis(nbrs, best, 1)
+        nbrs[~ok] = 0
+        return nbrs, ok
+
+    def __matmul__(self, residuals):
+        return self.lu.solve(self.sqrtd[:, None] * residuals)
 
 
 class BaseCorrelationModel(metaclass=abc.ABCMeta):
@@ -26,6 +115,19 @@ class BaseCorrelationModel(metaclass=abc.ABCMeta):
     Base class for correlation models for spatially-distributed ground-shaking
     intensities.
     """
+    max_neighbors = None  # if set, use a LocalCorrelationFactor
+
+    def get_local_factor(self, sites, imt):
+        """
+        :param sites: a SiteCollection
+        :param imt: an Intensity Measure Type object
+        :returns: a :class:`LocalCorrelationFactor` for the given sites
+        """
+        return LocalCorrelationFactor(
+            sites.lons, sites.lats,
+            lambda dists: self._get_correlation_matrix(dists, imt),
+            self.max_neighbors)
+
     def apply_correlation(self, sites, imt, residuals, stddev_intra=0):
         """
         Apply correlation to randomly sampled residuals.
@@ -49,6 +151,8 @@ class BaseCorrelationModel(metaclass=abc.ABCMeta):
         NB: the correlation matrix is cached. It is computed only once
         per IMT for the complete site collection and then the portion
         corresponding to the sites is multiplied by the residuals.
+        If `max_neighbors` is set, the dense Cholesky factor is replaced
+        by a sparse :class:`LocalCorrelationFactor`.
         """
         # intra-event residual for a single relization is a product
         # of lower-triangle decomposed correlation matrix and vector
@@ -58,8 +162,11 @@ class BaseCorrelationModel(metaclass=abc.ABCMeta):
         try:
             corma = self.cache[imt]
         except KeyError:
-            corma = self.get_lower_triangle_correlation_matrix(
-                sites.complete, imt)
+            if self.max_neighbors:
+                corma = self.get_local_factor(sites.complete, imt)
+            else:
+                corma = self.get_lower_triangle_correlation_matrix(
+                    sites.complete, imt)
             self.cache[imt] = corma
         # if N is the length of the complete site collection, then the
         # correlation matrix has shape (N, N) and the residuals (N, s),
@@ -84,9 +191,15 @@ class JB2009CorrelationModel(BaseCorrelationModel):
         Boolean value to indicate whether "Case 1" or "Case 2" from page 1700
         should be applied. ``True`` value means that Vs 30 values show or are
         expected to show clustering ("Case 2"), ``False`` means otherwise.
+    :param max_neighbors:
+        If given, the residual of each site is correlated only with the
+        residuals of its `max_neighbors` nearest sites, which is much
+        faster and less memory-consuming for large site collections, at
+        the cost of an approximation decreasing with `max_neighbors`.
     """
-    def __init__(self, vs30_clustering):
+    def __init__(self, vs30_clustering, max_neighbors=None):
         self.vs30_clustering = vs30_clustering
+        self.max_neighbors = max_neighbors
         self.cache = {}  # imt -> correlation model
 
     def _get_correlation_matrix(self, sites, imt):
@@ -159,9 +272,14 @@ class HM2018CorrelationModel(BaseCorrelationModel):
         Value to be multiplied by the uncertainty in the correlation parameter
         beta. If uncertainty_multiplier = 0 (default), the median value is
         used as a constant value.
+    :param max_neighbors:
+        If given, the residual of each site is correlated only with the
+        residuals of its `max_neighbors` nearest sites; it is ignored if
+        uncertainty_multiplier is not zero.
     """
-    def __init__(self, uncertainty_multiplier=0):
+    def __init__(self, uncertainty_multiplier=0, max_neighbors=None):
         self.uncertainty_multiplier = uncertainty_multiplier
+        self.max_neighbors = max_neighbors
         self.distance_matrix = {}
         self.cache = {}
 
@@ -192,6 +310,12 @@ class HM2018CorrelationModel(BaseCorrelationModel):
             # corresponding standard deviation element.
             residuals_norm = residuals / stddev_intra[sites.sids, None]
 
+            if self.max_neighbors:
+                # correlate the normalized residuals with the local factor
+                # of the complete site collection, then scale them back
+                return stddev_intra[sites.sids, None] * super(
+                    ).apply_correlation(sites, imt, residuals_norm)
+
             # Lower diagonal of the Cholesky decomposition from/to cache
             try:
                 cormaLow = self.cache[imt]
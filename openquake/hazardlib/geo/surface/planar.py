@@ -30,6 +30,15 @@ from openquake.hazardlib.geo import geodetic
 from openquake.hazardlib.geo.nodalplane import NodalPlane
 from openquake.hazardlib.geo import utils as geo_utils
 
+F64 = numpy.float64
+# max number of (rupture, site) pairs in a block of get_planar_distances;
+# each pair requires a few dozens of floats of temporary memory
+MAX_PAIRS = 500_000
+# geometry of a planar surface, as used by the vectorized distance functions
+planar_surface_dt = numpy.dtype([
+    ('strike', F64), ('length', F64), ('width', F64), ('hypo', (F64, 3)),
+    ('corners', (F64, (3, 4)))])
+
 
 class PlanarSurface(BaseSurface):
     """
@@ -622,3 +631,203 @@ class PlanarSurface(BaseSurface):
         return (self.corner_lons.take([0, 1, 3, 2, 0]),
                 self.corner_lats.take([0, 1, 3, 2, 0]),
                 self.corner_depths.take([0, 1, 3, 2, 0]))
+
+
+# ######################## vectorized planar ruptures ###################### #
+
+def get_plane(corners):
+    """
+    Vectorized version of :meth:`PlanarSurface._init_plane`.
+
+    :param corners:
+        an array of shape (K, 3, 4) with the longitudes, latitudes and depths
+        of the corners top left, top right, bottom left, bottom right of K
+        planar surfaces
+    :returns:
+        a tuple (tl, normal, d, uv1, uv2) with arrays of shape (K, 3) except
+        d which has shape K
+    """
+    tl, tr, bl, _br = geo_utils.spherical_to_cartesian(
+        corners[:, 0], corners[:, 1], corners[:, 2]).transpose(1, 0, 2)
+    normal = geo_utils.normalized(numpy.cross(tl - tr, tl - bl))
+    d = - (normal * tl).sum(axis=-1)
+    uv1 = geo_utils.normalized(tr - tl)
+    uv2 = numpy.cross(normal, uv1)
+    return tl, normal, d, uv1, uv2
+
+
+def get_length_width(corners):
+    """
+    :param corners: an array of shape (K, 3, 4)
+    :returns: two arrays of shape K with the lengths and widths, computed
+              as in the constructor of :class:`PlanarSurface`
+    """
+    tl, normal, d, uv1, uv2 = get_plane(corners)
+    xyz = geo_utils.spherical_to_cartesian(
+        corners[:, 0], corners[:, 1], corners[:, 2])  # shape (K, 4, 3)
+    dists = (normal[:, None] * xyz).sum(axis=-1) + d[:, None]
+    vectors2d = xyz - normal[:, None] * dists[..., None] - tl[:, None]
+    xx = (vectors2d * uv1[:, None]).sum(axis=-1)
+    yy = (vectors2d * uv2[:, None]).sum(axis=-1)
+    length = (xx[:, 1] - xx[:, 0] + xx[:, 3] - xx[:, 2]) / 2.
+    width = (yy[:, 2] - yy[:, 0] + yy[:, 3] - yy[:, 1]) / 2.
+    return length, width
+
+
+def _project(plane, xyz):
+    # vectorized version of PlanarSurface._project, returning arrays
+    # of shape (K, N); the projection of the points on the K planes is
+    # never stored, to save memory
+    tl, normal, d, uv1, uv2 = plane
+    dists = normal @ xyz.T + d[:, None]
+    xx = ((uv1 @ xyz.T) - dists * (normal * uv1).sum(axis=-1)[:, None]
+          - (tl * uv1).sum(axis=-1)[:, None])
+    yy = ((uv2 @ xyz.T) - dists * (normal * uv2).sum(axis=-1)[:, None]
+          - (tl * uv2).sum(axis=-1)[:, None])
+    return dists, xx, yy
+
+
+def _get_rjb(planar, lons, lats, xyz):
+    # vectorized version of PlanarSurface.get_joyner_boore_distance
+    clons, clats = planar['corners'][:, 0], planar['corners'][:, 1]
+    strike = planar['strike'][:, None]
+    downdip = (strike + 90) % 360
+    arcs_lons = clons[:, [0, 2, 0, 1], None]  # shape (K, 4, 1)
+    arcs_lats = clats[:, [0, 2, 0, 1], None]
+    arcs_azimuths = numpy.concatenate(
+        [strike, strike, downdip, downdip], axis=1)[:, :, None]
+    dists_to_arcs = geodetic.distance_to_arc(
+        arcs_lons, arcs_lats, arcs_azimuths, lons, lats)  # shape (K, 4, N)
+    ds1, ds2, ds3, ds4 = numpy.sign(dists_to_arcs).transpose(1, 0, 2)
+    dists_to_arcs = numpy.abs(dists_to_arcs)
+    dists_to_corners = numpy.full_like(ds1, numpy.inf)
+    corners_xyz = geo_utils.spherical_to_cartesian(clons, clats)  # (K, 4, 3)
+    for c in range(4):
+        dist = numpy.sqrt(
+            ((corners_xyz[:, c, None] - xyz) ** 2).sum(axis=-1))
+        numpy.fmin(dists_to_corners, dist, out=dists_to_corners)
+    return numpy.select(
+        [(ds1 == ds2) & (ds3 == ds4), ds1 == ds2, ds3 == ds4],
+        [dists_to_corners,
+         numpy.fmin(dists_to_arcs[:, 0], dists_to_arcs[:, 1]),
+         numpy.fmin(dists_to_arcs[:, 2], dists_to_arcs[:, 3])],
+        default=0)
+
+
+def _get_ry0(planar, lons, lats):
+    # vectorized version of PlanarSurface.get_ry0_distance
+    corners = planar['corners']
+    azimuth = (planar['strike'][:, None] + 90.) % 360
+    dst1 = geodetic.distance_to_arc(corners[:, 0, 0, None],
+                                    corners[:, 1, 0, None],
+                                    azimuth, lons, lats)
+    dst2 = geodetic.distance_to_arc(corners[:, 0, 1, None],
+                                    corners[:, 1, 1, None],
+                                    azimuth, lons, lats)
+    return numpy.where(numpy.sign(dst1) == numpy.sign(dst2),
+                       numpy.fmin(numpy.abs(dst1), numpy.abs(dst2)), 0)
+
+
+def build_planar_array(surfaces, hypocenters=()):
+    """
+    :param surfaces:
+        a sequence of K :class:`PlanarSurface` instances
+    :param hypocenters:
+        a sequence of K points, needed to compute rhypo and repi
+    :returns:
+        an array of dtype :data:`planar_surface_dt` and length K
+    """
+    arr = numpy.zeros(len(surfaces), planar_surface_dt)
+    arr['corners'] = [(surface.corner_lons, surface.corner_lats,
+                       surface.corner_depths) for surface in surfaces]
+    arr['strike'] = [surface.strike for surface in surfaces]
+    arr['length'] = [surface.length for surface in surfaces]
+    arr['width'] = [surface.width for surface in surfaces]
+    if len(hypocenters):
+        arr['hypo'] = [(hypo.longitude, hypo.latitude, hypo.depth)
+                       for hypo in hypocenters]
+    return arr
+
+
+def get_planar_distances(planar, mesh, params):
+    """
+    Compute the distances between K planar ruptures and N sites in a
+    vectorized way, without instantiating :class:`PlanarSurface` objects.
+    The ruptures are processed in blocks of at most MAX_PAIRS
+    rupture-site pairs, to bound the memory of the temporary arrays.
+
+    :param planar:
+        an array with fields corners, hypo, strike, length and width, like
+        the ones returned by :func:`build_planar_array` and by the method
+        ``get_planar`` of point-like sources
+    :param mesh:
+        a :class:`openquake.hazardlib.geo.mesh.Mesh` or a site collection
+    :param params:
+        names of the distances to compute, among rrup, rjb, rx, ry0, rhypo,
+        repi, rvolc; lon and lat are accepted too and return the coordinates
+        of the closest points of the ruptures
+    :returns:
+        a dictionary param -> array of shape (K, N)
+    """
+    lons, lats, depths = mesh.lons, mesh.lats, mesh.depths
+    if depths is None:
+        depths = numpy.zeros_like(lons)
+    xyz = geo_utils.spherical_to_cartesian(lons, lats, depths)
+    K, N = len(planar), len(lons)
+    blocksize = max(MAX_PAIRS // N, 1)
+    if K <= blocksize:
+        return _get_planar_distances(planar, lons, lats, depths, xyz, params)
+    dic = {param: numpy.zeros((K, N)) for param in params}
+    for start in range(0, K, blocksize):
+        stop = start + blocksize
+        dists = _get_planar_distances(
+            planar[start:stop], lons, lats, depths, xyz, params)
+        for param in params:
+            dic[param][start:stop] = dists[param]
+    return dic
+
+
+def _get_planar_distances(planar, lons, lats, depths, xyz, params):
+    K, N = len(planar), len(lons)
+    dic = {}
+    if set(params) & {'rrup', 'lon', 'lat'}:
+        plane = get_plane(planar['corners'])
+        dists, xx, yy = _project(plane, xyz)
+        length = planar['length'][:, None]
+        width = planar['width'][:, None]
+        mxx = xx.clip(0, length)
+        myy = yy.clip(0, width)
+    for param in params:
+        if param == 'rrup':
+            dic[param] = numpy.sqrt(dists ** 2 + (xx - mxx) ** 2 +
+                                    (yy - myy) ** 2)
+        elif param == 'rjb':
+            dic[param] = _get_rjb(planar, lons, lats, xyz)
+        elif param == 'rx':
+            corners = planar['corners']
+            dic[param] = geodetic.distance_to_arc(
+                corners[:, 0, 0, None], corners[:, 1, 0, None],
+                planar['strike'][:, None], lons, lats)
+        elif param == 'ry0':
+            dic[param] = _get_ry0(planar, lons, lats)
+        elif param == 'rhypo':
+            hypo = planar['hypo']
+            dic[param] = geodetic.distance(
+                hypo[:, 0, None], hypo[:, 1, None], hypo[:, 2, None],
+                lons, lats, depths)
+        elif param == 'repi':
+            hypo = planar['hypo']
+            dic[param] = geodetic.geodetic_distance(
+                hypo[:, 0, None], hypo[:, 1, None], lons, lats)
+        elif param == 'rvolc':
+            dic[param] = numpy.zeros((K, N))
+        elif param in ('lon', 'lat') and 'lon' not in dic:
+            tl, _normal, _d, uv1, uv2 = plane
+            vectors = (tl[:, None] + uv1[:, None] * mxx[..., None] +
+                       uv2[:, None] * myy[..., None])
+            lons_, lats_, _ = geo_utils.cartesian_to_spherical(
+                vectors.reshape(-1, 3))
+            dic['lon'], dic['lat'] = lons_.reshape(K, N), lats_.reshape(K, N)
+        elif param not in ('lon', 'lat'):
+            raise ValueError('Unknown distance measure %r' % param)
+    return dic
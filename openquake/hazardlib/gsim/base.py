@@ -106,7 +106,8 @@ def get_mean_std(sctx, rctx, dctx, imts, gsims):
     return arr
 
 
-def get_poes(mean_std, loglevels, truncation_level, gsims=()):
+def get_poes(mean_std, loglevels, truncation_level, gsims=(), imt_idx=None,
+             dtype=numpy.float64):
     """
     Calculate and return probabilities of exceedance (PoEs) of one or more
     intensity measure levels (IMLs) of one intensity measure type (IMT)
@@ -136,7 +137,13 @@ def get_poes(mean_std, loglevels, truncation_level, gsims=()):
         value and is defined in units of sigmas. The resulting PoEs
         for that mode are values of complementary cumulative distribution
         function of that truncated Gaussian applied to IMLs.
-
+    :param gsims:
+        the G GSIMs associated to the last axis of mean_std (optional)
+    :param imt_idx:
+        the IMT index of each level, as returned by :func:`level_imts`;
+        if not given, it is computed from the loglevels
+    :param dtype:
+        the precision of the computation (float64 or float32)
     :returns:
         array of PoEs of shape (N, L, G)
 
@@ -151,11 +158,13 @@ def get_poes(mean_std, loglevels, truncation_level, gsims=()):
     if len(gsims):
         assert mean_std.shape[-1] == len(gsims)
     tl = truncation_level
+    if imt_idx is None:
+        imt_idx = level_imts(loglevels)
     if any(hasattr(gsim, 'weights_signs') for gsim in gsims):
         # implement average get_poes for the nshmp_2014 model
         shp = list(mean_std[0].shape)  # (N, M, G)
         shp[1] = len(loglevels.array)  # L
-        arr = numpy.zeros(shp)
+        arr = numpy.zeros(shp, dtype)
         for g, gsim in enumerate(gsims):
             if hasattr(gsim, 'weights_signs'):
                 outs = []
@@ -164,51 +173,66 @@ def get_poes(mean_std, loglevels, truncation_level, gsims=()):
                     ms = numpy.array(mean_std[:, :, :, g])  # make a copy
                     for m in range(len(loglevels)):
                         ms[0, :, m] += s * gsim.adjustment
-                    outs.append(_get_poes(ms, loglevels, tl, squeeze=1))
+                    outs.append(_get_poes(ms, loglevels, tl, imt_idx, dtype))
                 arr[:, :, g] = numpy.average(outs, weights=weights, axis=0)
             else:
                 ms = mean_std[:, :, :, g]
-                arr[:, :, g] = _get_poes(ms, loglevels, tl, squeeze=1)
+                arr[:, :, g] = _get_poes(ms, loglevels, tl, imt_idx, dtype)
         return arr
     elif any("mixture_model" in gsim.kwargs for gsim in gsims):
         shp = list(mean_std[0].shape)  # (N, M, G)
         shp[1] = len(loglevels.array)  # L
-        arr = numpy.zeros(shp)
+        arr = numpy.zeros(shp, dtype)
         for g, gsim in enumerate(gsims):
             if "mixture_model" in gsim.kwargs:
                 for fact, wgt in zip(
                     gsim.kwargs["mixture_model"]["factors"],
                     gsim.kwargs["mixture_model"]["weights"]):
-                    mean_stdi = numpy.copy(mean_std)
-                    mean_stdi[1, :, :, :] *= fact
+                    mean_stdi = numpy.copy(mean_std[:, :, :, g])
+                    mean_stdi[1] *= fact
                     arr[:, :, g] += (wgt * _get_poes(mean_stdi, loglevels, tl,
-                                                     squeeze=1))
+                                                     imt_idx, dtype))
             else:
                 ms = mean_std[:, :, :, g]
-                arr[:, :, g] = _get_poes(ms, loglevels, tl, squeeze=1)
+                arr[:, :, g] = _get_poes(ms, loglevels, tl, imt_idx, dtype)
         return arr
     else:
         # regular case
-        return _get_poes(mean_std, loglevels, truncation_level)
+        return _get_poes(mean_std, loglevels, tl, imt_idx, dtype)
+
+
+def level_imts(loglevels):
+    """
+    :param loglevels: a DictArray imt -> logs of intensity measure levels
+    :returns: an array with the IMT index of each of the L levels
+
+    >>> from openquake.baselib.general import DictArray
+    >>> level_imts(DictArray({'PGA': [.1, .2, .3], 'SA(0.1)': [.1, .2]}))
+    array([0, 0, 0, 1, 1])
+    """
+    imt_idx = numpy.zeros(len(loglevels.array), int)
+    for m, imt in enumerate(loglevels):
+        imt_idx[loglevels(imt)] = m
+    return imt_idx
 
 
 # this is the critical function for the performance of the classical calculator
 # it is dominated by memory allocations (i.e. _truncnorm_sf is ultra-fast)
 # the only way to speedup is to reduce the maximum_distance, then the array
 # will become shorted in the N dimension (number of affected sites)
-def _get_poes(mean_std, loglevels, truncation_level, squeeze=False):
-    mean, stddev = mean_std  # shape (N, M, G) each
-    N, L, G = len(mean), len(loglevels.array), mean.shape[-1]
-    out = numpy.zeros((N, L) if squeeze else (N, L, G))
-    lvl = 0
-    for m, imt in enumerate(loglevels):
-        for iml in loglevels[imt]:
-            if truncation_level == 0:  # just compare imls to mean
-                out[:, lvl] = iml <= mean[:, m]
-            else:
-                out[:, lvl] = (iml - mean[:, m]) / stddev[:, m]
-            lvl += 1
-    return _truncnorm_sf(truncation_level, out)
+def _get_poes(mean_std, loglevels, truncation_level, imt_idx,
+              dtype=numpy.float64):
+    # mean_std has shape (2, N, M, G) or (2, N, M) for a single gsim;
+    # expand the IMTs into levels, i.e. mean and stddev of shape (N, L, ...)
+    mean, stddev = mean_std.astype(dtype, copy=False)[:, :, imt_idx]
+    levels = loglevels.array.astype(dtype)
+    if mean.ndim == 3:
+        levels = levels[:, None]  # broadcast on the gsims
+    if truncation_level == 0:  # just compare imls to mean
+        return (levels <= mean).astype(dtype)
+    values = numpy.subtract(levels, mean, out=mean)
+    values /= stddev
+    return _truncnorm_sf(truncation_level, values)
 
 
 class MetaGSIM(abc.ABCMeta):
@@ -327,6 +351,10 @@ class GroundShakingIntensityModel(metaclass=MetaGSIM):
     non_verified = False
     experimental = False
     adapted = False
+    # False for GSIMs using rupture attributes not listed in
+    # REQUIRES_RUPTURE_PARAMETERS (i.e. the geometry), which cannot be
+    # called on contexts coming from different ruptures
+    stackable = True
     get_poes = staticmethod(get_poes)
 
     @classmethod
@@ -453,6 +481,25 @@ class GroundShakingIntensityModel(metaclass=MetaGSIM):
         return '[%s]' % self.__class__.__name__
 
 
+@functools.lru_cache()
+def _truncnorm_consts(truncation_level):
+    # notation from http://en.wikipedia.org/wiki/Truncated_normal_distribution.
+    # given that mu = 0 and sigma = 1, we have alpha = a and beta = b.
+
+    # "CDF" in comments refers to cumulative distribution function
+    # of non-truncated distribution with that mu and sigma values.
+
+    # assume symmetric truncation, that is ``a = - truncation_level``
+    # and ``b = + truncation_level``.
+
+    # calculate CDF of b
+    phi_b = ndtr(truncation_level)
+
+    # calculate Z as ``Z = CDF(b) - CDF(a)``, here we assume that
+    # ``CDF(a) == CDF(- truncation_level) == 1 - CDF(b)``
+    return phi_b, phi_b * 2 - 1
+
+
 def _truncnorm_sf(truncation_level, values):
     """
     Survival function for truncated normal distribution.
@@ -482,21 +529,8 @@ def _truncnorm_sf(truncation_level, values):
     if truncation_level is None:
         return ndtr(- values)
 
-    # notation from http://en.wikipedia.org/wiki/Truncated_normal_distribution.
-    # given that mu = 0 and sigma = 1, we have alpha = a and beta = b.
-
-    # "CDF" in comments refers to cumulative distribution function
-    # of non-truncated distribution with that mu and sigma values.
-
-    # assume symmetric truncation, that is ``a = - truncation_level``
-    # and ``b = + truncation_level``.
-
-    # calculate CDF of b
-    phi_b = ndtr(truncation_level)
-
-    # calculate Z as ``Z = CDF(b) - CDF(a)``, here we assume that
-    # ``CDF(a) == CDF(- truncation_level) == 1 - CDF(b)``
-    z = phi_b * 2 - 1
+    # CDF(b) and Z are cached, since they depend only on the truncation level
+    phi_b, z = _truncnorm_consts(truncation_level)
 
     # calculate the result of survival function of ``values``,
     # and restrict it to the interval where probability is defined --
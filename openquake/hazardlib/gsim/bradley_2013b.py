@@ -513,6 +513,9 @@ class Bradley2013bChchMaps(Bradley2013bChchCBD):
     #: not have code that can be made available.
     non_verified = True
 
+    #: Uses the rupture surface, so it cannot work on stacked contexts
+    stackable = False
+
     def get_mean_and_stddevs(self, sites, rup, dists, imt, stddev_types):
         """
         See :meth:`superclass method
@@ -38,6 +38,9 @@ class McVerry2006Chch(McVerry2006AscSC):
     #: published, nor is independent code available.
     non_verified = True
 
+    #: Uses the rupture surface, so it cannot work on stacked contexts
+    stackable = False
+
     def get_mean_and_stddevs(self, sites, rup, dists, imt, stddev_types):
         """
         See :meth:`superclass method
@@ -15,9 +15,11 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
-from openquake.baselib.python3compat import zip
+import operator
 import numpy
 
+U32 = numpy.uint32
+I64 = numpy.int64
 F32 = numpy.float32
 F64 = numpy.float64
 BYTES_PER_FLOAT = 8
@@ -106,9 +108,9 @@ class ProbabilityCurve(object):
         return curve[0]
 
 
-class ProbabilityMap(dict):
+class ProbabilityMap(object):
     """
-    A dictionary site_id -> ProbabilityCurve. It defines the complement
+    A mapping site_id -> ProbabilityCurve. It defines the complement
     operator `~`, performing the complement on each curve
 
     ~p = 1 - p
@@ -123,6 +125,29 @@ class ProbabilityMap(dict):
     :class:`ProbabilityMap`. The map can be represented as 3D array of shape
     (shape_x, shape_y, shape_z) = (N, L, I), where N is the number of site IDs,
     L the total number of hazard levels and I the number of GSIMs.
+
+    Internally the curves are stored in a single array of shape (N', L, I)
+    with N' >= N, plus a dense array site ID -> row index; the
+    ProbabilityCurves returned by `pmap[sid]` are views over such array,
+    while the methods `.imul` and `.iadd` update many sites at once.
+
+    Unlike a dictionary, the map does not store the ProbabilityCurve
+    objects: `pmap[sid] = pcurve` copies `pcurve.array` into the map, so
+    changing `pcurve` later does not change the map. Moreover the curves
+    returned by `pmap[sid]`, `.setdefault` and `.values` are valid only
+    until the next insertion of a new site ID: if the underlying array has
+    to grow, it is replaced, and the old curves stop updating the map.
+    Hence a curve must be retrieved again after inserting new sites.
+
+    >>> pmap = ProbabilityMap.build(3, 1, sids=[5, 2], initvalue=1.)
+    >>> pmap.imul([2], numpy.array([[[.5], [.4], [.3]]]))
+    >>> (~pmap)[2]
+    <ProbabilityCurve
+    [[0.5]
+     [0.6]
+     [0.7]]>
+    >>> ~pmap
+    <ProbabilityMap 1, 3, 1>
     """
     @classmethod
     def build(cls, shape_y, shape_z, sids, initvalue=0., dtype=F64):
@@ -133,10 +158,9 @@ class ProbabilityMap(dict):
         :param initvalue: the initial value of the probability (default 0)
         :returns: a ProbabilityMap dictionary
         """
-        dic = cls(shape_y, shape_z)
-        for sid in sids:
-            dic.setdefault(sid, initvalue, dtype)
-        return dic
+        self = cls(shape_y, shape_z, dtype)
+        self.idxs(sids, initvalue)
+        return self
 
     @classmethod
     def from_array(cls, array, sids):
@@ -151,14 +175,87 @@ class ProbabilityMap(dict):
                              % (n_sites, n))
         if len(array.shape) == 2:  # shape (N, L) -> (N, L, 1)
             array = array.reshape(array.shape + (1,))
-        self = cls(*array.shape[1:])
-        for sid, poes in zip(sids, array):
-            self[sid] = ProbabilityCurve(poes)
+        self = cls(*array.shape[1:], dtype=array.dtype)
+        self.set(sids, array)
         return self
 
-    def __init__(self, shape_y, shape_z=1):
+    def __init__(self, shape_y, shape_z=1, dtype=F64):
         self.shape_y = shape_y
         self.shape_z = shape_z
+        self._n = 0  # number of stored curves
+        self._sids = numpy.zeros(0, U32)  # row index -> sid
+        self._idx = numpy.zeros(0, I64)  # sid -> row index, -1 if missing
+        self._array = numpy.zeros((0, shape_y, shape_z), dtype)
+
+    def _grow(self, n):
+        # make room for n more rows, by doubling the underlying arrays
+        nrows = self._n + n
+        if nrows > len(self._array):
+            size = max(nrows, 2 * len(self._array))
+            array = numpy.empty((size, self.shape_y, self.shape_z),
+                                self._array.dtype)
+            array[:self._n] = self._array[:self._n]
+            self._array = array
+            sids = numpy.zeros(size, U32)
+            sids[:self._n] = self._sids[:self._n]
+            self._sids = sids
+
+    def idxs(self, sids, initvalue):
+        """
+        :param sids: a sequence of distinct site IDs
+        :param initvalue: value used to fill the curves of the missing sids
+        :returns: the row indices of the sids in the underlying array
+        """
+        sids = numpy.asarray(sids, U32)
+        if len(sids) == 0:
+            return numpy.zeros(0, I64)
+        maxsid = sids.max()
+        if maxsid >= len(self._idx):
+            idx = numpy.full(maxsid + 1, -1, I64)
+            idx[:len(self._idx)] = self._idx
+            self._idx = idx
+        idxs = self._idx[sids]
+        missing = idxs == -1
+        nmissing = int(missing.sum())
+        if nmissing:
+            self._grow(nmissing)
+            new = numpy.arange(self._n, self._n + nmissing)
+            self._sids[new] = sids[missing]
+            self._idx[sids[missing]] = new
+            self._array[new] = initvalue
+            self._n += nmissing
+            idxs[missing] = new
+        return idxs
+
+    def imul(self, sids, array):
+        """
+        Multiply in-place the curves associated to the given distinct sids
+        by an array of shape (N, L, I); missing curves are initialized to 1.
+        This is used when composing probabilities of no exceedance.
+        """
+        idxs = self.idxs(sids, 1.)  # NB: this can resize self._array
+        self._array[idxs] *= array
+
+    def iadd(self, sids, array):
+        """
+        Add in-place to the curves associated to the given distinct sids
+        an array of shape (N, L, I); missing curves are initialized to 0.
+        This is used when composing mutually exclusive probabilities.
+        """
+        idxs = self.idxs(sids, 0.)  # NB: this can resize self._array
+        self._array[idxs] += array
+
+    def set(self, sids, array):
+        """
+        Set the curves associated to the given distinct sids
+        to an array of shape (N, L, I).
+        """
+        idxs = self.idxs(sids, 0.)  # NB: this can resize self._array
+        self._array[idxs] = array
+
+    def _rows(self):
+        # returns (sids, array) in insertion order
+        return self._sids[:self._n], self._array[:self._n]
 
     def setdefault(self, sid, value, dtype=F64):
         """
@@ -167,37 +264,99 @@ class ProbabilityMap(dict):
 
         :param sid: site ID
         :param value: value used to fill the returned ProbabilityCurve
-        :param dtype: dtype used internally (F32 or F64)
+        :param dtype: ignored, the dtype is fixed when building the map
+        """
+        [idx] = self.idxs([sid], value)
+        return ProbabilityCurve(self._array[idx])
+
+    def get(self, sid, default=None):
+        """
+        Works like `dict.get`
         """
         try:
             return self[sid]
         except KeyError:
-            array = numpy.empty((self.shape_y, self.shape_z), dtype)
-            array.fill(value)
-            pc = ProbabilityCurve(array)
-            self[sid] = pc
-            return pc
+            return default
+
+    def update(self, other):
+        """
+        Works like `dict.update`
+        """
+        if isinstance(other, ProbabilityMap):
+            self.set(*other._rows())
+        else:  # a dictionary sid -> ProbabilityCurve
+            for sid, pcurve in other.items():
+                self[sid] = pcurve
+
+    def copy(self):
+        """
+        :returns: a copy of the map
+        """
+        new = self.__class__(self.shape_y, self.shape_z, self._array.dtype)
+        new.update(self)
+        return new
+
+    def keys(self):
+        """
+        :returns: the site IDs in insertion order
+        """
+        return self._sids[:self._n].tolist()
+
+    def values(self):
+        """
+        :yields: the ProbabilityCurves in insertion order
+        """
+        for idx in range(self._n):
+            yield ProbabilityCurve(self._array[idx])
+
+    def items(self):
+        """
+        :yields: pairs (sid, ProbabilityCurve) in insertion order
+        """
+        return zip(self.keys(), self.values())
+
+    def __getitem__(self, sid):
+        try:
+            idx = self._idx[sid]
+        except IndexError:
+            raise KeyError(sid)
+        if idx == -1:
+            raise KeyError(sid)
+        return ProbabilityCurve(self._array[idx])
+
+    def __setitem__(self, sid, pcurve):
+        [idx] = self.idxs([sid], 0.)
+        self._array[idx] = pcurve.array
+
+    def __contains__(self, sid):
+        return sid < len(self._idx) and self._idx[sid] != -1
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return self._n
+
+    def __bool__(self):
+        return self._n > 0
 
     @property
     def sids(self):
         """The ordered keys of the map as a numpy.uint32 array"""
-        return numpy.array(sorted(self), numpy.uint32)
+        return numpy.sort(self._sids[:self._n])
 
     @property
     def array(self):
         """
         The underlying array of shape (N, L, I)
         """
-        return numpy.array([self[sid].array for sid in sorted(self)])
+        sids, array = self._rows()
+        return array[numpy.argsort(sids)]
 
     @property
     def nbytes(self):
         """The size of the underlying array"""
-        try:
-            N, L, I = get_shape([self])
-        except AllEmptyProbabilityMaps:
-            return 0
-        return BYTES_PER_FLOAT * N * L * I
+        return BYTES_PER_FLOAT * self._n * self.shape_y * self.shape_z
 
     # used when exporting to HDF5
     def convert(self, imtls, nsites, idx=0):
@@ -213,35 +372,25 @@ class ProbabilityMap(dict):
             index on the z-axis (default 0)
         """
         curves = numpy.zeros(nsites, imtls.dt)
+        sids, array = self._rows()
         for imt in curves.dtype.names:
-            curves_by_imt = curves[imt]
-            for sid in self:
-                curves_by_imt[sid] = self[sid].array[imtls(imt), idx]
+            curves[imt][sids] = array[:, imtls(imt), idx]
         return curves
 
     def filter(self, sids):
         """
         Extracs a submap of self for the given sids.
         """
-        dic = self.__class__(self.shape_y, self.shape_z)
-        for sid in sids:
-            try:
-                dic[sid] = self[sid]
-            except KeyError:
-                pass
-        return dic
+        sids = numpy.array([sid for sid in sids if sid in self], U32)
+        return self.from_array(self._array[self._idx[sids]], sids)
 
     def extract(self, inner_idx):
         """
         Extracts a component of the underlying ProbabilityCurves,
         specified by the index `inner_idx`.
         """
-        out = self.__class__(self.shape_y, 1)
-        for sid in self:
-            curve = self[sid]
-            array = curve.array[:, inner_idx].reshape(-1, 1)
-            out[sid] = ProbabilityCurve(array)
-        return out
+        sids, array = self._rows()
+        return self.from_array(array[:, :, [inner_idx]], sids)
 
     def __ior__(self, other):
         if not other:
@@ -249,103 +398,92 @@ class ProbabilityMap(dict):
         if (other.shape_y, other.shape_z) != (self.shape_y, self.shape_z):
             raise ValueError('%s has inconsistent shape with %s' %
                              (other, self))
-        self_sids = set(self)
-        other_sids = set(other)
-        for sid in self_sids & other_sids:
-            self[sid] = self[sid] | other[sid]
-        for sid in other_sids - self_sids:
-            self[sid] = other[sid]
+        sids, array = other._rows()
+        idxs = self.idxs(sids, 0.)
+        self._array[idxs] = 1. - (1. - self._array[idxs]) * (1. - array)
         return self
 
     def __or__(self, other):
-        new = self.__class__(self.shape_y, self.shape_z)
-        new.update(self)
+        new = self.copy()
         new |= other
         return new
 
     __ror__ = __or__
 
-    def __add__(self, other):
-        try:
-            other.get
-            is_pmap = True
-            sids = set(self) | set(other)
-        except AttributeError:  # no .get method, assume a float
-            is_pmap = False
+    def _binop(self, other, op):
+        # apply the operator on the union of the sids, replacing the
+        # missing curves with 1
+        new = self.copy()
+        if isinstance(other, ProbabilityMap):
+            sids, array = other._rows()
+            idxs = new.idxs(sids, 1.)
+            values = numpy.ones_like(new._array[:new._n])
+            values[idxs] = array
+        else:  # assume a float
             assert 0. <= other <= 1., other  # must be a probability
-            sids = set(self)
-        new = self.__class__(self.shape_y, self.shape_z)
-        for sid in sids:
-            prob = other.get(sid, 1) if is_pmap else other
-            new[sid] = self.get(sid, 1) + prob
+            values = other
+        new._array[:new._n] = op(new._array[:new._n], values)
         return new
 
+    def __add__(self, other):
+        return self._binop(other, operator.add)
+
     def __iadd__(self, other):
         # this is used when composing mutually exclusive probabilities
-        for sid in other:
-            pcurve = self.setdefault(sid, 0)
-            pcurve += other[sid]
+        self.iadd(*other._rows())
         return self
 
     def __mul__(self, other):
-        try:
-            other.get
-            is_pmap = True
-            sids = set(self) | set(other)
-        except AttributeError:  # no .get method, assume a float
-            is_pmap = False
-            assert 0. <= other <= 1., other  # must be a probability
-            sids = set(self)
-        new = self.__class__(self.shape_y, self.shape_z)
-        for sid in sids:
-            prob = other.get(sid, 1) if is_pmap else other
-            new[sid] = self.get(sid, 1) * prob
-        return new
+        return self._binop(other, operator.mul)
+
+    def __imul__(self, other):
+        if isinstance(other, ProbabilityMap):
+            self.imul(*other._rows())
+        else:  # assume a float
+            self._array[:self._n] *= other
+        return self
 
     def __ipow__(self, n):
-        for sid, pcurve in self.items():
-            self[sid] = pcurve ** n
+        self._array[:self._n] **= n
         return self
 
     def __pow__(self, n):
-        new = self.__class__(self.shape_y, self.shape_z)
-        for sid, pcurve in self.items():
-            new[sid] = pcurve ** n
+        new = self.copy()
+        new **= n
         return new
 
     def __invert__(self):
-        new = self.__class__(self.shape_y, self.shape_z)
-        for sid in self:
-            if (self[sid].array != 1.).any():
-                new[sid] = ~self[sid]  # store only nonzero probabilities
-        return new
+        sids, array = self._rows()
+        # store only nonzero probabilities
+        ok = (array != 1.).any(axis=(1, 2))
+        return self.from_array(1. - array[ok], sids[ok])
 
     def __getstate__(self):
-        return dict(shape_y=self.shape_y, shape_z=self.shape_z)
+        # trim the underlying arrays, since they can be larger than needed;
+        # the dense lookup _idx has a slot per sid up to the largest one,
+        # so it is not pickled but rebuilt from the sids in __setstate__
+        dic = vars(self).copy()
+        dic['_sids'], dic['_array'] = self._rows()
+        del dic['_idx']
+        return dic
+
+    def __setstate__(self, dic):
+        vars(self).update(dic)
+        sids = self._sids
+        self._idx = numpy.full(sids.max() + 1 if len(sids) else 0, -1, I64)
+        self._idx[sids] = numpy.arange(len(sids))
 
     def __toh5__(self):
         # converts to an array of shape (num_sids, shape_y, shape_z)
-        size = len(self)
-        sids = self.sids
-        shape = (size, self.shape_y, self.shape_z)
-        array = numpy.zeros(shape, F64)
-        for i, sid in numpy.ndenumerate(sids):
-            try:
-                array[i] = self[sid].array
-            except ValueError as exc:
-                # this should never happen, but I got a could not broadcast
-                # input array once for Australia
-                raise ValueError('%s on site_id=%d' % (exc, sid))
-        return dict(array=array, sids=sids), {}
+        sids, array = self._rows()
+        idx = numpy.argsort(sids)
+        return dict(array=array[idx].astype(F64), sids=sids[idx]), {}
 
     def __fromh5__(self, dic, attrs):
         # rebuild the map from sids and probs arrays
-        array = dic['array']
-        sids = dic['sids']
-        self.shape_y = array.shape[1]
-        self.shape_z = array.shape[2]
-        for sid, prob in zip(sids, array):
-            self[sid] = ProbabilityCurve(prob)
+        array = dic['array'][()]
+        self.__init__(array.shape[1], array.shape[2], array.dtype)
+        self.set(dic['sids'][()], array)
 
     def __repr__(self):
         return '<%s %d, %d, %d>' % (self.__class__.__name__, len(self),
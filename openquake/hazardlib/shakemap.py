@@ -278,10 +278,51 @@ def cholesky(spatial_cov, cross_corr):
     return numpy.linalg.cholesky(numpy.array(LLT))
 
 
+def local_residuals(shakemap, imts, spatialcorr, cross_corr, Z,
+                    max_neighbors):
+    """
+    Correlate the standard normal variables Z without building the full
+    covariance matrix of shape (M * N, M * N): the IMTs are correlated with
+    the Cholesky factor of the (M, M) cross correlation matrix and the
+    sites with a
+    :class:`openquake.hazardlib.correlation.LocalCorrelationFactor` for
+    each IMT, so that the memory is linear in the number of sites.
+
+    :param shakemap: an array of N records with fields lon, lat, std
+    :param imts: M intensity measure types
+    :param spatialcorr: 'yes', 'no' or 'full'
+    :param cross_corr: an array of shape (M, M)
+    :param Z: an array of shape (M * N, E)
+    :param max_neighbors: the number of neighbors used for each site
+    :returns: an array of residuals of shape (M * N, E)
+    """
+    M, N = len(imts), len(shakemap)
+    Z = Z.reshape(M, N, -1)
+    # W[i] = sum_k C[i, k] Z[k] has covariance cross_corr[i, j] * identity
+    W = numpy.einsum('ik,kne->ine', numpy.linalg.cholesky(cross_corr), Z)
+    res = numpy.zeros_like(W)
+    lons, lats = shakemap['lon'].astype(float), shakemap['lat'].astype(float)
+    for m, im in enumerate(imts):
+        std = shakemap['std'][str(im)][:, None]
+        if spatialcorr == 'no':
+            res[m] = std * W[m]
+        elif spatialcorr == 'full':  # the same residual for all sites
+            res[m] = std * W[m, 0]
+        else:  # 'yes'
+            factor = correlation.LocalCorrelationFactor(
+                lons, lats, lambda dists: correlation.jbcorrelation(
+                    dists, im, vs30_clustering=True), max_neighbors)
+            res[m] = std * (factor @ W[m])
+    return res.reshape(M * N, -1)
+
+
 def to_gmfs(shakemap, spatialcorr, crosscorr, site_effects, trunclevel,
-            num_gmfs, seed, imts=None):
+            num_gmfs, seed, imts=None, max_neighbors=None):
     """
-    :returns: (IMT-strings, array of GMFs of shape (R, N, E, M)
+    :param max_neighbors:
+        if given, use :func:`local_residuals` instead of the Cholesky
+        decomposition of the full covariance matrix
+    :returns: (IMT-strings, array of GMFs of shape (N, E, M))
     """
     N = len(shakemap)  # number of sites
     std = shakemap['std']
@@ -293,25 +334,29 @@ def to_gmfs(shakemap, spatialcorr, crosscorr, site_effects, trunclevel,
     imts_ = [imt.from_string(name) for name in imts]
     M = len(imts_)
     cross_corr = cross_correlation_matrix(imts_, crosscorr)
-    mu = numpy.array([numpy.ones(num_gmfs) * val[str(imt)][j]
-                      for imt in imts_ for j in range(N)])
-    dmatrix = geo.geodetic.distance_matrix(
-        shakemap['lon'], shakemap['lat'])
-    spatial_corr = spatial_correlation_array(dmatrix, imts_, spatialcorr)
+    mu = numpy.array([val[str(imt)] for imt in imts_]).reshape(M * N, 1)
     stddev = [std[str(imt)] for imt in imts_]
     for im, std in zip(imts_, stddev):
         if std.sum() == 0:
             raise ValueError('Cannot decompose the spatial covariance '
                              'because stddev==0 for IMT=%s' % im)
-    spatial_cov = spatial_covariance_array(stddev, spatial_corr)
-    L = cholesky(spatial_cov, cross_corr)  # shape (M * N, M * N)
     if trunclevel:
         Z = truncnorm.rvs(-trunclevel, trunclevel, loc=0, scale=1,
                           size=(M * N, num_gmfs), random_state=seed)
     else:
         Z = norm.rvs(loc=0, scale=1, size=(M * N, num_gmfs), random_state=seed)
     # Z has shape (M * N, E)
-    gmfs = numpy.exp(L @ Z + mu) / PCTG
+    if max_neighbors:
+        residuals = local_residuals(
+            shakemap, imts_, spatialcorr, cross_corr, Z, max_neighbors)
+    else:
+        dmatrix = geo.geodetic.distance_matrix(
+            shakemap['lon'], shakemap['lat'])
+        spatial_corr = spatial_correlation_array(dmatrix, imts_, spatialcorr)
+        spatial_cov = spatial_covariance_array(stddev, spatial_corr)
+        L = cholesky(spatial_cov, cross_corr)  # shape (M * N, M * N)
+        residuals = L @ Z
+    gmfs = numpy.exp(residuals + mu) / PCTG
     if site_effects:
         gmfs = amplify_gmfs(imts_, shakemap['vs30'], gmfs)
     if gmfs.max() > MAX_GMV:
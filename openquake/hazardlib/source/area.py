@@ -18,8 +18,10 @@ Module :mod:`openquake.hazardlib.source.area` defines :class:`AreaSource`.
 """
 import math
 from copy import deepcopy
+import numpy
 from openquake.hazardlib import geo, mfd
-from openquake.hazardlib.source.point import PointSource
+from openquake.hazardlib.geo import geodetic
+from openquake.hazardlib.source.point import PointSource, _get_planar
 from openquake.hazardlib.source.base import ParametricSeismicSource
 from openquake.hazardlib.source.rupture import ParametricProbabilisticRupture
 
@@ -126,6 +128,32 @@ class AreaSource(ParametricSeismicSource):
                     surface, occ_rate, self.temporal_occurrence_model)
                 yield rupture
 
+    def get_planar(self, shift_hypo=False, mag=None):
+        """
+        :returns: the ruptures as an array of dtype
+                  :data:`openquake.hazardlib.source.point.planar_dt`, in
+                  the same order as :meth:`iter_ruptures`
+
+        The reference ruptures are built on the first point of the polygon
+        mesh and translated to the other points, like in
+        :meth:`iter_ruptures`, but for all the points at once.
+        """
+        mesh = self.polygon.discretize(self.area_discretization)
+        lon0, lat0 = mesh.lons[0], mesh.lats[0]
+        ref = _get_planar(self, lon0, lat0, shift_hypo, mag).flatten()
+        ref['rate'] *= 1. / len(mesh)
+        arr = numpy.repeat(ref[None], len(mesh), axis=0)  # shape (P, U)
+        azimuth = geodetic.azimuth(lon0, lat0, mesh.lons, mesh.lats)
+        distance = geodetic.geodetic_distance(
+            lon0, lat0, mesh.lons, mesh.lats)
+        corners = arr['corners']
+        corners[:, :, 0], corners[:, :, 1] = geodetic.point_at(
+            ref['corners'][:, 0], ref['corners'][:, 1],
+            azimuth[:, None, None], distance[:, None, None])
+        arr['hypo'][:, :, 0] = mesh.lons[:, None]
+        arr['hypo'][:, :, 1] = mesh.lats[:, None]
+        return arr.flatten()
+
     def count_ruptures(self):
         """
         See
@@ -149,6 +149,14 @@ class BaseSeismicSource(metaclass=abc.ABCMeta):
         :yields: pairs (rupture, num_occurrences[num_samples])
         """
         tom = self.temporal_occurrence_model
+        if hasattr(self, 'get_rupture_rates'):  # simple and complex faults
+            # the rates come from the cached rupture placements, so only
+            # the ruptures which actually occur are built
+            rates = self.get_rupture_rates()
+            occurs = numpy.random.poisson(rates * tom.time_span * eff_num_ses)
+            mask = occurs > 0
+            yield from zip(self.iter_ruptures(mask=mask), occurs[mask])
+            return
         if not hasattr(self, 'nodal_plane_distribution'):  # fault
             ruptures = list(self.iter_ruptures())
             rates = numpy.array([rup.occurrence_rate for rup in ruptures])
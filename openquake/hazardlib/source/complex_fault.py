@@ -28,6 +28,25 @@ from openquake.hazardlib.geo.nodalplane import NodalPlane
 from openquake.hazardlib.source.rupture import ParametricProbabilisticRupture
 
 MINWEIGHT = 100
+U16 = numpy.uint16
+
+
+def _closest_ends(cumsum, starts, target):
+    """
+    :param cumsum: non decreasing array of N + 1 partial sums starting from 0
+    :param starts: array of start indices in the range [0, N)
+    :param target: the requested value of the sums cumsum[end] - cumsum[start]
+    :returns: for each start the end index > start giving the sum closest
+              to the target (the first one in case of ties)
+    """
+    n = len(cumsum) - 1
+    base = cumsum[starts]
+    hi = numpy.searchsorted(cumsum, base + target).clip(starts + 1, n)
+    lo = (hi - 1).clip(starts + 1, n)
+    ends = numpy.where(numpy.abs(cumsum[lo] - base - target) <=
+                       numpy.abs(cumsum[hi] - base - target), lo, hi)
+    # manage ties due to cells of zero size
+    return numpy.maximum(numpy.searchsorted(cumsum, cumsum[ends]), starts + 1)
 
 
 def _float_ruptures(rupture_area, rupture_length, cell_area, cell_length):
@@ -49,6 +68,10 @@ def _float_ruptures(rupture_area, rupture_length, cell_area, cell_length):
         of possible locations of the requested rupture on the fault surface.
         Each slice can be used to get a portion of the whole fault surface mesh
         that would represent the location of the rupture.
+
+    The lengths and the areas of the subsurfaces are computed as differences
+    of cumulative sums, so that the best number of columns and rows for all
+    the columns of a row are found with a few vectorized operations.
     """
     nrows, ncols = cell_length.shape
 
@@ -58,41 +81,51 @@ def _float_ruptures(rupture_area, rupture_length, cell_area, cell_length):
         return [slice(None)]
 
     rupture_slices = []
+    cols = numpy.arange(ncols)
+    # cumulative lengths and areas along the rows, starting from zero
+    cum_length = numpy.zeros((nrows, ncols + 1))
+    cum_length[:, 1:] = numpy.cumsum(cell_length, axis=1)
+    cum_area = numpy.zeros((nrows, ncols + 1))
+    cum_area[:, 1:] = numpy.cumsum(cell_area, axis=1)
+    # cumulative areas of the columns, used to extend along length
+    cum_col_area = numpy.zeros(ncols + 1)
+    cum_col_area[1:] = numpy.cumsum(cell_area.sum(axis=0))
 
     dead_ends = set()
     for row in range(nrows):
+        # find the "best match" number of columns for each starting column,
+        # the one that gives the least difference between actual and
+        # requested rupture length (note that we only consider top row here,
+        # mainly for simplicity: it's not yet clear how many rows will we
+        # end up with).
+        last_cols = _closest_ends(cum_length[row], cols, rupture_length)
+        lengths = cum_length[row, last_cols] - cum_length[row, :-1]
+        # the rupture doesn't fit along length if the requested rupture
+        # length is greater than the length of the part of current
+        # row that starts from the current column
+        no_length = (last_cols == ncols) & (lengths < rupture_length)
+
+        # now find the optimum (the one providing the closest to requested
+        # area) number of rows for each starting column
+        areas_acc = numpy.cumsum(cum_area[row:, last_cols] -
+                                 cum_area[row:, :-1], axis=0)
+        rup_rows = numpy.argmin(numpy.abs(areas_acc - rupture_area), axis=0)
+        last_rows = rup_rows + row + 1
+        # the rupture doesn't fit along width
+        no_width = (last_rows == nrows) & (
+            areas_acc[rup_rows, cols] < rupture_area)
+
         for col in range(ncols):
             if col in dead_ends:
                 continue
-            # find the lengths of all possible subsurfaces containing
-            # only the current row and from the current column till
-            # the last one.
-            lengths_acc = numpy.add.accumulate(cell_length[row, col:])
-            # find the "best match" number of columns, the one that gives
-            # the least difference between actual and requested rupture
-            # length (note that we only consider top row here, mainly
-            # for simplicity: it's not yet clear how many rows will we
-            # end up with).
-            rup_cols = numpy.argmin(numpy.abs(lengths_acc - rupture_length))
-            last_col = rup_cols + col + 1
-            if last_col == ncols and lengths_acc[rup_cols] < rupture_length:
-                # rupture doesn't fit along length (the requested rupture
-                # length is greater than the length of the part of current
-                # row that starts from the current column).
-                if col != 0:
-                    # if we are not in the first column, it means that we
-                    # hit the right border, so we need to go to the next
-                    # row.
-                    break
-
-            # now try to find the optimum (the one providing the closest
-            # to requested area) number of rows.
-            areas_acc = numpy.sum(cell_area[row:, col:last_col], axis=1)
-            areas_acc = numpy.add.accumulate(areas_acc, axis=0)
-            rup_rows = numpy.argmin(numpy.abs(areas_acc - rupture_area))
-            last_row = rup_rows + row + 1
-            if last_row == nrows and areas_acc[rup_rows] < rupture_area:
-                # rupture doesn't fit along width.
+            last_col = last_cols[col]
+            if no_length[col] and col != 0:
+                # if we are not in the first column, it means that we
+                # hit the right border, so we need to go to the next
+                # row.
+                break
+            last_row = last_rows[col]
+            if no_width[col]:
                 # we can try to extend it along length but only if we are
                 # at the first row
                 if row == 0:
@@ -101,13 +134,11 @@ def _float_ruptures(rupture_area, rupture_length, cell_area, cell_length):
                         return rupture_slices
                     else:
                         # try to extend along length
-                        areas_acc = numpy.sum(cell_area[:, col:], axis=0)
-                        areas_acc = numpy.add.accumulate(areas_acc, axis=0)
-                        rup_cols = numpy.argmin(
-                            numpy.abs(areas_acc - rupture_area))
-                        last_col = rup_cols + col + 1
-                        if last_col == ncols \
-                                and areas_acc[rup_cols] < rupture_area:
+                        [last_col] = _closest_ends(
+                            cum_col_area, cols[col:col + 1], rupture_area)
+                        if last_col == ncols and (
+                                cum_col_area[last_col] - cum_col_area[col] <
+                                rupture_area):
                             # still doesn't fit, return
                             return rupture_slices
                 else:
@@ -121,8 +152,8 @@ def _float_ruptures(rupture_area, rupture_length, cell_area, cell_length):
             # here we add 1 to last row and column numbers because we want
             # to return slices for cutting the mesh of vertices, not the cell
             # data (like cell_area or cell_length).
-            rupture_slices.append((slice(row, last_row + 1),
-                                   slice(col, last_col + 1)))
+            rupture_slices.append((slice(row, int(last_row) + 1),
+                                   slice(col, int(last_col) + 1)))
     return rupture_slices
 
 
@@ -162,33 +193,78 @@ class ComplexFaultSource(ParametricSeismicSource):
         ComplexFaultSurface.check_fault_data(edges, rupture_mesh_spacing)
         self.edges = edges
         self.rake = rake
+        self._placements = {}  # mag -> rupture bounds, see get_placements
+
+    def get_placements(self):
+        """
+        :returns:
+            a dictionary magnitude -> array of shape (R, 4) with the bounds
+            (first row, last row + 1, first col, last col + 1) of the floating
+            ruptures on the mesh of the whole fault, for the magnitudes with
+            nonzero occurrence rate
+
+        The placements are computed by :func:`_float_ruptures` only once per
+        magnitude and are cached on the source, so that they are pickled
+        together with it (for instance in the source model cache).
+        """
+        mags = [mag for mag, rate in self.get_annual_occurrence_rates()
+                if rate]
+        if not hasattr(self, '_placements'):  # built without __init__
+            self._placements = {}
+        missing = [mag for mag in mags if mag not in self._placements]
+        if missing:
+            mesh = ComplexFaultSurface.from_fault_data(
+                self.edges, self.rupture_mesh_spacing).mesh
+            nrows, ncols = mesh.shape
+            _, cell_length, _, cell_area = mesh.get_cell_dimensions()
+            for mag in missing:
+                rupture_area = self.magnitude_scaling_relationship.\
+                    get_median_area(mag, self.rake)
+                rupture_length = numpy.sqrt(
+                    rupture_area * self.rupture_aspect_ratio)
+                slices = _float_ruptures(
+                    rupture_area, rupture_length, cell_area, cell_length)
+                if slices == [slice(None)]:  # the whole fault
+                    bounds = [(0, nrows, 0, ncols)]
+                else:
+                    bounds = [(r.start, r.stop, c.start, c.stop)
+                              for r, c in slices]
+                self._placements[mag] = numpy.array(bounds, U16)
+        return {mag: self._placements[mag] for mag in mags}
+
+    def get_rupture_rates(self):
+        """
+        :returns:
+            the occurrence rates of the ruptures, in the same order as
+            :meth:`iter_ruptures`, without building the ruptures
+        """
+        mag_rates = dict(self.get_annual_occurrence_rates())
+        return numpy.concatenate(
+            [numpy.full(len(bounds), mag_rates[mag] / len(bounds))
+             for mag, bounds in self.get_placements().items()] or [[]])
 
     def iter_ruptures(self, **kwargs):
         """
         See :meth:
         `openquake.hazardlib.source.base.BaseSeismicSource.iter_ruptures`.
 
-        Uses :func:`_float_ruptures` for finding possible rupture locations
-        on the whole fault surface.
+        Uses :meth:`get_placements` for finding possible rupture locations
+        on the whole fault surface. If a boolean array ``mask`` is passed,
+        yields only the ruptures for which the mask is true.
         """
-        whole_fault_surface = ComplexFaultSurface.from_fault_data(
-            self.edges, self.rupture_mesh_spacing)
-        whole_fault_mesh = whole_fault_surface.mesh
-        cell_center, cell_length, cell_width, cell_area = (
-            whole_fault_mesh.get_cell_dimensions())
-        for mag, mag_occ_rate in self.get_annual_occurrence_rates():
-            # min_mag is inside get_annual_occurrence_rates
-            if mag_occ_rate == 0:
-                continue
-            rupture_area = self.magnitude_scaling_relationship.get_median_area(
-                mag, self.rake)
-            rupture_length = numpy.sqrt(
-                rupture_area * self.rupture_aspect_ratio)
-            rupture_slices = _float_ruptures(
-                rupture_area, rupture_length, cell_area, cell_length)
-            occurrence_rate = mag_occ_rate / float(len(rupture_slices))
-            for rupture_slice in rupture_slices:
-                mesh = whole_fault_mesh[rupture_slice]
+        mask = kwargs.get('mask')
+        whole_fault_mesh = ComplexFaultSurface.from_fault_data(
+            self.edges, self.rupture_mesh_spacing).mesh
+        mag_rates = dict(self.get_annual_occurrence_rates())
+        idx = 0
+        for mag, bounds in self.get_placements().items():
+            mag_occ_rate = mag_rates[mag]
+            occurrence_rate = mag_occ_rate / float(len(bounds))
+            for row0, row1, col0, col1 in bounds:
+                idx += 1
+                if mask is not None and not mask[idx - 1]:
+                    continue
+                mesh = whole_fault_mesh[row0:row1, col0:col1]
                 # XXX: use surface centroid as rupture's hypocenter
                 # XXX: instead of point with middle index
                 hypocenter = mesh.get_middle_point()
@@ -208,22 +284,7 @@ class ComplexFaultSource(ParametricSeismicSource):
         See :meth:
         `openquake.hazardlib.source.base.BaseSeismicSource.count_ruptures`.
         """
-        whole_fault_surface = ComplexFaultSurface.from_fault_data(
-            self.edges, self.rupture_mesh_spacing)
-        whole_fault_mesh = whole_fault_surface.mesh
-        cell_center, cell_length, cell_width, cell_area = (
-            whole_fault_mesh.get_cell_dimensions())
-        self._nr = []
-        for (mag, mag_occ_rate) in self.get_annual_occurrence_rates():
-            if mag_occ_rate == 0:
-                continue
-            rupture_area = self.magnitude_scaling_relationship.get_median_area(
-                mag, self.rake)
-            rupture_length = numpy.sqrt(
-                rupture_area * self.rupture_aspect_ratio)
-            rupture_slices = _float_ruptures(
-                rupture_area, rupture_length, cell_area, cell_length)
-            self._nr.append(len(rupture_slices))
+        self._nr = [len(bounds) for bounds in self.get_placements().values()]
         return sum(self._nr)
 
     def modify_set_geometry(self, edges, spacing):
@@ -233,6 +294,7 @@ class ComplexFaultSource(ParametricSeismicSource):
         ComplexFaultSurface.check_fault_data(edges, spacing)
         self.edges = edges
         self.rupture_mesh_spacing = spacing
+        self._placements = {}  # invalidate the cache
 
     def __iter__(self):
         if self.num_ruptures <= MINWEIGHT:
@@ -96,6 +96,14 @@ class MultiPointSource(ParametricSeismicSource):
             for rupture in ps.iter_ruptures(**kwargs):
                 yield rupture
 
+    def get_planar(self, shift_hypo=False, mag=None):
+        """
+        :returns: the ruptures of the underlying point sources as an array
+                  of dtype :data:`openquake.hazardlib.source.point.planar_dt`
+        """
+        return numpy.concatenate(
+            [ps.get_planar(shift_hypo, mag) for ps in self])
+
     def count_ruptures(self):
         """
         See
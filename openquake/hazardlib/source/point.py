@@ -20,13 +20,23 @@ import math
 import numpy
 from openquake.hazardlib.scalerel import PointMSR
 from openquake.hazardlib.geo import Point, geodetic
-from openquake.hazardlib.geo.surface.planar import PlanarSurface
+from openquake.hazardlib.geo.surface.planar import (
+    PlanarSurface, get_length_width)
 from openquake.hazardlib.geo.nodalplane import NodalPlane
 from openquake.hazardlib.source.base import ParametricSeismicSource
 from openquake.hazardlib.source.rupture import (
     ParametricProbabilisticRupture, PointRupture)
 from openquake.hazardlib.geo.utils import get_bounding_box
 
+F64 = numpy.float64
+# array representation of the planar ruptures of point-like sources;
+# the corners are the longitudes, latitudes and depths of the points
+# top left, top right, bottom left, bottom right
+planar_dt = numpy.dtype([
+    ('mag', F64), ('rake', F64), ('strike', F64), ('dip', F64),
+    ('rate', F64), ('length', F64), ('width', F64), ('hypo', (F64, 3)),
+    ('corners', (F64, (3, 4)))])
+
 
 def _get_rupture_dimensions(src, mag, rake, dip):
     """
@@ -69,6 +79,91 @@ def _get_rupture_dimensions(src, mag, rake, dip):
     return rup_length, rup_width
 
 
+def _get_planar(src, lon, lat, shift_hypo=False, mag=None):
+    """
+    Build the ruptures generated by the source at the given location as an
+    array of dtype :data:`planar_dt` of shape (#mags, #planes, #depths),
+    with the same geometry of :meth:`PointSource._get_rupture_surface`
+    but computed by broadcasting over magnitudes, nodal planes and
+    hypocenter depths.
+
+    :param src:
+        a PointSource, AreaSource or MultiPointSource
+    :param lon:
+        longitude of the epicenter
+    :param lat:
+        latitude of the epicenter
+    :param shift_hypo:
+        if True, the hypocenter is the center of the rupture
+    :param mag:
+        if given, build only the ruptures with that magnitude
+    """
+    mag_rates = [(m, r) for m, r in src.get_annual_occurrence_rates()
+                 if not mag or m == mag]
+    if not mag_rates:
+        return numpy.zeros((0, 0, 0), planar_dt)
+    planes = src.nodal_plane_distribution.data
+    depths = src.hypocenter_distribution.data
+    # the rupture dimensions have shape (M, P, 1)
+    dims = numpy.array([[_get_rupture_dimensions(src, m, np.rake, np.dip)
+                         for _, np in planes] for m, _ in mag_rates])
+    rup_length, rup_width = dims[:, :, 0, None], dims[:, :, 1, None]
+    # the nodal plane parameters have shape (P, 1)
+    strike, dip, rake = numpy.array(
+        [(np.strike, np.dip, np.rake) for _, np in planes]).T[:, :, None]
+    hc_depth = numpy.array([depth for _, depth in depths])  # shape H
+    rdip = numpy.radians(dip)
+    rup_proj_height = rup_width * numpy.sin(rdip)
+    rup_proj_width = rup_width * numpy.cos(rdip)
+    # move the ruptures vertically to fit in the seismogenic layer, see
+    # the comments in PointSource._get_rupture_surface
+    hheight = rup_proj_height / 2.
+    vshift = src.upper_seismogenic_depth - hc_depth + hheight
+    vdown = src.lower_seismogenic_depth - hc_depth - hheight
+    vshift = numpy.where(vshift < 0, numpy.where(vdown > 0, 0, vdown), vshift)
+    hshift = numpy.abs(vshift / numpy.tan(rdip))
+    azimuth = numpy.where(vshift < 0, (strike + 270) % 360,
+                          (strike + 90) % 360)
+    clon, clat = geodetic.point_at(lon, lat, azimuth, hshift)
+    moved = vshift != 0
+    clon = numpy.where(moved, clon, lon)
+    clat = numpy.where(moved, clat, lat)
+    cdepth = hc_depth + vshift
+    # compute the corners by moving along the diagonals of the plane
+    theta = numpy.degrees(
+        numpy.arctan((rup_proj_width / 2.) / (rup_length / 2.)))
+    hor_dist = numpy.sqrt(
+        (rup_length / 2.) ** 2 + (rup_proj_width / 2.) ** 2)
+    shape = vshift.shape
+    arr = numpy.zeros(shape, planar_dt)
+    corners = arr['corners']
+    for c, az in enumerate([strike + 180 + theta, strike - theta,
+                            strike + 180 - theta, strike + theta]):
+        corners[..., 0, c], corners[..., 1, c] = geodetic.point_at(
+            clon, clat, az % 360, hor_dist)
+        corners[..., 2, c] = cdepth + (
+            rup_proj_height / 2. if c >= 2 else -rup_proj_height / 2.)
+    mags, mrates = numpy.array(mag_rates).T[:, :, None, None]
+    np_probs = numpy.array([prob for prob, _ in planes])[:, None]
+    hc_probs = numpy.array([prob for prob, _ in depths])
+    arr['mag'] = mags
+    arr['rake'] = rake
+    arr['strike'] = strike
+    arr['dip'] = dip
+    arr['rate'] = mrates * np_probs * hc_probs
+    if shift_hypo:
+        arr['hypo'] = numpy.moveaxis(
+            numpy.broadcast_arrays(clon, clat, cdepth), 0, -1)
+    else:
+        arr['hypo'][..., 0] = lon
+        arr['hypo'][..., 1] = lat
+        arr['hypo'][..., 2] = hc_depth
+    length, width = get_length_width(corners.reshape(-1, 3, 4))
+    arr['length'] = length.reshape(shape)
+    arr['width'] = width.reshape(shape)
+    return arr
+
+
 class PointSource(ParametricSeismicSource):
     """
     Point source typology represents seismicity on a single geographical
@@ -177,6 +272,14 @@ class PointSource(ParametricSeismicSource):
                         surface, occurrence_rate,
                         self.temporal_occurrence_model)
 
+    def get_planar(self, shift_hypo=False, mag=None):
+        """
+        :returns: the ruptures as an array of dtype :data:`planar_dt`, in
+                  the same order as :meth:`iter_ruptures`
+        """
+        return _get_planar(self, self.location.longitude,
+                           self.location.latitude, shift_hypo, mag).flatten()
+
     def point_ruptures(self):
         """
         Generate one point rupture for each magnitude
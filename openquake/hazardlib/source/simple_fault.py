@@ -19,6 +19,7 @@ Module :mod:`openquake.hazardlib.source.simple_fault` defines
 """
 import copy
 import math
+import numpy
 from openquake.baselib.python3compat import round
 from openquake.hazardlib import mfd
 from openquake.hazardlib.source.base import ParametricSeismicSource
@@ -104,6 +105,7 @@ class SimpleFaultSource(ParametricSeismicSource):
         self.lower_seismogenic_depth = lower_seismogenic_depth
         self.dip = dip
         self.rake = rake
+        self._placements = {}  # mag -> rupture placement, see get_placements
 
         min_mag, max_mag = self.mfd.get_min_max_mag()
         cols_rows = self._get_rupture_dimensions(float('inf'), float('inf'),
@@ -121,6 +123,58 @@ class SimpleFaultSource(ParametricSeismicSource):
                              'ruptures of magnitude %s' %
                              (rupture_mesh_spacing, min_mag))
 
+    def get_placements(self):
+        """
+        :returns:
+            a dictionary magnitude -> (rup_rows, rup_cols, num_rup_along_width,
+            num_rup_along_length) with the number of mesh points of the
+            ruptures and the number of their positions on the whole fault
+
+        The placements are computed only once per magnitude and are cached
+        on the source, so that the mesh of the whole fault is not rebuilt
+        every time the ruptures are counted or sampled.
+        """
+        mags = [mag for mag, rate in self.get_annual_occurrence_rates()]
+        if not hasattr(self, '_placements'):  # built without __init__
+            self._placements = {}
+        missing = [mag for mag in mags if mag not in self._placements]
+        if missing:
+            whole_fault_surface = SimpleFaultSurface.from_fault_data(
+                self.fault_trace, self.upper_seismogenic_depth,
+                self.lower_seismogenic_depth, self.dip,
+                self.rupture_mesh_spacing)
+            mesh_rows, mesh_cols = whole_fault_surface.mesh.shape
+            fault_length = float((mesh_cols - 1) * self.rupture_mesh_spacing)
+            fault_width = float((mesh_rows - 1) * self.rupture_mesh_spacing)
+            for mag in missing:
+                rup_cols, rup_rows = self._get_rupture_dimensions(
+                    fault_length, fault_width, mag)
+                self._placements[mag] = (rup_rows, rup_cols,
+                                         mesh_rows - rup_rows + 1,
+                                         mesh_cols - rup_cols + 1)
+        return {mag: self._placements[mag] for mag in mags}
+
+    def get_rupture_rates(self):
+        """
+        :returns:
+            the occurrence rates of the ruptures, in the same order as
+            :meth:`iter_ruptures`, without building the ruptures
+        """
+        placements = self.get_placements()
+        rates = []
+        for mag, mag_occ_rate in self.get_annual_occurrence_rates():
+            _, _, num_rup_along_width, num_rup_along_length = placements[mag]
+            num_rup = num_rup_along_length * num_rup_along_width
+            occurrence_rate = mag_occ_rate / float(num_rup)
+            if not len(self.hypo_list) and not len(self.slip_list):
+                rates.append(numpy.full(num_rup, occurrence_rate))
+            else:
+                rates.append(numpy.tile(
+                    [occurrence_rate * hypo[2] * slip[1]
+                     for hypo in self.hypo_list for slip in self.slip_list],
+                    num_rup))
+        return numpy.concatenate(rates or [[]])
+
     def iter_ruptures(self, **kwargs):
         """
         See :meth:
@@ -132,20 +186,19 @@ class SimpleFaultSource(ParametricSeismicSource):
         size on the surface of the whole fault source. The occurrence
         rate of each of those ruptures is the magnitude occurrence rate
         divided by the number of ruptures that can be placed in a fault.
+        If a boolean array ``mask`` is passed, yields only the ruptures
+        for which the mask is true.
         """
+        mask = kwargs.get('mask')
         whole_fault_surface = SimpleFaultSurface.from_fault_data(
             self.fault_trace, self.upper_seismogenic_depth,
             self.lower_seismogenic_depth, self.dip, self.rupture_mesh_spacing)
         whole_fault_mesh = whole_fault_surface.mesh
-        mesh_rows, mesh_cols = whole_fault_mesh.shape
-        fault_length = float((mesh_cols - 1) * self.rupture_mesh_spacing)
-        fault_width = float((mesh_rows - 1) * self.rupture_mesh_spacing)
-
+        placements = self.get_placements()
+        idx = 0
         for mag, mag_occ_rate in self.get_annual_occurrence_rates():
-            rup_cols, rup_rows = self._get_rupture_dimensions(
-                fault_length, fault_width, mag)
-            num_rup_along_length = mesh_cols - rup_cols + 1
-            num_rup_along_width = mesh_rows - rup_rows + 1
+            (rup_rows, rup_cols, num_rup_along_width,
+             num_rup_along_length) = placements[mag]
             num_rup = num_rup_along_length * num_rup_along_width
             occurrence_rate = mag_occ_rate / float(num_rup)
             for first_row in range(num_rup_along_width):
@@ -154,7 +207,9 @@ class SimpleFaultSource(ParametricSeismicSource):
                                             first_col: first_col + rup_cols]
 
                     if not len(self.hypo_list) and not len(self.slip_list):
-
+                        idx += 1
+                        if mask is not None and not mask[idx - 1]:
+                            continue
                         hypocenter = mesh.get_middle_point()
                         occurrence_rate_hypo = occurrence_rate
                         surface = SimpleFaultSurface(mesh)
@@ -166,6 +221,9 @@ class SimpleFaultSource(ParametricSeismicSource):
                     else:
                         for hypo in self.hypo_list:
                             for slip in self.slip_list:
+                                idx += 1
+                                if mask is not None and not mask[idx - 1]:
+                                    continue
                                 surface = SimpleFaultSurface(mesh)
                                 hypocenter = surface.get_hypo_location(
                                     self.rupture_mesh_spacing, hypo[:2])
@@ -184,23 +242,14 @@ class SimpleFaultSource(ParametricSeismicSource):
         See :meth:
         `openquake.hazardlib.source.base.BaseSeismicSource.count_ruptures`.
         """
-        whole_fault_surface = SimpleFaultSurface.from_fault_data(
-            self.fault_trace, self.upper_seismogenic_depth,
-            self.lower_seismogenic_depth, self.dip, self.rupture_mesh_spacing)
-        whole_fault_mesh = whole_fault_surface.mesh
-        mesh_rows, mesh_cols = whole_fault_mesh.shape
-        fault_length = float((mesh_cols - 1) * self.rupture_mesh_spacing)
-        fault_width = float((mesh_rows - 1) * self.rupture_mesh_spacing)
+        placements = self.get_placements()
         self._nr = []
         n_hypo = len(self.hypo_list) or 1
         n_slip = len(self.slip_list) or 1
         for (mag, mag_occ_rate) in self.get_annual_occurrence_rates():
             if mag_occ_rate == 0:
                 continue
-            rup_cols, rup_rows = self._get_rupture_dimensions(
-                fault_length, fault_width, mag)
-            num_rup_along_length = mesh_cols - rup_cols + 1
-            num_rup_along_width = mesh_rows - rup_rows + 1
+            _, _, num_rup_along_width, num_rup_along_length = placements[mag]
             self._nr.append(num_rup_along_length * num_rup_along_width *
                             n_hypo * n_slip)
         counts = sum(self._nr)
@@ -266,6 +315,7 @@ class SimpleFaultSource(ParametricSeismicSource):
         self.lower_seismogenic_depth = lower_seismogenic_depth
         self.dip = dip
         self.rupture_mesh_spacing = spacing
+        self._placements = {}  # invalidate the cache
 
     def modify_adjust_dip(self, increment):
         """
@@ -280,6 +330,7 @@ class SimpleFaultSource(ParametricSeismicSource):
             self.lower_seismogenic_depth, self.dip + increment,
             self.rupture_mesh_spacing)
         self.dip += increment
+        self._placements = {}  # invalidate the cache
 
     def modify_set_dip(self, dip):
         """
@@ -292,6 +343,7 @@ class SimpleFaultSource(ParametricSeismicSource):
             self.fault_trace, self.upper_seismogenic_depth,
             self.lower_seismogenic_depth, dip, self.rupture_mesh_spacing)
         self.dip = dip
+        self._placements = {}  # invalidate the cache
 
     def __iter__(self):
         mag_rates = self.get_annual_occurrence_rates()
@@ -15,6 +15,7 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
+import json
 import operator
 import collections
 import pickle
@@ -272,18 +273,46 @@ class SourceGroup(collections.abc.Sequence):
         lst = []
         for i, src in enumerate(self.sources):
             buf = pickle.dumps(src, pickle.HIGHEST_PROTOCOL)
-            lst.append((src.id, src.num_ruptures,
+            lst.append((getattr(src, 'id', i), src.num_ruptures,
                         numpy.frombuffer(buf, numpy.uint8)))
         attrs = dict(
             trt=self.trt,
             name=self.name or '',
             src_interdep=self.src_interdep,
             rup_interdep=self.rup_interdep,
-            grp_probability=self.grp_probability or '')
+            grp_probability=self.grp_probability or '',
+            min_mag=json.dumps(self.min_mag),
+            max_mag=numpy.nan if self.max_mag is None else self.max_mag,
+            cluster=self.cluster)
+        tom_ = self.temporal_occurrence_model
+        if tom_ is not None:
+            attrs['tom'] = tom_.__class__.__name__
+            attrs['time_span'] = tom_.time_span
+            attrs['occurrence_rate'] = tom_.occurrence_rate or ''
         return numpy.array(lst, source_dt), attrs
 
     def __fromh5__(self, array, attrs):
-        vars(self).update(attrs)
+        dic = dict(attrs)
+        tom_name = dic.pop('tom', None)
+        time_span = dic.pop('time_span', None)
+        occurrence_rate = dic.pop('occurrence_rate', '')
+        # groups written by older versions do not store the magnitude
+        # limits and the cluster flag
+        min_mag = dic.pop('min_mag', '{"default": 0}')
+        max_mag = dic.pop('max_mag', numpy.nan)
+        cluster = dic.pop('cluster', False)
+        vars(self).update(dic)
+        self.name = self.name or None
+        self.grp_probability = self.grp_probability or None
+        self.min_mag = json.loads(min_mag)
+        self.max_mag = None if numpy.isnan(max_mag) else max_mag
+        self.cluster = bool(cluster)
+        self.source_model = None
+        if tom_name is None:
+            self.temporal_occurrence_model = None
+        else:
+            self.temporal_occurrence_model = tom.registry[tom_name](
+                time_span, occurrence_rate or None)
         self.sources = []
         for row in array:
             self.sources.append(pickle.loads(memoryview(row['pik'])))
@@ -40,11 +40,30 @@ def std_curve(values, weights=None):
     return res
 
 
+def _interp(x, xp, fp):
+    # vectorized version of numpy.interp(x, xp[:, idx], fp[:, idx]) for all
+    # the indices idx on the trailing axes; xp must be sorted on the first axis
+    if len(xp) == 1:
+        return fp[0].astype(float)
+    j = (xp <= x).sum(axis=0) - 1  # xp[j] <= x < xp[j + 1]
+    j = numpy.clip(j, 0, len(xp) - 2)[None]
+    x0 = numpy.take_along_axis(xp, j, 0)[0]
+    x1 = numpy.take_along_axis(xp, j + 1, 0)[0]
+    y0 = numpy.take_along_axis(fp, j, 0)[0]
+    y1 = numpy.take_along_axis(fp, j + 1, 0)[0]
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        res = (y1 - y0) / (x1 - x0) * (x - x0) + y0
+    res = numpy.where(x < xp[0], fp[0], res)
+    return numpy.where(x >= xp[-1], fp[-1], res)
+
+
 # NB: for equal weights and sorted values the quantile is computed a
 # numpy.interp(q, [1/N, 2/N, ..., N/N], values)
 def quantile_curve(quantile, curves, weights=None):
     """
     Compute the weighted quantile aggregate of a set of curves.
+    The curves are sorted once along the first axis and the
+    quantile is interpolated for all the points at the same time.
 
     :param quantile:
         Quantile value to calculate. Should be in the range [0.0, 1.0].
@@ -54,6 +73,9 @@ def quantile_curve(quantile, curves, weights=None):
         Array-like of weights, 1 for each input curve, or None
     :returns:
         A numpy array representing the quantile aggregate
+
+    >>> quantile_curve(.5, [[.1, .4], [.3, .2], [.2, .3]])
+    array([0.15, 0.25])
     """
     if not isinstance(curves, numpy.ndarray):
         curves = numpy.array(curves)
@@ -63,14 +85,11 @@ def quantile_curve(quantile, curves, weights=None):
     else:
         weights = numpy.array(weights)
         assert len(weights) == R, (len(weights), R)
-    result = numpy.zeros(curves.shape[1:])
-    for idx, _ in numpy.ndenumerate(result):
-        data = numpy.array([a[idx] for a in curves])
-        sorted_idxs = numpy.argsort(data)
-        cum_weights = numpy.cumsum(weights[sorted_idxs])
-        # get the quantile from the interpolated CDF
-        result[idx] = numpy.interp(quantile, cum_weights, data[sorted_idxs])
-    return result
+    sorted_idxs = numpy.argsort(curves, axis=0)
+    data = numpy.take_along_axis(curves, sorted_idxs, 0)
+    cum_weights = numpy.cumsum(weights[sorted_idxs], axis=0)
+    # get the quantile from the interpolated CDF
+    return _interp(quantile, cum_weights, data)
 
 
 def max_curve(values, weights=None):
@@ -110,20 +129,20 @@ def compute_pmap_stats(pmaps, stats, weights, imtls):
     nstats = len(stats)
     curves = numpy.zeros((len(pmaps), len(sids), L), numpy.float64)
     for i, pmap in enumerate(pmaps):
-        for j, sid in enumerate(sids):
-            if sid in pmap:
-                curves[i, j] = pmap[sid].array[:, 0]
-    out = p0.__class__.build(L, nstats, sids)
+        if pmap:
+            idxs = numpy.searchsorted(sids, pmap.sids)
+            curves[i, idxs] = pmap.array[:, :, 0]
+    array = numpy.zeros((len(sids), L, nstats))
     for imt in imtls:
         slc = imtls(imt)
         w = [weight[imt] if hasattr(weight, 'dic') else weight
              for weight in weights]
         if sum(w) == 0:  # expect no data for this IMT
             continue
-        for i, array in enumerate(compute_stats(curves[:, :, slc], stats, w)):
-            for j, sid in numpy.ndenumerate(sids):
-                out[sid].array[slc, i] = array[j]
-    return out
+        # compute_stats returns an array of shape (S, N, L')
+        array[:, slc] = compute_stats(
+            curves[:, :, slc], stats, w).transpose(1, 2, 0)
+    return p0.__class__.from_array(array, sids)
 
 
 # NB: this is a function linear in the array argument
@@ -162,7 +181,7 @@ def compute_stats2(arrayNR, stats, weights):
                          (len(weights), newshape[1]))
     newshape[1] = len(stats)  # number of statistical outputs
     newarray = numpy.zeros(newshape, arrayNR.dtype)
-    data = [arrayNR[:, i] for i in range(len(weights))]
+    data = arrayNR.swapaxes(0, 1)  # shape (R, N, ...)
     for i, func in enumerate(stats):
         newarray[:, i] = apply_stat(func, data, weights)
     return newarray
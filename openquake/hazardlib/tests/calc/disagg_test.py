@@ -82,6 +82,25 @@ class DigitizeLonsTestCase(unittest.TestCase):
         numpy.testing.assert_equal(idx, expected)
 
 
+class EpsPoesTestCase(unittest.TestCase):
+
+    def test_same_as_disaggregate_pne(self):
+        # the vectorized poes must be identical to the scalar ones
+        tn, eps, bands = disagg._eps3(truncation_level=2, n_epsilons=4)
+        lvls = numpy.array([-3, -2, -1.5, -0.1, 0, 0.7, 1, 1.99, 2, 2.5])
+        poes = disagg._eps_poes(lvls, tn, eps, bands)
+        mean_std = numpy.zeros((2, 1, 1))
+        mean_std[1] = 1
+
+        class FakeRupture:  # returning the poes unchanged
+            def get_probability_no_exceedance(self, poes):
+                return poes
+        for lvl, poe in zip(lvls, poes):
+            expected = disagg._disaggregate_pne(
+                FakeRupture(), mean_std, numpy.array([[lvl]]), tn, eps, bands)
+            numpy.testing.assert_equal(poe, expected[0, 0])
+
+
 class DisaggregateTestCase(unittest.TestCase):
     def setUp(self):
         d = os.path.dirname(os.path.dirname(__file__))
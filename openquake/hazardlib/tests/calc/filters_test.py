@@ -17,6 +17,7 @@
 # along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
 import os
 import unittest
+import numpy
 from numpy.testing import assert_almost_equal as aae
 from openquake.baselib.general import gettemp
 from openquake.hazardlib import nrml
@@ -72,6 +73,36 @@ class SourceFilterTestCase(unittest.TestCase):
         aae(bb1, (176.928409, 79.640272, 181.071591, 80.359728))
         aae(bb2, (-181.071591, 79.640272, -176.928409, 80.359728))
 
+    def test_sids_within_bboxes(self):
+        # the batched KD-tree query must give the same sites as within_bbox
+        rng = numpy.random.RandomState(42)
+        for lon0 in (0, 178):  # the second case crosses the IDL
+            lons = (lon0 + rng.uniform(-5, 5, 1000) + 180) % 360 - 180
+            lats = rng.uniform(40, 50, 1000)
+            sitecol = SiteCollection.from_points(lons, lats)
+            srcfilter = SourceFilter(sitecol, {'default': 100})
+            bboxes = []
+            for lon, lat in zip(rng.uniform(-6, 6, 50) + lon0,
+                                rng.uniform(39, 51, 50)):
+                w, h = rng.uniform(0.1, 3, 2)
+                bboxes.append(((lon - w + 180) % 360 - 180, lat - h,
+                               (lon + w + 180) % 360 - 180, lat + h))
+            for bbox, sids in zip(
+                    bboxes, srcfilter.sids_within_bboxes(bboxes)):
+                numpy.testing.assert_equal(sids, sitecol.within_bbox(bbox))
+
+    def test_sids_within_wide_bbox(self):
+        # a box wider than 180 degrees around the IDL: the farthest points
+        # from the center are in the middle of the side edges, not corners
+        lons, lats = numpy.meshgrid(numpy.arange(-175, 180, 10),
+                                    numpy.arange(-75, 80, 10))
+        sitecol = SiteCollection.from_points(lons.flatten(), lats.flatten())
+        srcfilter = SourceFilter(sitecol, {'default': 100})
+        bbox = (45, -80, -45, 80)  # 270 degrees of longitude
+        [sids] = srcfilter.sids_within_bboxes([bbox])
+        self.assertIn(sitecol.within_bbox([50, -10, 60, 10])[0], sids)
+        numpy.testing.assert_equal(sids, sitecol.within_bbox(bbox))
+
     def test_international_date_line_2(self):
         # from a bug affecting a calculation in New Zealand
         fname = gettemp(characteric_source)
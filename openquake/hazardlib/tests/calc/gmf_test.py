@@ -0,0 +1,91 @@
+# The Hazard Library
+# Copyright (C) 2020 GEM Foundation
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import unittest
+import numpy
+from openquake.baselib.general import DictArray
+from openquake.hazardlib.const import TRT
+from openquake.hazardlib.geo import Point
+from openquake.hazardlib.geo.surface import PlanarSurface
+from openquake.hazardlib.site import Site, SiteCollection
+from openquake.hazardlib.source.rupture import BaseRupture, EBRupture
+from openquake.hazardlib.gsim.base import ContextMaker
+from openquake.hazardlib.calc.filters import IntegrationDistance
+from openquake.hazardlib.gsim.sadigh_1997 import SadighEtAl1997
+from openquake.hazardlib.gsim.campbell_2003 import Campbell2003
+from openquake.hazardlib.calc.gmf import GmfComputer
+
+
+class GmfComputerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        surface = PlanarSurface.from_corner_points(
+            Point(0.1, -0.1, 0.), Point(0.1, 0.1, 0.),
+            Point(0.1, 0.1, 10.), Point(0.1, -0.1, 10.))
+        rup = BaseRupture(6.5, 0.0, TRT.ACTIVE_SHALLOW_CRUST,
+                          Point(0.1, 0, 5.), surface)
+        rup.rup_id = 42
+        ebr = EBRupture(rup, 0, 0, n_occ=10)
+        ebr.e0 = 100
+        sites = [Site(Point(0.01 * i, 0.01 * i), vs30=760., z1pt0=40.,
+                      z2pt5=1.)
+                 for i in range(13)]
+        gsims = [SadighEtAl1997(), Campbell2003()]
+        cmaker = ContextMaker(
+            TRT.ACTIVE_SHALLOW_CRUST, gsims,
+            dict(imtls=DictArray({'PGA': [.1], 'SA(0.1)': [.1]}),
+                 maximum_distance=IntegrationDistance({'default': 200})))
+        self.computer = GmfComputer(
+            ebr, SiteCollection(sites), ['PGA', 'SA(0.1)'], cmaker,
+            truncation_level=3)
+        self.rlzs_by_gsim = {gsim: [i] for i, gsim in enumerate(gsims)}
+        self.min_iml = numpy.array([.01, .01])
+
+    def test_chunks(self):
+        # the chunked GMFs are the same as the unchunked ones
+        allgmfs, _dt = self.computer.compute_all(
+            self.min_iml, self.rlzs_by_gsim)
+        self.assertEqual(len(allgmfs), 260)  # 2 gsims x 10 events x 13 sites
+        max_rows = 30
+        chunks = list(self.computer.gen_gmfs(
+            self.min_iml, self.rlzs_by_gsim, max_rows=max_rows))
+        self.assertGreater(len(chunks), 1)
+        numpy.testing.assert_equal(numpy.concatenate(chunks), allgmfs)
+        seen = set()
+        for chunk in chunks:
+            # the events are not split between chunks
+            eids = set(chunk['eid'])
+            self.assertFalse(eids & seen)
+            seen |= eids
+            self.assertTrue(len(chunk) <= max_rows or len(eids) == 1)
+
+    def test_big_event(self):
+        # an event with more sites than max_rows is yielded as a whole
+        chunks = list(self.computer.gen_gmfs(
+            self.min_iml, self.rlzs_by_gsim, max_rows=5))
+        self.assertEqual([len(chunk) for chunk in chunks], [13] * 20)
+
+    def test_rlzi_dtype(self):
+        # with sampling the first realization can have no events and
+        # the realization indices must stay integers anyway
+        ebr = self.computer.rupture
+        ebr.rupture.rup_id = 44  # the histogram of 1 event in 2 rlzs is 0, 1
+        ebr.n_occ, ebr.samples = 1, 2
+        gsim = self.computer.gsims[0]
+        sig_eps = []
+        list(self.computer.gen_gmfs(self.min_iml, {gsim: [0, 1]}, sig_eps))
+        [(eid, rlzi, *_)] = sig_eps
+        self.assertEqual(rlzi, 1)
+        self.assertIsInstance(rlzi, numpy.integer)
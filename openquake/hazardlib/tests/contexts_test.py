@@ -18,7 +18,22 @@
 
 import unittest
 import numpy
-from openquake.hazardlib.contexts import Effect
+from openquake.baselib.general import DictArray
+from openquake.hazardlib import const
+from openquake.hazardlib.contexts import Effect, ContextMaker
+from openquake.hazardlib.calc.filters import IntegrationDistance
+from openquake.hazardlib.geo import Point, NodalPlane
+from openquake.hazardlib.gsim.base import get_mean_std
+from openquake.hazardlib.gsim.sadigh_1997 import SadighEtAl1997
+from openquake.hazardlib.gsim.akkar_bommer_2010 import AkkarBommer2010
+from openquake.hazardlib.mfd import EvenlyDiscretizedMFD
+from openquake.hazardlib.pmf import PMF
+from openquake.hazardlib.scalerel import WC1994
+from openquake.hazardlib.site import Site, SiteCollection
+from openquake.hazardlib.source import PointSource
+from openquake.hazardlib.tom import PoissonTOM
+
+aac = numpy.testing.assert_allclose
 
 dists = numpy.array([0, 10, 20, 30, 40, 50])
 intensities = {
@@ -39,3 +54,48 @@ class EffectTestCase(unittest.TestCase):
 
         dist = list(effect.dist_by_mag(1.1).values())
         numpy.testing.assert_allclose(dist, [0, 10, 13.225806, 16.666667])
+
+
+class StackTestCase(unittest.TestCase):
+    def test_stack_ctxs(self):
+        # 3 point sources with the same magnitudes and nodal planes
+        srcs = [PointSource(
+            source_id='p%d' % i, name='p%d' % i,
+            tectonic_region_type=const.TRT.ACTIVE_SHALLOW_CRUST,
+            mfd=EvenlyDiscretizedMFD(
+                min_mag=5, bin_width=1, occurrence_rates=[.01, .001]),
+            nodal_plane_distribution=PMF([(1, NodalPlane(0, 90, 0))]),
+            hypocenter_distribution=PMF([(1, 10)]),
+            upper_seismogenic_depth=0.0,
+            lower_seismogenic_depth=10.0,
+            magnitude_scaling_relationship=WC1994(),
+            rupture_aspect_ratio=2,
+            temporal_occurrence_model=PoissonTOM(1.),
+            rupture_mesh_spacing=1.0,
+            location=Point(10 + i * .1, 10)) for i in range(3)]
+        sitecol = SiteCollection([
+            Site(Point(10, 10.1), 760, 100, 1),
+            Site(Point(10.1, 10.2), 400, 200, 2),
+            Site(Point(10.2, 10.3), 500, 300, 3)])
+        gsims = [SadighEtAl1997(), AkkarBommer2010()]
+        imtls = DictArray({'PGA': [.01, .1, .5], 'SA(0.1)': [.01, .1]})
+        cmaker = ContextMaker(
+            const.TRT.ACTIVE_SHALLOW_CRUST, gsims,
+            dict(imtls=imtls, maximum_distance=IntegrationDistance(
+                {'default': 100})))
+        rups = [rup for src in srcs for rup in src.iter_ruptures()]
+        ctxs = cmaker.make_ctxs(rups, sitecol, [0], filt=True)
+        self.assertEqual(len(ctxs), 6)
+        stacks = list(cmaker.stack_ctxs(ctxs, 100))
+        self.assertEqual(len(stacks), 2)  # one stack per magnitude
+        for stack, sites, dctx in stacks:
+            mean_std = get_mean_std(
+                sites, stack[0][0], dctx, cmaker.imts, gsims)
+            expected = numpy.concatenate([
+                get_mean_std(s, rup, d, cmaker.imts, gsims)
+                for rup, s, d in stack], axis=1)
+            aac(mean_std, expected)
+
+        # with maxrows=1 nothing is stacked
+        stacks = list(cmaker.stack_ctxs(ctxs, 1))
+        self.assertEqual(len(stacks), 6)
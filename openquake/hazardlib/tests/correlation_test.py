@@ -19,7 +19,7 @@ import numpy
 
 from openquake.hazardlib.imt import SA, PGA
 from openquake.hazardlib.correlation import JB2009CorrelationModel, \
-                                            HM2018CorrelationModel
+    HM2018CorrelationModel, LocalCorrelationFactor, jbcorrelation
 from openquake.hazardlib.site import Site, SiteCollection
 from openquake.hazardlib.geo import Point
 
@@ -148,6 +148,60 @@ class JB2009ApplyCorrelationTestCase(unittest.TestCase):
              decimal=6)
 
 
+class LocalCorrelationFactorTestCase(unittest.TestCase):
+    # a grid of 15 x 15 sites spaced by ~3.3 km
+    lons, lats = numpy.meshgrid(numpy.linspace(0, .45, 15),
+                                numpy.linspace(0, .45, 15))
+    SITECOL = SiteCollection([Site(Point(lon, lat), 1, 1, 1) for lon, lat
+                              in zip(lons.flat, lats.flat)])
+
+    def get_dense(self, imt):
+        corma = jbcorrelation(self.SITECOL, imt)
+        return corma, numpy.linalg.cholesky(corma)
+
+    def get_local(self, imt, k):
+        factor = LocalCorrelationFactor(
+            self.SITECOL.lons, self.SITECOL.lats,
+            lambda dists: jbcorrelation(dists, imt), k)
+        return factor @ numpy.eye(len(self.SITECOL))
+
+    def test_exact(self):
+        # with all the previous sites as neighbors the factor is exact
+        _, lt = self.get_dense(SA(0.3))
+        aaae(self.get_local(SA(0.3), len(self.SITECOL) - 1), lt)
+
+    def test_accuracy(self):
+        # the error on the correlation matrix decreases with the neighbors
+        corma, _ = self.get_dense(SA(0.3))
+        errors = []
+        for k in (5, 10, 20):
+            lt = self.get_local(SA(0.3), k)
+            errors.append(numpy.abs(lt @ lt.T - corma).max())
+        self.assertLess(errors[2], errors[1])
+        self.assertLess(errors[1], errors[0])
+        self.assertLess(errors[2], .02)
+
+    def test_apply_filtered(self):
+        # same results as the dense path on a filtered site collection
+        filtered = self.SITECOL.filtered(range(0, 225, 2))
+        residuals = numpy.random.RandomState(42).normal(size=(113, 3))
+        dense = JB2009CorrelationModel(vs30_clustering=False)
+        local = JB2009CorrelationModel(vs30_clustering=False,
+                                       max_neighbors=224)
+        aaae(local.apply_correlation(filtered, PGA(), residuals),
+             dense.apply_correlation(filtered, PGA(), residuals))
+
+    def test_apply_hm2018(self):
+        residuals = numpy.random.RandomState(42).normal(size=(225, 3))
+        stddev_intra = numpy.linspace(.4, .6, 225)
+        dense = HM2018CorrelationModel()
+        local = HM2018CorrelationModel(max_neighbors=224)
+        aaae(local.apply_correlation(self.SITECOL, PGA(), residuals,
+                                     stddev_intra),
+             dense.apply_correlation(self.SITECOL, PGA(), residuals,
+                                     stddev_intra))
+
+
 class HM2018CorrelationMatrixTestCase(unittest.TestCase):
     SITECOL = SiteCollection([Site(Point(2, -40), 1, 1, 1),
                               Site(Point(2, -40.1), 1, 1, 1),
@@ -14,11 +14,13 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import unittest
+import unittest.mock as mock
 import numpy
 
 from openquake.hazardlib.geo import Point
 from openquake.hazardlib.geo.mesh import Mesh
 from openquake.hazardlib.geo import utils as geo_utils
+from openquake.hazardlib.geo.surface import planar
 from openquake.hazardlib.geo.surface.planar import PlanarSurface
 from openquake.hazardlib.tests.geo.surface import _planar_test_data as tdata
 
@@ -523,3 +525,36 @@ class PlanarSurfaceGetMiddlePointTestCase(unittest.TestCase):
         aac(midpoint.longitude, 0.0, atol=1E-4)
         aac(midpoint.latitude, 0.044966, atol=1E-4)
         aac(midpoint.depth, -4.0, atol=1E-4)
+
+
+class PlanarDistancesTestCase(unittest.TestCase):
+    def test_same_as_surface_methods(self):
+        surfaces = [
+            PlanarSurface(2, 3, *tdata.TEST_7_RUPTURE_2_CORNERS),
+            PlanarSurface(2, 3, *tdata.TEST_7_RUPTURE_6_CORNERS),
+            PlanarSurface(2, 3, *tdata.TEST_7_RUPTURE_9_CORNERS),
+            PlanarSurface.from_corner_points(
+                Point(0.0, 0.0, 0.0), Point(0.0, 0.089932, 0.0),
+                Point(0.0, 0.089932, 10.0), Point(0.0, 0.0, 10.0))]
+        hypos = [surface.get_middle_point() for surface in surfaces]
+        lons, lats = numpy.meshgrid(numpy.linspace(-0.5, 0.5, 7),
+                                    numpy.linspace(-0.5, 0.5, 7))
+        mesh = Mesh(lons.flatten(), lats.flatten())
+        arr = planar.build_planar_array(surfaces, hypos)
+        params = 'rrup rjb rx ry0 rhypo repi'.split()
+        # use blocks of a single rupture
+        with mock.patch.object(planar, 'MAX_PAIRS', len(mesh)):
+            dists = planar.get_planar_distances(arr, mesh, params)
+        for k, (surface, hypo) in enumerate(zip(surfaces, hypos)):
+            aac(dists['rrup'][k], surface.get_min_distance(mesh), atol=1E-6)
+            aac(dists['rjb'][k], surface.get_joyner_boore_distance(mesh),
+                atol=1E-6)
+            aac(dists['rx'][k], surface.get_rx_distance(mesh), atol=1E-6)
+            aac(dists['ry0'][k], surface.get_ry0_distance(mesh), atol=1E-6)
+            aac(dists['rhypo'][k], hypo.distance_to_mesh(mesh), atol=1E-6)
+            aac(dists['repi'][k], hypo.distance_to_mesh(mesh, False),
+                atol=1E-6)
+        # the same in a single block
+        for param, array in planar.get_planar_distances(
+                arr, mesh, params).items():
+            aac(array, dists[param])
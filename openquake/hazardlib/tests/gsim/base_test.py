@@ -26,7 +26,8 @@ from copy import deepcopy
 from openquake.hazardlib import const
 from openquake.hazardlib.gsim.base import (
     GMPE, CoeffsTable, SitesContext, RuptureContext,
-    NotVerifiedWarning, DeprecationWarning)
+    NotVerifiedWarning, DeprecationWarning, get_poes, _truncnorm_sf)
+from openquake.baselib.general import DictArray
 from openquake.hazardlib.geo.point import Point
 from openquake.hazardlib.imt import PGA, PGV, SA
 from openquake.hazardlib.site import Site, SiteCollection
@@ -314,6 +315,43 @@ class GsimInstantiationTestCase(unittest.TestCase):
             'the user is liable for their application')
 
 
+class GetPoesTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.RandomState(42)
+        self.loglevels = DictArray(
+            {'PGA': numpy.log([.01, .1, .2, .5]),
+             'SA(0.1)': numpy.log([.02, .2, .4])})
+        mean = rng.normal(-2, 1, size=(5, 2, 3))  # (N, M, G)
+        std = rng.uniform(.4, .8, size=(5, 2, 3))
+        self.mean_std = numpy.array([mean, std])
+
+    def loop_poes(self, truncation_level):
+        # compute the PoEs one level at the time
+        mean, std = self.mean_std
+        out = numpy.zeros((5, 7, 3))
+        lvl = 0
+        for m, imt in enumerate(self.loglevels):
+            for iml in self.loglevels[imt]:
+                if truncation_level == 0:
+                    out[:, lvl] = iml <= mean[:, m]
+                else:
+                    out[:, lvl] = (iml - mean[:, m]) / std[:, m]
+                lvl += 1
+        return _truncnorm_sf(truncation_level, out)
+
+    def test_vectorized(self):
+        for tl in (None, 0, 3):
+            poes = get_poes(self.mean_std, self.loglevels, tl)
+            self.assertEqual(poes.shape, (5, 7, 3))
+            numpy.testing.assert_allclose(poes, self.loop_poes(tl))
+
+    def test_float32(self):
+        poes = get_poes(self.mean_std, self.loglevels, 3,
+                        dtype=numpy.float32)
+        self.assertEqual(poes.dtype, numpy.float32)
+        numpy.testing.assert_allclose(poes, self.loop_poes(3), atol=1E-6)
+
+
 class CoeffsTableTestCase(unittest.TestCase):
     def setUp(self):
         self.coefficient_string = """\
@@ -16,6 +16,7 @@
 #  You should have received a copy of the GNU Affero General Public License
 #  along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
 
+import pickle
 import unittest
 import numpy
 from openquake.hazardlib.probability_map import ProbabilityMap
@@ -40,3 +41,64 @@ class ProbabilityMapTestCase(unittest.TestCase):
         # test pmap power
         pmap = pmap1 ** 2
         numpy.testing.assert_almost_equal(pmap[0].array, [[.16], [0], [0]])
+
+    def test_imul_iadd(self):
+        pmap = ProbabilityMap(2, 1)
+        pmap.imul([3, 1], numpy.full((2, 2, 1), .5))
+        pmap.imul([1, 7], numpy.full((2, 2, 1), .5))
+        self.assertEqual(pmap.keys(), [3, 1, 7])
+        numpy.testing.assert_equal(pmap.sids, [1, 3, 7])
+        numpy.testing.assert_equal(pmap.array[:, 0, 0], [.25, .5, .5])
+        pmap.iadd([7], numpy.full((1, 2, 1), .25))
+        numpy.testing.assert_equal(pmap[7].array[:, 0], [.75, .75])
+        self.assertNotIn(2, pmap)
+        self.assertNotIn(100, pmap)
+        with self.assertRaises(KeyError):
+            pmap[2]
+
+    def test_views_and_copy(self):
+        pmap = ProbabilityMap.build(2, 1, sids=[0, 1], initvalue=.1)
+        pmap[1].array[:] = .2  # the curves are views over the map
+        numpy.testing.assert_equal(pmap.array[:, 0, 0], [.1, .2])
+        copy = pmap.copy()
+        copy[1].array[:] = .3  # the copy is independent
+        numpy.testing.assert_equal(pmap[1].array[:, 0], [.2, .2])
+        numpy.testing.assert_equal((~pmap).array, 1. - pmap.array)
+
+    def test_setdefault_then_insert(self):
+        # a curve held across an insertion is detached from the map
+        pmap = ProbabilityMap(2, 1)
+        pcurve = pmap.setdefault(0, .1)
+        pmap.setdefault(1, .1)  # the underlying array grows
+        pcurve.array[:] = .5
+        numpy.testing.assert_equal(pmap[0].array[:, 0], [.1, .1])
+        pmap.setdefault(0, .1).array[:] = .5  # retrieve the curve again
+        numpy.testing.assert_equal(pmap[0].array[:, 0], [.5, .5])
+
+        # __setitem__ copies the curve
+        pmap[2] = pcurve
+        pcurve.array[:] = .7
+        numpy.testing.assert_equal(pmap[2].array[:, 0], [.5, .5])
+
+    def test_toh5(self):
+        pmap = ProbabilityMap(3, 2)
+        pmap.imul([4, 0], numpy.random.random((2, 3, 2)))
+        dic, attrs = pmap.__toh5__()
+        numpy.testing.assert_equal(dic['sids'], [0, 4])
+        new = object.__new__(ProbabilityMap)
+        new.__fromh5__(dic, attrs)
+        numpy.testing.assert_equal(new.array, pmap.array)
+
+    def test_pickle_sparse(self):
+        # the pickle size depends on the number of curves, not on the sids
+        pmap = ProbabilityMap.build(3, 1, sids=[999_998, 1_000_000],
+                                    initvalue=.1)
+        data = pickle.dumps(pmap, pickle.HIGHEST_PROTOCOL)
+        self.assertLess(len(data), 1000)
+        new = pickle.loads(data)
+        self.assertEqual(new.sids.tolist(), [999_998, 1_000_000])
+        numpy.testing.assert_equal(new.array, pmap.array)
+        self.assertNotIn(999_999, new)
+        new.setdefault(999_999, .2)  # the map works after unpickling
+        self.assertEqual(new[999_999].array[0, 0], .2)
+        self.assertEqual(new[1_000_000].array[0, 0], .1)
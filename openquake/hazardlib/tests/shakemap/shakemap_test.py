@@ -114,6 +114,41 @@ class ShakemapTestCase(unittest.TestCase):
                     trunclevel=3, num_gmfs=2, seed=42)
         self.assertIn('stddev==0 for IMT=PGA', str(ctx.exception))
 
+    def test_max_neighbors(self):
+        lons = numpy.array([84., 84., 84., 85.5, 85.5, 85.5, 87., 87., 87.])
+        lats = numpy.array([26., 27.5, 29., 26., 27.5, 29., 26., 27.5, 29.])
+        shakemap = numpy.zeros(9, shakemap_dt)  # 9 sites
+        shakemap['lon'] = lons
+        shakemap['lat'] = lats
+        shakemap['vs30'] = numpy.array([301.17] * 9)
+        shakemap['val'] = numpy.array(
+            [(5.38409665, 3.9383686, 3.55435415, 4.37692394)] * 9, imt_dt)
+        shakemap['std'] = numpy.array(
+            [(0.5, 0.52, 0.64, 0.73)] * 9, imt_dt)
+
+        # without spatial correlation the two approaches are identical
+        for crosscorr in ('no', 'yes'):
+            _, expected = to_gmfs(
+                shakemap, 'no', crosscorr, site_effects=False,
+                trunclevel=3, num_gmfs=2, seed=42)
+            _, gmfs = to_gmfs(
+                shakemap, 'no', crosscorr, site_effects=False,
+                trunclevel=3, num_gmfs=2, seed=42, max_neighbors=4)
+            aae(gmfs, expected)
+
+        # with all the neighbors the local factor is exact, so the
+        # empirical correlations are the ones of the dense approach
+        _, expected = to_gmfs(
+            shakemap, 'yes', 'yes', site_effects=False,
+            trunclevel=0, num_gmfs=20000, seed=42)
+        _, gmfs = to_gmfs(
+            shakemap, 'yes', 'yes', site_effects=False,
+            trunclevel=0, num_gmfs=20000, seed=42, max_neighbors=8)
+        logs = numpy.log(gmfs).transpose(2, 0, 1).reshape(36, -1)
+        exp_logs = numpy.log(expected).transpose(2, 0, 1).reshape(36, -1)
+        aae(logs.std(axis=1), exp_logs.std(axis=1), decimal=2)
+        aae(numpy.corrcoef(logs), numpy.corrcoef(exp_logs), decimal=1)
+
     def test_from_files(self):
         # files provided by Vitor Silva, without site amplification
         f1 = os.path.join(CDIR, 'test_shaking.xml')
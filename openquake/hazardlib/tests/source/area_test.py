@@ -14,16 +14,20 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import unittest
+import numpy
 
 from openquake.hazardlib.const import TRT
 from openquake.hazardlib.scalerel.peer import PeerMSR
 from openquake.hazardlib.mfd import TruncatedGRMFD, EvenlyDiscretizedMFD
-from openquake.hazardlib.geo import Point, Polygon, NodalPlane
+from openquake.hazardlib.geo import Point, Polygon, NodalPlane, Mesh
+from openquake.hazardlib.geo.surface.planar import get_planar_distances
 from openquake.hazardlib.pmf import PMF
 from openquake.hazardlib.tom import PoissonTOM
 from openquake.hazardlib.source.area import AreaSource
 from openquake.hazardlib.tests import assert_pickleable
 
+aac = numpy.testing.assert_allclose
+
 
 def make_area_source(polygon, discretization, **kwargs):
     default_arguments = {
@@ -100,3 +104,41 @@ class AreaSourceIterRupturesTestCase(unittest.TestCase):
         for rupture in ruptures:
             self.assertNotEqual(rupture.occurrence_rate, 3)
             self.assertEqual(rupture.occurrence_rate, 3.0 / 8.0)
+
+
+class AreaSourceGetPlanarTestCase(unittest.TestCase):
+    def test_same_as_iter_ruptures(self):
+        polygon = Polygon([Point(0, 0), Point(0, 1), Point(1, 1),
+                           Point(1, 0)])
+        npd = PMF([(.5, NodalPlane(0, 30, 90)), (.3, NodalPlane(45, 90, 0)),
+                   (.2, NodalPlane(200, 60, -45))])
+        source = make_area_source(
+            polygon, 25., nodal_plane_distribution=npd,
+            hypocenter_distribution=PMF([(.4, 2.), (.6, 9.)]))
+        mesh = Mesh(numpy.linspace(-1, 1.5, 30), numpy.linspace(1.5, -1, 30))
+        params = 'rrup rjb rx ry0 rhypo repi lon lat'.split()
+        for shift_hypo in (False, True):
+            ruptures = list(source.iter_ruptures(shift_hypo=shift_hypo))
+            planar = source.get_planar(shift_hypo)
+            self.assertEqual(len(planar), len(ruptures))
+            dists = get_planar_distances(planar, mesh, params)
+            for rup, rec, *ds in zip(ruptures, planar, *dists.values()):
+                surface = rup.surface
+                hypo = rup.hypocenter
+                self.assertEqual(rec['mag'], rup.mag)
+                self.assertEqual(rec['rake'], rup.rake)
+                self.assertAlmostEqual(rec['rate'], rup.occurrence_rate)
+                self.assertAlmostEqual(rec['width'], surface.width)
+                aac(rec['hypo'], [hypo.x, hypo.y, hypo.z])
+                aac(rec['corners'], [surface.corner_lons,
+                                     surface.corner_lats,
+                                     surface.corner_depths])
+                closest = surface.get_closest_points(mesh)
+                expected = [surface.get_min_distance(mesh),
+                            surface.get_joyner_boore_distance(mesh),
+                            surface.get_rx_distance(mesh),
+                            surface.get_ry0_distance(mesh),
+                            hypo.distance_to_mesh(mesh),
+                            hypo.distance_to_mesh(mesh, with_depths=False),
+                            closest.lons, closest.lats]
+                aac(ds, expected, atol=1E-6)
@@ -13,6 +13,7 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import pickle
 import unittest
 
 import numpy
@@ -356,3 +357,38 @@ class ModifyComplexFaultGeometryTestCase(unittest.TestCase):
                                    exp_lats_bot[iloc])
             self.assertAlmostEqual(fault.edges[1].points[iloc].depth,
                                    exp_depths_bot[iloc])
+
+    def test_placements_cache(self):
+        fault = self._make_source(self.edges)
+        placements = fault.get_placements()
+        self.assertEqual(list(placements), [7.0])
+        self.assertEqual(fault.count_ruptures(), len(placements[7.0]))
+        # the placements are cached and pickled with the source
+        self.assertIs(fault.get_placements()[7.0], placements[7.0])
+        self.assertIn(7.0, pickle.loads(pickle.dumps(fault))._placements)
+        # sources pickled before the cache existed have no _placements
+        old = pickle.loads(pickle.dumps(fault))
+        del old._placements
+        self.assertEqual(old.count_ruptures(), len(placements[7.0]))
+        # the sampler builds only the ruptures which occur
+        rates = fault.get_rupture_rates()
+        numpy.testing.assert_allclose(
+            rates, [rup.occurrence_rate for rup in fault.iter_ruptures()])
+        numpy.random.seed(42)
+        sampled = list(fault.sample_ruptures_poissonian(1))
+        numpy.random.seed(42)
+        occurs = numpy.random.poisson(rates * 50.)
+        expected = [rup for rup, occ in zip(fault.iter_ruptures(), occurs)
+                    if occ]
+        self.assertEqual(len(sampled), len(expected))
+        for (rup, num_occ), exp in zip(sampled, expected):
+            numpy.testing.assert_equal(rup.surface.mesh.lons,
+                                       exp.surface.mesh.lons)
+        # changing the geometry invalidates the cache
+        top_edge_2 = Line([Point(29.9, 30.0, 2.0), Point(31.1, 30.0, 2.1)])
+        bottom_edge_2 = Line([Point(29.6, 29.9, 29.0),
+                              Point(31.4, 29.9, 33.0)])
+        fault.modify_set_geometry([top_edge_2, bottom_edge_2], self.spacing)
+        self.assertEqual(fault._placements, {})
+        self.assertEqual(fault.count_ruptures(),
+                         len(list(fault.iter_ruptures())))
@@ -607,3 +607,17 @@ class ModifySimpleFaultTestCase(_BaseFaultSourceTestCase):
         new_fault = deepcopy(self.fault) 
         new_fault.modify_set_dip(72.0)
         self.assertAlmostEqual(new_fault.dip, 72.0)
+
+    def test_modify_set_dip_placements(self):
+        new_fault = deepcopy(self.fault)
+        num_ruptures = new_fault.count_ruptures()
+        self.assertEqual(list(new_fault._placements), [7.0])
+        new_fault.modify_set_dip(72.0)
+        self.assertEqual(new_fault._placements, {})
+        self.assertLess(new_fault.count_ruptures(), num_ruptures)
+        self.assertEqual(new_fault.count_ruptures(),
+                         len(new_fault.get_rupture_rates()))
+        # sources pickled before the cache existed have no _placements
+        del new_fault._placements
+        self.assertEqual(new_fault.count_ruptures(),
+                         len(new_fault.get_rupture_rates()))
@@ -272,3 +272,21 @@ class SourceGroupHDF5TestCase(unittest.TestCase):
             f['grp'] = grp
         with hdf5.File(f.path, 'r') as f:
             print(f['grp'])
+
+    def test_old_serialization(self):
+        # groups stored without the magnitude limits and the cluster flag
+        testfile = os.path.join(
+            testdir, 'nonparametric-source-mutex-ruptures.xml')
+        [grp] = nrml.to_python(testfile)
+        for i, src in enumerate(grp, 1):
+            src.id = i
+        with hdf5.File.temporary() as f:
+            f['grp'] = grp
+            for attr in ('min_mag', 'max_mag', 'cluster'):
+                del f.getitem('grp').attrs[attr]
+        with hdf5.File(f.path, 'r') as f:
+            new = f['grp']
+        self.assertEqual(new.min_mag, {'default': 0})
+        self.assertIsNone(new.max_mag)
+        self.assertFalse(new.cluster)
+        self.assertEqual(len(new), len(grp))
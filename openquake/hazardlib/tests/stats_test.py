@@ -124,3 +124,19 @@ class QuantileCurveTestCase(unittest.TestCase):
         actual_curve = quantile_curve(quantile, curves, weights)
 
         numpy.testing.assert_allclose(expected_curve, actual_curve)
+
+    def test_vectorized(self):
+        # compare with numpy.interp applied point by point, including
+        # ties, zero weights and quantiles outside the weights range
+        curves = numpy.random.RandomState(42).randint(0, 5, (6, 7, 3)) / 5.
+        weights = numpy.array([0.2, 0., 0.3, 0.1, 0.15, 0.25])
+        for quantile in (0., .05, .15, .5, .85, 1.):
+            expected = numpy.zeros((7, 3))
+            for idx, _ in numpy.ndenumerate(expected):
+                data = curves[(slice(None),) + idx]
+                sorted_idxs = numpy.argsort(data)
+                expected[idx] = numpy.interp(
+                    quantile, numpy.cumsum(weights[sorted_idxs]),
+                    data[sorted_idxs])
+            numpy.testing.assert_allclose(
+                quantile_curve(quantile, curves, weights), expected)
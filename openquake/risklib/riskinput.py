@@ -18,27 +18,32 @@
 
 import logging
 import numpy
+from scipy.special import ndtri
 
 from openquake.baselib import hdf5
 from openquake.baselib.general import group_array, AccumDict
 from openquake.risklib import scientific
 
 U32 = numpy.uint32
+U64 = numpy.uint64
 F32 = numpy.float32
+GOLDEN = 0x9e3779b97f4a7c15  # 2**64 / golden ratio, used in the hashing
 
 
-def get_assets_by_taxo(assets, tempname=None):
+def get_assets_by_taxo(assets, tempname=None, epsgetter=None):
     """
     :param assets: an array of assets
     :param tempname: hdf5 file where the epsilons are (or None)
-    :returns: assets_by_taxo with attributes eps and idxs
+    :param epsgetter: an EpsilonGetter generating the epsilons (or None)
+    :returns: assets_by_taxo with attributes eps, epsgetter and idxs
     """
     assets_by_taxo = AccumDict(group_array(assets, 'taxonomy'))
     assets_by_taxo.assets = assets
     assets_by_taxo.idxs = numpy.argsort(numpy.concatenate([
         a['ordinal'] for a in assets_by_taxo.values()]))
     assets_by_taxo.eps = {}
-    if tempname is None:  # no epsilons
+    assets_by_taxo.epsgetter = epsgetter
+    if tempname is None:  # no epsilons or epsilons generated on the fly
         return assets_by_taxo
     # otherwise read the epsilons and group them by taxonomy
     with hdf5.File(tempname, 'r') as h5:
@@ -81,13 +86,16 @@ def get_output(crmodel, assets_by_taxo, haz, rlzi=None):
                loss_types=crmodel.loss_types)
     if rlzi is not None:
         dic['rlzi'] = rlzi
+    eps = {}  # taxonomy -> array of shape (A, E)
+    for taxonomy, assets_ in assets_by_taxo.items():
+        if assets_by_taxo.epsgetter and len(eids):
+            eps[taxonomy] = assets_by_taxo.epsgetter(assets_['ordinal'], eids)
+        elif len(assets_by_taxo.eps):
+            eps[taxonomy] = assets_by_taxo.eps[taxonomy][:, eids]
     for l, lt in enumerate(crmodel.loss_types):
         ls = []
         for taxonomy, assets_ in assets_by_taxo.items():
-            if len(assets_by_taxo.eps):
-                epsilons = assets_by_taxo.eps[taxonomy][:, eids]
-            else:  # no CoVs
-                epsilons = ()
+            epsilons = eps.get(taxonomy, ())  # empty if there are no CoVs
             arrays = []
             rmodels, weights = crmodel.get_rmodels_weights(taxonomy)
             for rm in rmodels:
@@ -126,13 +134,17 @@ class RiskInput(object):
             aids.append(asset['ordinal'])
         self.aids = numpy.array(aids, numpy.uint32)
 
-    def gen_outputs(self, cr_model, monitor, tempname=None, haz=None):
+    def gen_outputs(self, cr_model, monitor, tempname=None, haz=None,
+                    epsgetter=None):
         """
         Group the assets per taxonomy and compute the outputs by using the
         underlying riskmodels. Yield one output per realization.
 
         :param cr_model: a CompositeRiskModel instance
         :param monitor: a monitor object used to measure the performance
+        :param tempname: hdf5 file where the epsilons are (or None)
+        :param haz: the hazard on the site (if None, read it)
+        :param epsgetter: an EpsilonGetter (or None)
         """
         self.monitor = monitor
         hazard_getter = self.hazard_getter
@@ -148,7 +160,8 @@ class RiskInput(object):
             # small arrays are passed (one per realization) instead of
             # a long array with all realizations; ebrisk does the right
             # thing since it calls get_output directly
-            assets_by_taxo = get_assets_by_taxo(self.assets, tempname)
+            assets_by_taxo = get_assets_by_taxo(
+                self.assets, tempname, epsgetter)
             for rlzi, haz_by_rlzi in items:
                 out = get_output(cr_model, assets_by_taxo, haz_by_rlzi, rlzi)
                 yield out
@@ -179,28 +192,73 @@ def make_eps(asset_array, num_samples, seed, correlation):
     return eps
 
 
+def _mix(z):
+    # splitmix64 finalizer: a bijection on uint64 with good avalanche
+    z = (z ^ (z >> U64(30))) * U64(0xbf58476d1ce4e5b9)
+    z = (z ^ (z >> U64(27))) * U64(0x94d049bb133111eb)
+    return z ^ (z >> U64(31))
+
+
+class EpsilonGetter(object):
+    """
+    Generate the epsilons of the event based calculators on demand, with
+    a counter-based random stream: the epsilon of a given asset and event
+    depends only on the master seed, the asset ordinal and the event ID,
+    so it does not depend on how the calculation is split in tasks.
+
+    :param master_seed: the master seed from the job.ini
+    :param asset_correlation: 0 (no correlation) or 1 (full correlation)
+    """
+    def __init__(self, master_seed, asset_correlation):
+        self.master_seed = master_seed
+        self.asset_correlation = asset_correlation
+
+    def __call__(self, aids, eids):
+        """
+        :param aids: A asset ordinals
+        :param eids: E event IDs
+        :returns: an array of standard normal epsilons of shape (A, E)
+        """
+        with numpy.errstate(over='ignore'):
+            seed = numpy.array([self.master_seed], U64) * U64(GOLDEN)
+            if self.asset_correlation:  # the same epsilons for all assets
+                keys = _mix(seed)
+            else:
+                keys = _mix(seed + U64(GOLDEN) * (U64(aids) + U64(1)))
+            z = _mix(keys[:, None] ^ (U64(eids) * U64(GOLDEN) + U64(1)))
+        # 53 random bits converted into a float in the open interval (0, 1)
+        eps = F32(ndtri(((z >> U64(11)) + .5) * 2. ** -53))
+        if self.asset_correlation:
+            return numpy.repeat(eps, len(aids), axis=0)
+        return eps
+
+    def __repr__(self):
+        return '<%s seed=%d, correlation=%d>' % (
+            self.__class__.__name__, self.master_seed, self.asset_correlation)
+
+
+def get_epsilon_getter(oq, crmodel):
+    """
+    :returns: None if there are no coefficients of variation or ignore_covs
+              is set, otherwise an EpsilonGetter for the event based
+              calculators
+    """
+    if oq.ignore_covs or not crmodel.covs or 'LN' not in crmodel.distributions:
+        return
+    return EpsilonGetter(oq.master_seed, oq.asset_correlation)
+
+
 def cache_epsilons(dstore, oq, assetcol, crmodel, E):
     """
     Do nothing if there are no coefficients of variation of ignore_covs is
     set. Otherwise, generate an epsilon matrix of shape (A, E) and save it
-    in the cache file, by returning the path to it.
+    in the cache file, by returning the path to it. Used in scenario_risk,
+    the event based calculators use an EpsilonGetter instead.
     """
     if oq.ignore_covs or not crmodel.covs or 'LN' not in crmodel.distributions:
         return
-    A = len(assetcol)
     logging.info('Storing the epsilon matrix in %s', dstore.tempname)
-    if oq.calculation_mode == 'scenario_risk':
-        eps = make_eps(assetcol.array, E, oq.master_seed, oq.asset_correlation)
-    else:  # event based
-        if oq.asset_correlation:
-            numpy.random.seed(oq.master_seed)
-            eps = numpy.array([numpy.random.normal(size=E)] * A)
-        else:
-            seeds = oq.master_seed + numpy.arange(E)
-            eps = numpy.zeros((A, E), F32)
-            for i, seed in enumerate(seeds):
-                numpy.random.seed(seed)
-                eps[:, i] = numpy.random.normal(size=A)
+    eps = make_eps(assetcol.array, E, oq.master_seed, oq.asset_correlation)
     with hdf5.File(dstore.tempname, 'w') as cache:
         cache['sitecol'] = dstore['sitecol']
         cache['epsilon_matrix'] = eps
@@ -31,11 +31,13 @@ import numpy
 from numpy.testing import assert_equal
 from scipy import interpolate, stats, random
 
-from openquake.baselib.general import CallableDict, cached_property
+from openquake.baselib.general import (
+    CallableDict, cached_property, fast_agg)
 from openquake.hazardlib.stats import compute_stats2
 
 F64 = numpy.float64
 F32 = numpy.float32
+U16 = numpy.uint16
 U32 = numpy.uint32
 
 
@@ -1517,23 +1519,52 @@ class LossesByAsset(object):
         Populate .losses_by_A, .losses_by_E and .alt
         """
         numlosses = numpy.zeros(2, int)
+        if tagidxs is not None:
+            # build an integer key for each distinct combination of tags
+            tags = numpy.column_stack([tagidxs[name]
+                                       for name in tagidxs.dtype.names])
+            utags, keys = numpy.unique(tags, axis=0, return_inverse=True)
+            K, E, L = len(utags), len(out.eids), len(self.loss_names)
+            kept_losses = numpy.zeros((K, E, L))
+            kept = numpy.zeros((K, E), int)
         for lni, losses in self.gen_losses(out):
             if ws is not None:  # compute avg_losses, really fast
                 aids = out.assets['ordinal']
                 self.losses_by_A[aids, lni] += losses @ ws
             self.losses_by_E[eidx, lni] += losses.sum(axis=0)
             if tagidxs is not None:
-                # this is the slow part, depending on minimum_loss
-                for a, asset in enumerate(out.assets):
-                    idx = ','.join(map(str, tagidxs[a]))
-                    kept = 0
-                    for loss, eid in zip(losses[a], out.eids):
-                        if loss >= minimum_loss[lni]:
-                            self.alt[idx][eid][lni] += loss
-                            kept += 1
-                    numlosses += numpy.array([kept, len(losses[a])])
+                # sum the losses above minimum_loss by (tag key, event)
+                ok = losses >= minimum_loss[lni]  # shape (A, E)
+                numpy.add.at(kept_losses[:, :, lni], keys,
+                             numpy.where(ok, losses, 0))
+                numpy.add.at(kept, keys, ok)
+                numlosses += [ok.sum(), losses.size]
+        if tagidxs is not None:
+            for key, tagidx in enumerate(utags):
+                ok = kept[key] > 0
+                if ok.any():
+                    idx = ','.join(map(str, tagidx))
+                    self.alt[idx].append(
+                        (out.eids[ok], kept_losses[key, ok]))
         return numlosses
 
+    def get_alt(self, idx, events):
+        """
+        :param idx: a string of comma-separated tag indices
+        :param events: an array of events sorted by ID, with fields id, rlz_id
+        :returns: an array (event_id, rlzi, loss) sorted by event ID,
+                  with the losses of .alt[idx] summed by event
+        """
+        eids, losses = zip(*self.alt[idx])
+        uniq, inv = numpy.unique(numpy.concatenate(eids), return_inverse=True)
+        L = len(self.loss_names)
+        arr = numpy.zeros(len(uniq), [('event_id', U32), ('rlzi', U16),
+                                      ('loss', (F32, (L,)))])
+        arr['event_id'] = uniq
+        arr['rlzi'] = events['rlz_id'][numpy.searchsorted(events['id'], uniq)]
+        arr['loss'] = fast_agg(inv, numpy.concatenate(losses))
+        return arr
+
 
 # ####################### Consequences ##################################### #
 
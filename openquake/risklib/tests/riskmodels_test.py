@@ -24,7 +24,7 @@ import numpy
 from numpy.testing import assert_almost_equal
 from openquake.baselib.general import gettemp
 from openquake.hazardlib import InvalidFile, nrml
-from openquake.risklib import riskmodels, nrml_examples
+from openquake.risklib import riskmodels, riskinput, nrml_examples
 from openquake.qa_tests_data.scenario_damage import case_4b
 
 FF_DIR = os.path.dirname(case_4b.__file__)
@@ -348,3 +348,28 @@ class ProbabilisticEventBasedTestCase(unittest.TestCase):
         ratios2 = rm('structural', assets, gmvs2, eids2, eps2)
         numpy.testing.assert_allclose(ratios1, self.expected_ratios[:, :2])
         numpy.testing.assert_allclose(ratios2, self.expected_ratios[:, 2:])
+
+
+class EpsilonGetterTestCase(unittest.TestCase):
+    def test_uncorrelated(self):
+        epsgetter = riskinput.EpsilonGetter(42, 0)
+        aids = numpy.arange(1000)
+        eids = numpy.arange(500)
+        eps = epsgetter(aids, eids)
+        self.assertEqual(eps.shape, (1000, 500))
+        self.assertEqual(eps.dtype, numpy.float32)
+        # standard normal numbers
+        self.assertAlmostEqual(eps.mean(), 0, delta=.01)
+        self.assertAlmostEqual(eps.std(), 1, delta=.01)
+        # the epsilons do not depend on the other assets and events
+        numpy.testing.assert_equal(
+            epsgetter(aids[[7, 3]], eids[[100, 11, 12]]),
+            eps[[7, 3]][:, [100, 11, 12]])
+        # they depend on the seed
+        eps2 = riskinput.EpsilonGetter(43, 0)(aids, eids)
+        self.assertLess(abs(numpy.corrcoef(eps.flat, eps2.flat)[0, 1]), .01)
+
+    def test_correlated(self):
+        eps = riskinput.EpsilonGetter(42, 1)(numpy.arange(3), numpy.arange(5))
+        numpy.testing.assert_equal(eps[0], eps[1])
+        numpy.testing.assert_equal(eps[0], eps[2])
@@ -20,9 +20,12 @@ import unittest
 import pickle
 
 import numpy
+from openquake.baselib import hdf5
+from openquake.baselib.general import AccumDict
 from openquake.risklib import scientific
 
 aaae = numpy.testing.assert_array_almost_equal
+F32 = numpy.float32
 
 
 class DegenerateDistributionTest(unittest.TestCase):
@@ -705,3 +708,45 @@ class ClassicalDamageTestCase(unittest.TestCase):
             fragility_functions, hazard_imls, hazard_poes,
             investigation_time, risk_investigation_time)
         aaae(poos, [0.56652127, 0.12513401, 0.1709355, 0.06555033, 0.07185889])
+
+
+class LossesByAssetTestCase(unittest.TestCase):
+    def test_aggregate(self):
+        # 4 assets with tags (1, 1), (2, 1), (1, 1), (2, 2) and 3 events
+        assets = numpy.zeros(4, [('ordinal', numpy.uint32),
+                                 ('value-structural', F32),
+                                 ('taxonomy', numpy.uint32),
+                                 ('NAME_1', numpy.uint32)])
+        assets['ordinal'] = range(4)
+        assets['value-structural'] = [100, 200, 300, 400]
+        assets['taxonomy'] = [1, 2, 1, 2]
+        assets['NAME_1'] = [1, 1, 1, 2]
+        lratios = numpy.array([[.1, .0, .3],
+                               [.2, .01, .0],
+                               [.3, .2, .1],
+                               [.0, .5, .4]], F32)
+        out = hdf5.ArrayWrapper((), dict(
+            eids=numpy.array([10, 11, 12]), assets=assets,
+            loss_types=['structural'], structural=lratios))
+        lba = scientific.LossesByAsset(assets, ['structural'])
+        lba.alt = AccumDict(accum=[])
+        lba.losses_by_E = numpy.zeros((3, 1), F32)
+        numlosses = lba.aggregate(out, numpy.arange(3), [5.],
+                                  assets[['taxonomy', 'NAME_1']], None)
+        # the losses below 5 are discarded (including the zeros)
+        numpy.testing.assert_equal(numlosses, [8, 12])
+        numpy.testing.assert_allclose(
+            lba.losses_by_E[:, 0], [140, 262, 220])
+        events = numpy.array([(10, 0), (11, 1), (12, 1)],
+                             [('id', numpy.uint32), ('rlz_id', numpy.uint16)])
+        self.assertEqual(sorted(lba.alt), ['1,1', '2,1', '2,2'])
+        alt = lba.get_alt('1,1', events)
+        numpy.testing.assert_equal(alt['event_id'], [10, 11, 12])
+        numpy.testing.assert_equal(alt['rlzi'], [0, 1, 1])
+        numpy.testing.assert_allclose(alt['loss'][:, 0], [100, 60, 60])
+        alt = lba.get_alt('2,1', events)
+        numpy.testing.assert_equal(alt['event_id'], [10])
+        numpy.testing.assert_allclose(alt['loss'][:, 0], [40])
+        alt = lba.get_alt('2,2', events)
+        numpy.testing.assert_equal(alt['event_id'], [11, 12])
+        numpy.testing.assert_allclose(alt['loss'][:, 0], [200, 160])
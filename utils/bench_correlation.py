@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright (C) 2020 GEM Foundation
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import numpy
+from openquake.baselib import sap
+from openquake.hazardlib.imt import from_string
+from openquake.hazardlib.geo.geodetic import geodetic_distance
+from openquake.hazardlib.correlation import (
+    LocalCorrelationFactor, jbcorrelation)
+
+
+@sap.script
+def bench_correlation(side=50, spacing=1., max_neighbors=20,
+                      num_samples=100, imt='SA(0.3)'):
+    """
+    Compare the dense Cholesky factor of the JB2009 correlation matrix with
+    the LocalCorrelationFactor on a grid of side x side sites, by printing
+    the build and application times and the maximum error on the
+    correlation matrix
+    """
+    imt = from_string(imt)
+    n = numpy.arange(side) * spacing / 111.  # spacing in km -> degrees
+    lons, lats = [arr.flatten() for arr in numpy.meshgrid(n, n)]
+    N = len(lons)
+    resid = numpy.random.RandomState(42).normal(size=(N, num_samples))
+    t0 = time.time()
+    corma = jbcorrelation(
+        geodetic_distance(lons[:, None], lats[:, None], lons, lats), imt)
+    dense = numpy.linalg.cholesky(corma)
+    t1 = time.time()
+    dense @ resid
+    t2 = time.time()
+    local = LocalCorrelationFactor(
+        lons, lats, lambda dists: jbcorrelation(dists, imt), max_neighbors)
+    t3 = time.time()
+    local @ resid
+    t4 = time.time()
+    lt = local @ numpy.eye(N)
+    err = numpy.abs(lt @ lt.T - corma).max()
+    print('N=%d, max_neighbors=%d, samples=%d' % (N, max_neighbors,
+                                                  num_samples))
+    print('dense: build %.2f s, apply %.3f s' % (t1 - t0, t2 - t1))
+    print('local: build %.2f s, apply %.3f s' % (t3 - t2, t4 - t3))
+    print('max error on the correlation matrix: %.4f' % err)
+
+
+bench_correlation.opt('side', 'number of sites per side of the grid',
+                      type=int)
+bench_correlation.opt('spacing', 'grid spacing in km', type=float)
+bench_correlation.opt('max_neighbors', 'number of neighbors', type=int)
+bench_correlation.opt('num_samples', 'number of samples', type=int)
+bench_correlation.opt('imt', 'intensity measure type')
+
+if __name__ == '__main__':
+    bench_correlation.callfunc()